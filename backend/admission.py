@@ -0,0 +1,181 @@
+"""
+Cost-aware admission control for the inference engines.
+Each engine has a budget of in-flight cost (roughly megapixels pushed
+through the model). Requests that fit the budget run immediately, a
+bounded number wait in FIFO order, and anything beyond is rejected with
+a Retry-After estimated from how fast the queue is currently draining.
+"""
+# Import math to round Retry-After up to whole seconds
+import math
+# Import threading to coordinate waiting requests
+import threading
+# Import time for waits and the drain rate window
+import time
+# Import deque for the FIFO queue and the completion window
+from collections import deque
+
+
+class AdmissionRejected(Exception):
+    """Raised when an engine is saturated and its queue is full."""
+
+    def __init__(self, engine, retry_after, reason='queue full'):
+        super().__init__(f"{engine} is overloaded ({reason}), retry in {retry_after}s")
+        self.engine = engine
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+# A request waiting for budget
+class _Waiter:
+    __slots__ = ('cost', 'admitted')
+
+    def __init__(self, cost):
+        self.cost = cost
+        self.admitted = False
+
+
+class AdmissionController:
+    """
+    Per-engine in-flight cost budget with a bounded FIFO wait queue.
+    A request costing more than the whole budget is admitted alone.
+    """
+
+    # engine: Engine name (used in messages and stats)
+    # budget: Maximum total cost running at the same time
+    # max_queue: Maximum number of requests waiting for budget
+    # queue_timeout: Seconds a request may wait before it is rejected
+    # window: Seconds of completions used to estimate the drain rate
+    def __init__(self, engine, budget, max_queue=16, queue_timeout=30.0, window=60.0):
+        self.engine = engine
+        self.budget = float(budget)
+        self.max_queue = max(0, int(max_queue))
+        self.queue_timeout = queue_timeout
+        self.window = window
+
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._in_flight = 0
+        self._in_flight_cost = 0.0
+        # (finished_at, cost) of recently completed requests
+        self._completed = deque()
+
+        self._admitted = 0
+        self._queued = 0
+        self._rejected = 0
+
+    # Function to run a block once the request fits the budget
+    # cost: Estimated cost of the request
+    # wait: Queue without a length limit instead of rejecting (background jobs)
+    # Usage: with controller.admit(cost): ...
+    def admit(self, cost, wait=False):
+        """Reserve budget for cost, waiting in the queue or raising AdmissionRejected."""
+        self._acquire(max(0.0, float(cost)), wait)
+        return _Admission(self, cost)
+
+    # Function returning the current Retry-After estimate in seconds
+    def retry_after(self):
+        with self._cond:
+            return self._retry_after_locked()
+
+    # Function returning budget, queue and drain rate figures
+    def stats(self):
+        with self._cond:
+            return {
+                'budget': self.budget,
+                'in_flight': self._in_flight,
+                'in_flight_cost': round(self._in_flight_cost, 3),
+                'queued': len(self._queue),
+                'queued_cost': round(sum(w.cost for w in self._queue), 3),
+                'max_queue': self.max_queue,
+                'drain_rate': round(self._drain_rate_locked(), 3),
+                'admitted': self._admitted,
+                'waited': self._queued,
+                'rejected': self._rejected,
+            }
+
+    # ---------- internals ----------
+    def _fits(self, cost):
+        # An oversized request may still run when nothing else is running
+        return self._in_flight == 0 or self._in_flight_cost + cost <= self.budget
+
+    def _acquire(self, cost, wait):
+        with self._cond:
+            if not self._queue and self._fits(cost):
+                self._start(cost)
+                return
+            if not wait and len(self._queue) >= self.max_queue:
+                self._rejected += 1
+                raise AdmissionRejected(self.engine, self._retry_after_locked())
+
+            waiter = _Waiter(cost)
+            self._queue.append(waiter)
+            self._queued += 1
+            deadline = None if wait else time.monotonic() + self.queue_timeout
+            while not waiter.admitted:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self._queue.remove(waiter)
+                    self._rejected += 1
+                    # Our departure may unblock the requests behind us
+                    self._dispatch()
+                    raise AdmissionRejected(self.engine, self._retry_after_locked(), 'queue timeout')
+                self._cond.wait(remaining)
+
+    def _release(self, cost):
+        with self._cond:
+            self._in_flight -= 1
+            self._in_flight_cost = max(0.0, self._in_flight_cost - cost)
+            self._completed.append((time.monotonic(), cost))
+            self._dispatch()
+
+    # Function admitting queued requests in FIFO order (called with the lock held)
+    def _dispatch(self):
+        admitted = False
+        while self._queue and self._fits(self._queue[0].cost):
+            waiter = self._queue.popleft()
+            self._start(waiter.cost)
+            waiter.admitted = True
+            admitted = True
+        if admitted:
+            self._cond.notify_all()
+
+    def _start(self, cost):
+        self._in_flight += 1
+        self._in_flight_cost += cost
+        self._admitted += 1
+
+    # Function returning completed cost per second over the recent window
+    def _drain_rate_locked(self):
+        now = time.monotonic()
+        while self._completed and self._completed[0][0] < now - self.window:
+            self._completed.popleft()
+        if not self._completed:
+            return 0.0
+        span = max(now - self._completed[0][0], 1.0)
+        return sum(cost for _, cost in self._completed) / span
+
+    def _retry_after_locked(self):
+        backlog = self._in_flight_cost + sum(w.cost for w in self._queue)
+        rate = self._drain_rate_locked()
+        if rate <= 0:
+            # Nothing finished recently: ask for a short pause per queued request
+            seconds = 1 + len(self._queue)
+        else:
+            seconds = backlog / rate
+        return int(min(max(math.ceil(seconds), 1), 120))
+
+
+# Context manager holding an admitted request's budget until the block exits
+class _Admission:
+    __slots__ = ('_controller', '_cost')
+
+    def __init__(self, controller, cost):
+        self._controller = controller
+        self._cost = max(0.0, float(cost))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._controller._release(self._cost)
+        return False
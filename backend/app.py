@@ -3,7 +3,7 @@
 # Handles neural style transfer and SPADE image generation requests
 
 # Import Flask for web server functionality
-from flask import Flask, request, send_file, jsonify
+from flask import Flask, request, send_file, jsonify, Response, stream_with_context
 # Import CORS to allow cross-origin requests from frontend
 from flask_cors import CORS
 # Import os for file system operations
@@ -26,9 +26,49 @@ import torch
 from torchvision import transforms
 # Import re for regular expression operations
 import re
+# Import MicroBatcher to group concurrent inference requests
+from micro_batcher import MicroBatcher
+# Import in-memory image I/O helpers and the optional disk sink
+from image_io import InMemoryRequest, DiskSink, decode_image, encode_image, image_size
+# Import Warmup to preload engines at boot and gate readiness
+from warmup import Warmup
+# Import the background job manager for the asynchronous API
+from jobs import JobManager, JobQueueFull
+# Import the content-addressed result cache
+from result_cache import ResultCache, cache_key, file_fingerprint
+# Import tempfile to place the default result cache directory
+import tempfile
+# Import the Prometheus-style metrics used by /metrics
+from metrics import REGISTRY as metrics_registry, Counter, Gauge, stage
+# Import per-engine admission control
+from admission import AdmissionController, AdmissionRejected
+# Import contextlib for the no-op admission context
+import contextlib
+# Import functools to bind job options to engine tasks
+import functools
+# Import zipfile to bundle multi-style results
+import zipfile
+# Import json to encode error parts of streamed responses
+import json
+# Import numpy for SPADE session label maps and outputs
+import numpy as np
+# Import shape bucketing for style model inputs
+from shape_buckets import ShapeBuckets
+# Import the per-session canvas state for incremental SPADE generation
+from spade_sessions import SessionStore, composite, dirty_boxes, group_boxes
+# Import the per-host settings written by autotune.py
+from perf_profile import apply_profile
+
+# Install this host's autotuned settings before any configuration is read
+# (explicit environment variables still take precedence)
+PERF_PROFILE_SETTINGS = apply_profile()
+if PERF_PROFILE_SETTINGS:
+    print(f"Applied performance profile: {', '.join(PERF_PROFILE_SETTINGS)}")
 
 # Initialize Flask application
 app = Flask(__name__)
+# Keep uploads in memory instead of spooling them to temporary files
+app.request_class = InMemoryRequest
 # Enable CORS for all routes (allows frontend to make requests)
 CORS(app)
 
@@ -60,6 +100,234 @@ DEVICE = 'cuda' if torch.cuda.is_available() else 'cpu'
 # Print device information for debugging
 print(f"Using device: {DEVICE}")
 
+# torch intra-op threads for the single-process server (0 = torch default;
+# serve.py sizes its workers' thread pools itself)
+TORCH_THREADS = int(os.environ.get('TORCH_THREADS', '0'))
+
+# Function to read a boolean switch from the environment
+def _env_flag(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+# ---------- Request I/O ----------
+# Requests are served entirely in memory; uploads are bounded by this size
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_UPLOAD_MB', '64')) * 1024 * 1024
+# Optionally keep copies of inputs/outputs on disk (written in the background)
+image_sink = DiskSink(enabled=_env_flag('PERSIST_IMAGES', False), root=BASE_DIR)
+
+# ---------- Warmup ----------
+# Preload and exercise the engines at boot; /health reports not-ready until done
+WARMUP_ENABLED = _env_flag('WARMUP', True)
+# Style models to preload (comma-separated, '*' for all, default: pinned styles)
+WARMUP_STYLES = [n.strip() for n in os.environ.get('WARMUP_STYLES', '').split(',') if n.strip()]
+# Longest image sides used for the dummy style forward passes
+WARMUP_SIZES = [int(n) for n in os.environ.get('WARMUP_SIZES', '256,512,1024').split(',') if n.strip()]
+
+# ---------- Jobs ----------
+# Background worker pool for POST /jobs
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+# Maximum number of queued or running jobs before POST /jobs is refused
+JOB_MAX_QUEUED = int(os.environ.get('JOB_MAX_QUEUED', '32'))
+# Seconds a finished job's result is kept for retrieval
+JOB_RESULT_TTL = int(os.environ.get('JOB_RESULT_TTL', '600'))
+# Finished jobs (and total MB of their results) kept before the oldest are dropped
+JOB_MAX_FINISHED = int(os.environ.get('JOB_MAX_FINISHED', '256'))
+JOB_RESULT_MAX_MB = int(os.environ.get('JOB_RESULT_MAX_MB', '256'))
+jobs = JobManager(max_workers=JOB_WORKERS, max_queued=JOB_MAX_QUEUED, result_ttl=JOB_RESULT_TTL,
+                  max_finished=JOB_MAX_FINISHED, max_result_bytes=JOB_RESULT_MAX_MB * 1024 * 1024)
+
+# ---------- Result Cache ----------
+# Generated images keyed by input bytes + engine + model + parameters, so
+# resubmissions and retries are answered without running the model again
+RESULT_CACHE_ENABLED = _env_flag('RESULT_CACHE', True)
+# On-disk store (size-bounded, least recently used files are evicted)
+RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'creativecollab-result-cache'))
+RESULT_CACHE_DISK_MB = int(os.environ.get('RESULT_CACHE_DISK_MB', '1024'))
+# In-memory tier for hot entries
+RESULT_CACHE_MEMORY_MB = int(os.environ.get('RESULT_CACHE_MEMORY_MB', '64'))
+result_cache = ResultCache(
+    directory=RESULT_CACHE_DIR,
+    max_disk_bytes=RESULT_CACHE_DISK_MB * 1024 * 1024,
+    max_memory_bytes=RESULT_CACHE_MEMORY_MB * 1024 * 1024,
+    enabled=RESULT_CACHE_ENABLED,
+)
+
+# ---------- Inference Scheduler ----------
+# Concurrent /stylize requests for the same style model are grouped by
+# resolution and run as one batched forward. A request starts at once when
+# no batch of its model and shape is running; requests arriving meanwhile
+# are collected into the next batch
+# Maximum number of images per batched forward (1 disables batching)
+STYLE_BATCH_MAX_SIZE = int(os.environ.get('STYLE_BATCH_MAX_SIZE', '4'))
+# How long (ms) a request queued behind a running batch of its group waits
+# before it runs on another dispatcher anyway
+STYLE_BATCH_WAIT_MS = float(os.environ.get('STYLE_BATCH_WAIT_MS', '10'))
+# Dispatcher threads: batches of different styles or shapes run in parallel
+STYLE_BATCH_WORKERS = int(os.environ.get('STYLE_BATCH_WORKERS', '2'))
+# Images whose sides fall in the same bucket of this many pixels share a batch.
+# The default (1) only batches identical shapes. Larger values are an opt-in:
+# smaller images are padded to the batch's largest, and the style models'
+# instance norm then computes statistics over the padding too, so an image's
+# output depends on which requests happened to share its batch
+STYLE_BATCH_SIZE_TOLERANCE = int(os.environ.get('STYLE_BATCH_SIZE_TOLERANCE', '1'))
+# Pad style inputs up to sides that are multiples of this many pixels (0 = off),
+# so the model sees a small set of shapes instead of one per upload size
+STYLE_SHAPE_BUCKET_STEP = int(os.environ.get('STYLE_SHAPE_BUCKET_STEP', '0'))
+# Concurrent /spade requests (e.g. a user drawing on the canvas) are stacked
+# into one generator forward. Label maps are all resized to the generator's
+# 512x512 input, so any of them can share a batch. The number running at once
+# is also bounded by ADMISSION_SPADE_BUDGET
+SPADE_BATCH_MAX_SIZE = int(os.environ.get('SPADE_BATCH_MAX_SIZE', '4'))
+# How long (ms) the first SPADE request waits for companions
+SPADE_BATCH_WAIT_MS = float(os.environ.get('SPADE_BATCH_WAIT_MS', '20'))
+# Tiled SPADE generation keeps the canvas' own size and aspect ratio instead
+# of squashing it to 512x512: the generator runs over overlapping 512 windows
+# whose cores are blended. Requests choose with the 'tiled' form field; this
+# is the default when the field is absent
+SPADE_TILED = _env_flag('SPADE_TILED', False)
+# Canvases are downscaled to fit this longest side in tiled mode
+SPADE_TILED_MAX_SIZE = int(os.environ.get('SPADE_TILED_MAX_SIZE', '4096'))
+# Label context (pixels) around each tile's core
+SPADE_TILE_CONTEXT = int(os.environ.get('SPADE_TILE_CONTEXT', '64'))
+# Pixels blended between neighbouring tiles
+SPADE_TILE_OVERLAP = int(os.environ.get('SPADE_TILE_OVERLAP', '32'))
+# Tiles of one request in flight at once (they share batched forwards)
+SPADE_TILE_WORKERS = int(os.environ.get('SPADE_TILE_WORKERS', str(max(1, SPADE_BATCH_MAX_SIZE))))
+# Drawing sessions: /spade requests carrying a 'session' form field keep
+# their last label map and output; the next canvas of the session only
+# regenerates the regions that changed (plus SPADE_SESSION_MARGIN) and
+# blends them into the previous output. A canvas that is unchanged is
+# answered from the session without running the generator
+SPADE_SESSIONS_ENABLED = _env_flag('SPADE_SESSIONS', True)
+# Memory for session label maps and outputs (least recently used are dropped)
+SPADE_SESSION_MAX_MB = int(os.environ.get('SPADE_SESSION_MAX_MB', '256'))
+# Seconds an idle session is kept
+SPADE_SESSION_TTL = float(os.environ.get('SPADE_SESSION_TTL', '900'))
+# Pixels regenerated around each change (the blend happens inside this margin)
+SPADE_SESSION_MARGIN = int(os.environ.get('SPADE_SESSION_MARGIN', '32'))
+# Regenerate everything once the changed regions cover this fraction of the canvas
+SPADE_SESSION_FULL_FRACTION = float(os.environ.get('SPADE_SESSION_FULL_FRACTION', '0.5'))
+# Label-map cache: SPADE outputs are also cached under a hash of the label
+# map the generator sees (after color conversion and resizing), so uploads
+# that differ only in their PNG encoding or in antialiasing noise absorbed
+# by the color tolerance reuse the output (same memory and disk tiers)
+SPADE_LABEL_CACHE = _env_flag('SPADE_LABEL_CACHE', True)
+# ---------- Video ----------
+# Longest side of stylized video frames (frames are downscaled to it)
+STYLE_VIDEO_MAX_SIZE = int(os.environ.get('STYLE_VIDEO_MAX_SIZE', '720'))
+# Frames per forward pass
+STYLE_VIDEO_BATCH = int(os.environ.get('STYLE_VIDEO_BATCH', '4'))
+# Decoded frames buffered ahead of inference (bounds memory per video)
+STYLE_VIDEO_QUEUE_FRAMES = int(os.environ.get('STYLE_VIDEO_QUEUE_FRAMES', '16'))
+# Frames stylized per clip at most (0 = whole clip)
+STYLE_VIDEO_MAX_FRAMES = int(os.environ.get('STYLE_VIDEO_MAX_FRAMES', '0'))
+# ---------- Progressive Preview ----------
+# Longest side of the quick preview streamed before the full result
+STYLE_PREVIEW_SIZE = int(os.environ.get('STYLE_PREVIEW_SIZE', '256'))
+# JPEG quality of the preview
+STYLE_PREVIEW_QUALITY = int(os.environ.get('STYLE_PREVIEW_QUALITY', '85'))
+# Maximum number of styles in one POST /stylize/multi request
+STYLE_MULTI_MAX_STYLES = int(os.environ.get('STYLE_MULTI_MAX_STYLES', '8'))
+
+# ---------- Tiled Inference ----------
+# Images up to STYLE_MAX_SIZE run through the model in one piece. Larger images
+# are stylized at full resolution (up to STYLE_TILED_MAX_SIZE) tile by tile, so
+# peak memory is bounded by the tile size and worker count, not the image size
+STYLE_MAX_SIZE = int(os.environ.get('STYLE_MAX_SIZE', '1024'))
+# Enable tiled full-resolution mode for large images
+STYLE_TILING_ENABLED = _env_flag('STYLE_TILING', True)
+# Longest side accepted in tiled mode (larger images are downscaled to it)
+STYLE_TILED_MAX_SIZE = int(os.environ.get('STYLE_TILED_MAX_SIZE', '8192'))
+# Window fed to the model per tile, including context on both sides
+STYLE_TILE_SIZE = int(os.environ.get('STYLE_TILE_SIZE', '512'))
+# Reflection context around each tile (covers TransformerNet's ~54px receptive field)
+STYLE_TILE_CONTEXT = int(os.environ.get('STYLE_TILE_CONTEXT', '64'))
+# Overlap between neighbouring tiles that is feather-blended
+STYLE_TILE_OVERLAP = int(os.environ.get('STYLE_TILE_OVERLAP', '32'))
+# Number of tiles processed in parallel
+STYLE_TILE_WORKERS = int(os.environ.get('STYLE_TILE_WORKERS', str(min(4, os.cpu_count() or 1))))
+
+# ---------- Inference Build ----------
+# Prefer the fused, frozen TorchScript artifact (saved_models/<style>.frozen.pt,
+# built by neural_style/inference_build.py) over the eager checkpoint
+STYLE_FROZEN_ENABLED = _env_flag('STYLE_FROZEN', True)
+# Build and save the artifact on first load when it is missing or stale
+STYLE_FROZEN_AUTOBUILD = _env_flag('STYLE_FROZEN_AUTOBUILD', False)
+
+# ---------- Memory-Mapped Weights ----------
+# Build eager models on the mapped saved_models/<style>.safetensors (written by
+# neural_style/mmap_weights.py) instead of unpickling the checkpoint
+STYLE_MMAP_ENABLED = _env_flag('STYLE_MMAP', True)
+# Write the weights file on first load when it is missing or stale
+STYLE_MMAP_AUTOCONVERT = _env_flag('STYLE_MMAP_AUTOCONVERT', True)
+
+# ---------- bfloat16 CPU Execution ----------
+# Run eager style models in channels_last under CPU autocast (bfloat16) on
+# CPUs with AVX512-BF16/AMX. Each model is validated against its fp32 output
+# when loaded and stays in fp32 if it falls below STYLE_BF16_MIN_PSNR or the
+# CPU has no bf16 kernels. Replaces the frozen fp32 artifact when enabled
+STYLE_BF16 = _env_flag('STYLE_BF16', False)
+# Minimum PSNR (dB) of the bf16 output against fp32
+STYLE_BF16_MIN_PSNR = float(os.environ.get('STYLE_BF16_MIN_PSNR', '40'))
+
+# ---------- Quantized Inference ----------
+# Default precision for /stylize (fp32 or int8); requests may override it with
+# the 'precision' form field. int8 uses saved_models/<style>.int8.pt (built by
+# neural_style/quantize.py, only for styles that passed its quality check) and
+# falls back to fp32 when there is no artifact, on GPU and for tiled images
+STYLE_PRECISIONS = ('fp32', 'int8')
+STYLE_PRECISION = os.environ.get('STYLE_PRECISION', 'fp32').strip().lower()
+if STYLE_PRECISION not in STYLE_PRECISIONS:
+    print(f" Unknown STYLE_PRECISION '{STYLE_PRECISION}', using fp32")
+    STYLE_PRECISION = 'fp32'
+
+# ---------- ONNX Runtime Backend ----------
+# Execution backend for fp32 style models: torch or onnxruntime. The ORT backend
+# exports saved_models/<style>.onnx from the checkpoint on first use (when
+# STYLE_ORT_AUTOEXPORT is on) and keeps one session per style in the model cache
+STYLE_BACKENDS = ('torch', 'onnxruntime')
+STYLE_BACKEND = os.environ.get('STYLE_BACKEND', 'torch').strip().lower()
+if STYLE_BACKEND == 'ort':
+    STYLE_BACKEND = 'onnxruntime'
+if STYLE_BACKEND not in STYLE_BACKENDS:
+    print(f" Unknown STYLE_BACKEND '{STYLE_BACKEND}', using torch")
+    STYLE_BACKEND = 'torch'
+# Threads inside one operator (0 = same as torch, i.e. the worker's thread budget)
+STYLE_ORT_INTRA_THREADS = int(os.environ.get('STYLE_ORT_INTRA_THREADS', '0'))
+# Threads running independent operators (the network is sequential)
+STYLE_ORT_INTER_THREADS = int(os.environ.get('STYLE_ORT_INTER_THREADS', '1'))
+# Export the .onnx from the .pth when it is missing or stale
+STYLE_ORT_AUTOEXPORT = _env_flag('STYLE_ORT_AUTOEXPORT', True)
+
+# ---------- Admission Control ----------
+# Each engine runs at most a budget of estimated cost at once (megapixels
+# pushed through the model). A bounded number of requests wait in FIFO
+# order; beyond that the request is refused with 429 and a Retry-After
+# derived from the queue drain rate, so latency stays stable under bursts
+ADMISSION_ENABLED = _env_flag('ADMISSION', True)
+# Requests allowed to wait per engine once its budget is used up
+ADMISSION_MAX_QUEUE = int(os.environ.get('ADMISSION_MAX_QUEUE', '16'))
+# Seconds a request may wait for budget before it is refused
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', '30'))
+# In-flight cost budget per inference path (megapixels)
+ADMISSION_BUDGETS = {
+    'stylize': float(os.environ.get('ADMISSION_STYLE_BUDGET', '4')),
+    'spade': float(os.environ.get('ADMISSION_SPADE_BUDGET', '1')),
+    'enhance_esrgan': float(os.environ.get('ADMISSION_ESRGAN_BUDGET', '16')),
+    'enhance_simple': float(os.environ.get('ADMISSION_SIMPLE_BUDGET', '64')),
+    # Videos cost 1 each: this is the number of clips stylized at the same time
+    'stylize_video': float(os.environ.get('ADMISSION_VIDEO_BUDGET', '1')),
+}
+# Cost assumed when an upload's dimensions cannot be read
+ADMISSION_DEFAULT_COST = 1.0
+admission = {
+    engine: AdmissionController(engine, budget, max_queue=ADMISSION_MAX_QUEUE,
+                                queue_timeout=ADMISSION_QUEUE_TIMEOUT)
+    for engine, budget in ADMISSION_BUDGETS.items()
+}
+
 # ---------- Import SPADE ----------
 # Try to import SPADE handler for image generation from segmentation maps
 try:
@@ -67,8 +335,17 @@ try:
     spade_handler_path = os.path.join(BASE_DIR, 'spade_handler.py')
     # Check if handler file exists
     if os.path.exists(spade_handler_path):
-        # Import generate_image function from SPADE handler
-        from spade_handler import generate_image
+        # Import SPADE generation functions (file-based and in-memory)
+        from spade_handler import generate_image, generate_image_pil, load_spade_model
+        from spade_handler import generate_tensors as generate_spade_tensors
+        from spade_handler import generate_tiled as generate_spade_tiled
+        from spade_handler import generate_region as generate_spade_region
+        from spade_handler import label_tensor_from_array as spade_label_tensor_from_array
+        from spade_handler import label_array_from_image as spade_label_array
+        from spade_handler import tensor_to_image as spade_tensor_to_image
+        from spade_handler import CHECKPOINT_PATH as SPADE_CHECKPOINT_PATH
+        from spade_handler import GENERATION_SEED as SPADE_SEED
+        from spade_handler import spade_model_loaded
         # Mark SPADE as available
         SPADE_AVAILABLE = True
         print(" SPADE loaded successfully")
@@ -76,6 +353,25 @@ except Exception as e:
     # Print error if SPADE cannot be loaded (non-critical)
     print(f" SPADE not available: {e}")
 
+# ---------- Import Real-ESRGAN ----------
+# Optional learned upscaler used by /enhance when a target height is requested
+ESRGAN_AVAILABLE = False
+try:
+    from enhance_image import enhance_bytes, get_enhancer, enhancer_loaded
+    from enhance_image import MODEL_NAME as ESRGAN_MODEL_NAME
+    ESRGAN_AVAILABLE = True
+except Exception as e:
+    print(f" Real-ESRGAN not available: {e}")
+
+# ---------- Import Tiled Inference ----------
+# Tiled engine used for images larger than STYLE_MAX_SIZE
+TILING_AVAILABLE = False
+try:
+    from tiled_inference import stylize_tiled
+    TILING_AVAILABLE = True
+except Exception as e:
+    print(f" Tiled inference not available: {e}")
+
 # ---------- Import Neural Style ----------
 # Try to import Neural Style Transfer module
 try:
@@ -98,77 +394,305 @@ except Exception as e:
     print(f" Neural Style not available: {e}")
     traceback.print_exc()
 
+# ---------- Import Video Pipeline ----------
+# Optional video stylization (needs OpenCV)
+VIDEO_AVAILABLE = False
+try:
+    from video_pipeline import stylize_video
+    VIDEO_AVAILABLE = True
+except Exception as e:
+    print(f" Video stylization not available: {e}")
+
+# ---------- Import Inference Build ----------
+# Optional fused/frozen TorchScript artifacts for style models
+INFERENCE_BUILD_AVAILABLE = False
+try:
+    from inference_build import load_inference_model, save_inference_artifact
+    INFERENCE_BUILD_AVAILABLE = True
+except Exception as e:
+    print(f" Inference build not available: {e}")
+
+# ---------- Import Memory-Mapped Weights ----------
+# Optional zero-copy weight files for style models
+MMAP_WEIGHTS_AVAILABLE = False
+try:
+    from mmap_weights import convert_checkpoint, load_mmap_model
+    MMAP_WEIGHTS_AVAILABLE = True
+except Exception as e:
+    print(f" Memory-mapped weights not available: {e}")
+
+# ---------- Import Mixed Precision ----------
+# Optional bfloat16 execution for style models
+MIXED_PRECISION_AVAILABLE = False
+try:
+    from mixed_precision import enable_bf16, forward as bf16_forward
+    MIXED_PRECISION_AVAILABLE = True
+except Exception as e:
+    print(f" bfloat16 execution not available: {e}")
+
+# ---------- Import Quantization ----------
+# Optional INT8 style models
+QUANTIZE_AVAILABLE = False
+try:
+    from quantize import load_quantized_model
+    from quantize import artifact_path as int8_artifact_path
+    QUANTIZE_AVAILABLE = True
+except Exception as e:
+    print(f" INT8 style models not available: {e}")
+
+# ---------- Import ONNX Runtime ----------
+# Optional ONNX Runtime backend for style models
+ORT_AVAILABLE = False
+try:
+    from ort_backend import load_ort_model, onnx_path
+    ORT_AVAILABLE = True
+except Exception as e:
+    print(f" ONNX Runtime backend not available: {e}")
+
 # ---------- Model Cache ----------
-# Dictionary to cache loaded models (key: model path, value: model instance)
-# Prevents reloading same model multiple times, improving performance
-_model_cache = {}
+# Shared LRU cache of loaded style models (key: model path, value: model instance)
+# Bounded by STYLE_CACHE_MAX_MB; each model is loaded only once even when
+# several requests ask for it at the same time
+from model_cache import style_model_cache as _model_cache
+# Style names that are pinned in the cache and never evicted (comma-separated)
+STYLE_CACHE_PINNED = [n.strip() for n in os.environ.get('STYLE_CACHE_PINNED', '').split(',') if n.strip()]
 
 # ---------- Helper Functions ----------
-# Function to load a style transfer model from disk with proper error handling
+# Directory containing the trained style models
+def _style_models_dir():
+    return os.path.join(NEURAL_STYLE_DIR, 'saved_models')
+
+# Function to find the checkpoint file for a style name
+# style_name: Name of the style (file name without extension)
+# Returns: Path to the .pth or .model checkpoint, or None if not found
+def find_style_model(style_name: str):
+    """Resolve a style name to its checkpoint path"""
+    # Try .pth extension first, then .model as fallback
+    for ext in ('.pth', '.model'):
+        model_path = os.path.join(_style_models_dir(), f'{style_name}{ext}')
+        if os.path.exists(model_path):
+            return model_path
+    return None
+
+# Function to list the available style names
+def list_style_names():
+    models_dir = _style_models_dir()
+    if not os.path.exists(models_dir):
+        return []
+    return [f.replace('.pth', '').replace('.model', '')
+            for f in os.listdir(models_dir)
+            if f.endswith(('.pth', '.model'))]
+
+# Function to turn a cache key (model path) into a display name
+def _cache_label(key):
+    return os.path.splitext(os.path.basename(key))[0]
+
+# Function to load a style transfer model through the shared model cache
 # model_path: Path to the saved model checkpoint file (.pth or .model)
 # device: Target device for model (GPU/CPU)
 # Returns: Loaded TransformerNet model instance
 def load_style_model(model_path: str, device: str = DEVICE):
+    """Load a style transfer model, reusing the cached instance when resident"""
+    # Pinned styles are never evicted from the cache
+    pin = _cache_label(model_path) in STYLE_CACHE_PINNED
+    return _model_cache.get_or_load(
+        model_path,
+        lambda: _read_style_model(model_path, device),
+        pin=pin,
+    )
+
+# Style model variants (INT8 artifacts, ONNX sessions) that could not be
+# loaded: cache key -> fingerprints of the checkpoint and artifact it failed for
+_style_variant_failures = {}
+
+# Function to load a variant of a style model through the shared model cache
+# key: Cache key of the variant (its artifact path)
+# loader: Callable returning the variant, or None if it is unavailable
+# Returns: The variant, or None (never cached, so nothing else is served under its key)
+def _load_style_variant(model_path, key, loader):
+    fingerprint = (file_fingerprint(model_path), file_fingerprint(key))
+    # Do not retry a failed export or a stale artifact until one of the files changes
+    if _style_variant_failures.get(key) == fingerprint:
+        return None
+
+    def load():
+        model = loader()
+        if model is None:
+            raise LookupError(f"{os.path.basename(key)} is not available")
+        return model
+
+    pin = _cache_label(model_path) in STYLE_CACHE_PINNED
+    try:
+        model = _model_cache.get_or_load(key, load, pin=pin)
+    except LookupError as e:
+        print(f" {e}")
+        _style_variant_failures[key] = fingerprint
+        return None
+    _style_variant_failures.pop(key, None)
+    return model
+
+# Function to load the INT8 version of a style model through the shared model cache
+# model_path: Path to the fp32 checkpoint; the artifact is cached under its own path
+# Returns: Quantized model (CPU), or None if the artifact is missing or stale
+def load_int8_style_model(model_path: str):
+    """Load a style's INT8 artifact, reusing the cached instance when resident"""
+    return _load_style_variant(model_path, int8_artifact_path(model_path),
+                               lambda: load_quantized_model(model_path))
+
+# Function to load the ONNX Runtime session of a style model through the shared model cache
+# model_path: Path to the checkpoint; the session is cached under the .onnx path
+# Returns: OrtStyleModel, or None if no ONNX model could be loaded or exported
+def load_ort_style_model(model_path: str):
+    """Load a style's ONNX Runtime session, reusing the cached one when resident"""
+    intra = STYLE_ORT_INTRA_THREADS or torch.get_num_threads()
+    return _load_style_variant(
+        model_path,
+        onnx_path(model_path),
+        lambda: load_ort_model(model_path, intra, STYLE_ORT_INTER_THREADS, STYLE_ORT_AUTOEXPORT),
+    )
+
+# Function to decide the backend an fp32 style transfer runs on
+# model_path: Checkpoint of the requested style
+# size: (width, height) of the upload, or None if unknown
+# Returns: 'onnxruntime' when configured and usable for the image, otherwise 'torch'
+def style_backend(model_path, size):
+    if STYLE_BACKEND != 'onnxruntime' or not ORT_AVAILABLE or DEVICE != 'cpu':
+        return 'torch'
+    if not STYLE_ORT_AUTOEXPORT and not os.path.exists(onnx_path(model_path)):
+        return 'torch'
+    # Tiled inference needs the torch model's layers for its global statistics pass
+    if size is not None and TILING_AVAILABLE and STYLE_TILING_ENABLED and max(size) > STYLE_MAX_SIZE:
+        return 'torch'
+    # A failed export is reported as torch, in the response header and the cache key alike
+    if load_ort_style_model(model_path) is None:
+        return 'torch'
+    return 'onnxruntime'
+
+# Function to decide the precision a style transfer actually runs in
+# model_path: Checkpoint of the requested style
+# requested: 'fp32' or 'int8'
+# size: (width, height) of the upload, or None if unknown
+# Returns: 'int8' when an INT8 artifact can serve the image, otherwise 'fp32'
+def style_precision(model_path, requested, size):
+    if requested != 'int8' or not QUANTIZE_AVAILABLE or DEVICE != 'cpu':
+        return 'fp32'
+    if not os.path.exists(int8_artifact_path(model_path)):
+        return 'fp32'
+    # Tiled inference needs the fp32 model's global statistics pass
+    if size is not None and TILING_AVAILABLE and STYLE_TILING_ENABLED and max(size) > STYLE_MAX_SIZE:
+        return 'fp32'
+    # A stale artifact is reported as fp32, in the response header and the cache key alike
+    if load_int8_style_model(model_path) is None:
+        return 'fp32'
+    return 'int8'
+
+# Function to load the style model variant a request runs on
+# precision, backend: As chosen by style_precision() and style_backend()
+def load_style_for(model_path, precision, backend):
+    if precision == 'int8':
+        return load_int8_style_model(model_path)
+    if backend == 'onnxruntime':
+        return load_ort_style_model(model_path)
+    return load_style_model(model_path, DEVICE)
+
+# Function to read a style transfer model from disk with proper error handling
+# model_path: Path to the saved model checkpoint file (.pth or .model)
+# device: Target device for model (GPU/CPU)
+# Returns: Loaded TransformerNet model instance
+def _read_style_model(model_path: str, device: str = DEVICE):
     """Load a style transfer model with proper state dict handling"""
     
-    # Check cache first to avoid reloading same model
-    if model_path in _model_cache:
-        print(f" Using cached model: {os.path.basename(model_path)}")
-        return _model_cache[model_path]
-    
     # Print loading message
     print(f"Loading model: {os.path.basename(model_path)}")
     
+    # bfloat16 mode converts the eager model, so it replaces the frozen artifact
+    use_bf16 = STYLE_BF16 and MIXED_PRECISION_AVAILABLE and device == 'cpu'
+    # Prefer the frozen inference artifact when it matches this checkpoint
+    use_artifact = STYLE_FROZEN_ENABLED and INFERENCE_BUILD_AVAILABLE and not use_bf16
+    use_mmap = STYLE_MMAP_ENABLED and MMAP_WEIGHTS_AVAILABLE
+    if use_artifact:
+        model = load_inference_model(model_path, device)
+        if model is not None:
+            print(f" Inference artifact loaded successfully")
+            return model
+    
     try:
-        # Load checkpoint file from disk, map to target device
-        checkpoint = torch.load(model_path, map_location=device)
+        # Map the converted weights file when it matches the checkpoint: no
+        # unpickling or copying, and the pages are shared between processes
+        model = load_mmap_model(model_path, device) if use_mmap else None
+        if model is not None:
+            print(f" Mapped weights loaded successfully")
+        else:
+            # Load checkpoint file from disk, map to target device
+            checkpoint = torch.load(model_path, map_location=device)
         
-        # Extract state dict from various checkpoint formats
-        # Some checkpoints wrap state_dict in a dictionary
-        if isinstance(checkpoint, dict):
-            # Check for common wrapper keys
-            if 'state_dict' in checkpoint:
-                state_dict = checkpoint['state_dict']
-            elif 'model' in checkpoint:
-                state_dict = checkpoint['model']
+            # Extract state dict from various checkpoint formats
+            # Some checkpoints wrap state_dict in a dictionary
+            if isinstance(checkpoint, dict):
+                # Check for common wrapper keys
+                if 'state_dict' in checkpoint:
+                    state_dict = checkpoint['state_dict']
+                elif 'model' in checkpoint:
+                    state_dict = checkpoint['model']
+                else:
+                    # Assume entire dict is state_dict
+                    state_dict = checkpoint
             else:
-                # Assume entire dict is state_dict
+                # Checkpoint is already state_dict
                 state_dict = checkpoint
-        else:
-            # Checkpoint is already state_dict
-            state_dict = checkpoint
         
-        # Remove 'module.' prefix from DataParallel models
-        # Models trained with DataParallel have 'module.' prefix on all keys
-        cleaned_state = {}
-        for k, v in state_dict.items():
-            # Remove prefix if present
-            new_key = k.replace('module.', '') if k.startswith('module.') else k
-            cleaned_state[new_key] = v
+            # Remove 'module.' prefix from DataParallel models
+            # Models trained with DataParallel have 'module.' prefix on all keys
+            cleaned_state = {}
+            for k, v in state_dict.items():
+                # Remove prefix if present
+                new_key = k.replace('module.', '') if k.startswith('module.') else k
+                cleaned_state[new_key] = v
         
-        # Remove deprecated InstanceNorm running_mean/var buffers
-        # These cause errors in newer PyTorch versions
-        keys_to_remove = [
-            k for k in cleaned_state.keys() 
-            if re.search(r'in\d+\.running_(mean|var)$', k) or 
-               'running_mean' in k or 'running_var' in k
-        ]
-        # Delete deprecated keys
-        for k in keys_to_remove:
-            del cleaned_state[k]
+            # Remove deprecated InstanceNorm running_mean/var buffers
+            # These cause errors in newer PyTorch versions
+            keys_to_remove = [
+                k for k in cleaned_state.keys() 
+                if re.search(r'in\d+\.running_(mean|var)$', k) or 
+                   'running_mean' in k or 'running_var' in k
+            ]
+            # Delete deprecated keys
+            for k in keys_to_remove:
+                del cleaned_state[k]
+        
+            # Create model instance and load weights
+            model = TransformerNet()
+            # Load state dict (strict=False allows missing keys)
+            model.load_state_dict(cleaned_state, strict=False)
+            # Move model to target device
+            model.to(device)
+            # Set to evaluation mode (disables dropout, batch norm updates)
+            model.eval()
+        
+            print(f" Model loaded successfully")
+
+            # Convert now so the next cold load can map the weights
+            if use_mmap and STYLE_MMAP_AUTOCONVERT:
+                try:
+                    convert_checkpoint(model_path, model)
+                except Exception as e:
+                    print(f" Weights conversion failed: {e}")
         
-        # Create model instance and load weights
-        model = TransformerNet()
-        # Load state dict (strict=False allows missing keys)
-        model.load_state_dict(cleaned_state, strict=False)
-        # Move model to target device
-        model.to(device)
-        # Set to evaluation mode (disables dropout, batch norm updates)
-        model.eval()
+        # Switch to channels_last/bfloat16 if it matches the fp32 output closely enough
+        if use_bf16:
+            score = enable_bf16(model, STYLE_BF16_MIN_PSNR)
+            if score is None:
+                print(f" bfloat16 rejected (no CPU support or below {STYLE_BF16_MIN_PSNR} dB), using fp32")
+            else:
+                print(f" bfloat16 enabled (PSNR vs fp32: {score:.1f} dB)")
         
-        # Cache the model for future use
-        _model_cache[model_path] = model
-        print(f" Model loaded and cached successfully")
+        # Optionally build the artifact now so the next load can use it
+        if use_artifact and STYLE_FROZEN_AUTOBUILD:
+            try:
+                save_inference_artifact(model, model_path)
+                return load_inference_model(model_path, device) or model
+            except Exception as e:
+                print(f" Inference build failed, using eager model: {e}")
         
         return model
         
@@ -178,31 +702,36 @@ def load_style_model(model_path: str, device: str = DEVICE):
         traceback.print_exc()
         raise
 
-# Function to apply style transfer to an image using a loaded model
+# Function to apply style transfer to an in-memory image using a loaded model
 # model: Pre-loaded TransformerNet model instance
-# image_path: Path to input content image file
-# output_path: Path where stylized output will be saved
+# image: Input PIL Image (RGB)
 # device: Computation device (GPU/CPU)
-# Returns: Path to saved output image
+# progress: Optional callback(done, total) reporting tiles completed
+# Returns: Stylized PIL Image
+def stylize_pil(model, image, device: str = DEVICE, progress=None):
+    """Apply style transfer to a PIL image and return the stylized PIL image"""
+    return stylize_pil_multi([model], image, device, progress)[0]
 
-def stylize_image(model, image_path: str, output_path: str, device: str = DEVICE):
-    """Apply style transfer to an image"""
-    
-    # Print processing message
-    print(f" Stylizing image: {os.path.basename(image_path)}")
+# Function to apply several style models to one in-memory image
+# models: Pre-loaded style models, applied one after another
+# image: Input PIL Image (RGB), resized and converted to a tensor only once
+# device: Computation device (GPU/CPU)
+# progress: Optional callback(done, total) reporting tiles completed over all models
+# Returns: List of stylized PIL Images, in the order of models
+def stylize_pil_multi(models, image, device: str = DEVICE, progress=None):
+    """Apply each style model to a PIL image and return the stylized PIL images"""
     
     try:
-        # Load and preprocess image
-        # Open image and convert to RGB (handles RGBA, grayscale, etc.)
-        image = Image.open(image_path).convert('RGB')
         # Store original dimensions
         original_size = image.size
         print(f"   Original size: {original_size}")
         
         # Resize if too large (preserve aspect ratio)
-        # Large images consume too much memory and are slow to process
-        max_size = 1024
+        # Large images consume too much memory and are slow to process,
+        # unless tiled mode is available to process them at full resolution
         w, h = image.size
+        tiled = TILING_AVAILABLE and STYLE_TILING_ENABLED and max(w, h) > STYLE_MAX_SIZE
+        max_size = STYLE_TILED_MAX_SIZE if tiled else STYLE_MAX_SIZE
         if max(w, h) > max_size:
             # Calculate new dimensions maintaining aspect ratio
             if w > h:
@@ -214,7 +743,8 @@ def stylize_image(model, image_path: str, output_path: str, device: str = DEVICE
                 new_h = max_size
                 new_w = int(w * max_size / h)
             # Resize using high-quality LANCZOS resampling
-            image = image.resize((new_w, new_h), Image.LANCZOS)
+            with stage('stylize', 'resize'):
+                image = image.resize((new_w, new_h), Image.LANCZOS)
             print(f"   Resized to: {image.size}")
         
         # Convert to tensor (multiply by 255 as expected by the model)
@@ -225,32 +755,52 @@ def stylize_image(model, image_path: str, output_path: str, device: str = DEVICE
         ])
         
         # Apply transform and add batch dimension, move to device
-        content_tensor = transform(image).unsqueeze(0).to(device)
+        with stage('stylize', 'to_tensor'):
+            content_tensor = transform(image).unsqueeze(0).to(device)
         print(f"   Tensor: {content_tensor.shape} on {content_tensor.device}")
         
-        # Apply style transfer
-        print(f" Applying style transfer...")
-        # Disable gradient computation for inference (saves memory)
-        with torch.no_grad():
-            # Forward pass through model
-            output_tensor = model(content_tensor)
-        
-        print(f"   Output: {output_tensor.shape}")
-        
-        # Convert back to image
-        # Remove batch dimension and move to CPU
-        output_tensor = output_tensor.squeeze(0).cpu().clamp(0, 255)
-        # Normalize back to [0, 1] range for PIL conversion
-        output_tensor = output_tensor.div(255)
-        
-        # Convert tensor to PIL Image
-        output_image = transforms.ToPILImage()(output_tensor)
+        output_images = []
+        for index, model in enumerate(models):
+            # Tile progress of this model, offset by the models already done
+            model_progress = None
+            if progress is not None:
+                model_progress = (lambda done, total, index=index:
+                                  progress(index * total + done, len(models) * total))
+            
+            # Apply style transfer
+            with stage('stylize', 'forward'):
+                if tiled:
+                    # Large image: bounded-memory tiled pass at full resolution
+                    print(f" Applying tiled style transfer (tile={STYLE_TILE_SIZE}, workers={STYLE_TILE_WORKERS})...")
+                    output_tensor = stylize_tiled(
+                        model, content_tensor,
+                        tile_size=STYLE_TILE_SIZE,
+                        context=STYLE_TILE_CONTEXT,
+                        overlap=STYLE_TILE_OVERLAP,
+                        workers=STYLE_TILE_WORKERS,
+                        stats_size=STYLE_MAX_SIZE,
+                        progress=model_progress,
+                    )
+                else:
+                    # Batched with concurrent requests for the same model
+                    print(f" Applying style transfer...")
+                    output_tensor = style_forward(model, content_tensor)
+            
+            print(f"   Output: {output_tensor.shape}")
         
-        # Save with high quality JPEG
-        output_image.save(output_path, 'JPEG', quality=95)
-        print(f"    Saved: {os.path.basename(output_path)}")
+            # Convert back to image
+            with stage('stylize', 'convert'):
+                # Remove batch dimension and move to CPU
+                output_tensor = output_tensor.squeeze(0).cpu().clamp(0, 255)
+                # Normalize back to [0, 1] range for PIL conversion
+                output_tensor = output_tensor.div(255)
+                
+                # Convert tensor to PIL Image
+                output_image = transforms.ToPILImage()(output_tensor)
+            
+            output_images.append(output_image)
         
-        return output_path
+        return output_images
         
     except Exception as e:
         # Print error and traceback if stylization fails
@@ -258,6 +808,315 @@ def stylize_image(model, image_path: str, output_path: str, device: str = DEVICE
         traceback.print_exc()
         raise
 
+# Function to apply style transfer to an image file using a loaded model
+# model: Pre-loaded TransformerNet model instance
+# image_path: Path to input content image file
+# output_path: Path where stylized output will be saved
+# device: Computation device (GPU/CPU)
+# Returns: Path to saved output image
+def stylize_image(model, image_path: str, output_path: str, device: str = DEVICE):
+    """Apply style transfer to an image file and save the result"""
+    
+    # Print processing message
+    print(f" Stylizing image: {os.path.basename(image_path)}")
+    # Open image and convert to RGB (handles RGBA, grayscale, etc.)
+    with stage('stylize', 'file_io'):
+        image = Image.open(image_path).convert('RGB')
+    output_image = stylize_pil(model, image, device)
+    # Save with high quality JPEG
+    with stage('stylize', 'file_io'):
+        output_image.save(output_path, 'JPEG', quality=95)
+    print(f"    Saved: {os.path.basename(output_path)}")
+    return output_path
+
+# Function to apply style transfer entirely in memory
+# model: Pre-loaded TransformerNet model instance
+# source: Encoded input image as bytes or a readable stream
+# device: Computation device (GPU/CPU)
+# quality: JPEG quality of the encoded result
+# progress: Optional callback(done, total) reporting tiles completed
+# Returns: Stylized image encoded as JPEG bytes
+def stylize_image_bytes(model, source, device: str = DEVICE, quality: int = 95, progress=None) -> bytes:
+    """Decode, stylize and encode an image without touching the filesystem"""
+    with stage('stylize', 'decode'):
+        image = decode_image(source)
+    output_image = stylize_pil(model, image, device, progress=progress)
+    with stage('stylize', 'encode'):
+        return encode_image(output_image, quality=quality)
+
+# Function running a style model on a batch in the current thread
+# model: Loaded style model (eager, frozen, INT8 or ONNX Runtime)
+# batch: Input tensor [N, 3, H, W] in 0-255 on the model's device
+# Returns: fp32 output tensor
+def run_style_model(model, batch):
+    # Grad mode is thread-local, so disable it in whichever thread runs the model
+    with torch.no_grad():
+        if getattr(model, 'bf16', False):
+            # Runs under bfloat16 autocast and returns fp32 for the clamp and encode
+            return bf16_forward(model, batch)
+        return model(batch)
+
+# Function to stylize a quick, downscaled preview of an image
+# size: Longest side of the preview
+# Returns: Preview encoded as JPEG bytes
+def stylize_preview_bytes(model, source, size, device: str = DEVICE, quality: int = 85) -> bytes:
+    """Downscale, stylize and encode a preview of an image"""
+    with stage('stylize', 'decode'):
+        image = decode_image(source)
+    with stage('stylize', 'resize'):
+        # reducing_gap first shrinks by a cheap integer factor, then resamples
+        image.thumbnail((size, size), Image.BILINEAR, reducing_gap=2.0)
+    output_image = stylize_pil(model, image, device)
+    with stage('stylize', 'encode'):
+        return encode_image(output_image, quality=quality)
+
+# Function to run one batch of style transfer requests that share a model
+# key: Grouping key built by style_forward (model id, device, size bucket)
+# items: List of (model, tensor) pairs, each tensor of shape [1, 3, H, W]
+# Returns: List of output tensors cropped back to each input's own size
+def _run_style_batch(key, items):
+    """Pad a group of similar-sized inputs to a common shape and run one forward"""
+    model = items[0][0]
+    sizes = [tuple(tensor.shape[-2:]) for _, tensor in items]
+    # Common shape of the batch, rounded up to its bucket when bucketing is on
+    max_h, max_w = shape_buckets.bucket(max(h for h, _ in sizes), max(w for _, w in sizes))
+    shape_buckets.record((key[0], key[1], len(items), max_h, max_w))
+
+    batch = []
+    for (_, tensor), (h, w) in zip(items, sizes):
+        if (h, w) != (max_h, max_w):
+            # Reflection padding keeps image statistics close to the original;
+            # fall back to replicate when the pad is larger than the image side
+            mode = 'reflect' if (max_h - h) < h and (max_w - w) < w else 'replicate'
+            tensor = torch.nn.functional.pad(tensor, (0, max_w - w, 0, max_h - h), mode=mode)
+        batch.append(tensor)
+
+    output = run_style_model(model, torch.cat(batch, dim=0))
+
+    # Each caller receives its own slice, cropped to its input size
+    return [output[i:i + 1, :, :h, :w] for i, (h, w) in enumerate(sizes)]
+
+# Canonical input shapes (and shape reuse statistics) of the style models
+shape_buckets = ShapeBuckets(STYLE_SHAPE_BUCKET_STEP)
+
+# Scheduler shared by all style transfer requests
+style_batcher = MicroBatcher(
+    _run_style_batch,
+    max_batch_size=STYLE_BATCH_MAX_SIZE,
+    max_wait_ms=STYLE_BATCH_WAIT_MS,
+    num_workers=STYLE_BATCH_WORKERS,
+    name='style-batcher',
+    eager=True,
+)
+
+# Function to run a style model forward pass through the micro-batching scheduler
+# model: Loaded TransformerNet model instance
+# content_tensor: Input tensor of shape [1, 3, H, W] in [0, 255] range
+# Returns: Stylized tensor of shape [1, 3, H, W]
+def style_forward(model, content_tensor):
+    """Submit one image to the style batcher and wait for its output"""
+    h, w = content_tensor.shape[-2:]
+    # Only requests for the same model, on the same device, with the same
+    # shape (or sides in the same STYLE_BATCH_SIZE_TOLERANCE bucket) are batched together
+    if shape_buckets.enabled:
+        key = (id(model), str(content_tensor.device)) + shape_buckets.bucket(h, w)
+    else:
+        tolerance = max(1, STYLE_BATCH_SIZE_TOLERANCE)
+        key = (id(model), str(content_tensor.device), -(-h // tolerance), -(-w // tolerance))
+    return style_batcher.submit(key, (model, content_tensor))
+
+# Function to run one batch of SPADE generations
+# key: Label tensor shape shared by the batch
+# items: List of label tensors [1, H, W]
+# Returns: List of generated [3, H, W] tensors
+def _run_spade_batch(key, items):
+    return generate_spade_tensors(items)
+
+# Scheduler shared by all SPADE requests and tiles
+spade_batcher = MicroBatcher(
+    _run_spade_batch,
+    max_batch_size=SPADE_BATCH_MAX_SIZE,
+    max_wait_ms=SPADE_BATCH_WAIT_MS,
+    name='spade-batcher',
+)
+
+# Function to run one generator input through the SPADE batcher
+# label_tensor: Long tensor [1, 512, 512] of class IDs
+# Returns: Generated [3, 512, 512] tensor in [-1, 1]
+def spade_forward(label_tensor):
+    """Wait for a label map's slot in a batched generator forward"""
+    return spade_batcher.submit(tuple(label_tensor.shape), label_tensor)
+
+# Function to convert a segmentation map to the label map the generator sees
+# seg_image: PIL Image (RGB image with semantic colors)
+# tiled: Keep the map's size and aspect ratio (tiled) instead of resizing to 512x512
+# Returns: [H, W] uint8 label array
+def spade_labels(seg_image, tiled=False):
+    """Class IDs at the size they are generated at"""
+    if not tiled:
+        # Same nearest-neighbour resize as the generator's input transform
+        return spade_label_array(seg_image.resize((512, 512), Image.NEAREST))
+    # Nearest-neighbour keeps the colors exact for the palette lookup
+    if max(seg_image.size) > SPADE_TILED_MAX_SIZE:
+        seg_image = seg_image.copy()
+        seg_image.thumbnail((SPADE_TILED_MAX_SIZE, SPADE_TILED_MAX_SIZE), Image.NEAREST)
+    return spade_label_array(seg_image)
+
+# Function to generate an image from a label map through the SPADE batcher
+# labels: [H, W] uint8 label array from spade_labels()
+# progress: Optional callback(done, total) reporting tiles completed
+# Returns: Generated PIL Image
+def spade_generate_labels(labels, tiled=False, progress=None):
+    """Generate from a label map, batching generator forwards with concurrent requests"""
+    if not tiled:
+        return spade_tensor_to_image(spade_forward(spade_label_tensor_from_array(labels)))
+    return generate_spade_tiled(
+        labels,
+        forward=spade_forward,
+        context=SPADE_TILE_CONTEXT,
+        overlap=SPADE_TILE_OVERLAP,
+        workers=SPADE_TILE_WORKERS,
+        progress=progress,
+    )
+
+# Function to generate an image from a segmentation map through the SPADE batcher
+# seg_image: PIL Image (RGB image with semantic colors)
+# tiled: Keep the map's size and aspect ratio (tiled) instead of generating at 512x512
+# progress: Optional callback(done, total) reporting tiles completed
+# Returns: Generated PIL Image
+def spade_generate(seg_image, tiled=False, progress=None):
+    """Generate from a segmentation map, batching generator forwards with concurrent requests"""
+    return spade_generate_labels(spade_labels(seg_image, tiled), tiled, progress)
+
+# Function to build the label-map cache key of a SPADE generation
+# labels: [H, W] uint8 label array from spade_labels()
+# params: Generation options (the same as in the upload's cache key)
+def _spade_label_key(labels, params):
+    params = dict(params, shape=list(labels.shape))
+    return cache_key(labels.tobytes(), 'spade-labels', file_fingerprint(SPADE_CHECKPOINT_PATH), params)
+
+# Previous canvas per drawing session
+spade_sessions = SessionStore(max_bytes=SPADE_SESSION_MAX_MB * 1024 * 1024, ttl=SPADE_SESSION_TTL)
+
+# Function to generate from a segmentation map within a drawing session
+# session_id: Client-chosen id of the drawing session
+# seg_image: PIL Image (RGB image with semantic colors)
+# tiled: Generate at the canvas' own size (otherwise at 512x512)
+# Returns: (generated PIL Image, outcome: full, incremental or unchanged)
+def spade_generate_session(session_id, seg_image, tiled=False, progress=None):
+    """Regenerate only what changed since the session's previous canvas"""
+    labels = spade_labels(seg_image, tiled)
+    params = (tiled, file_fingerprint(SPADE_CHECKPOINT_PATH), SPADE_TILE_CONTEXT, SPADE_TILE_OVERLAP)
+    tile_options = dict(forward=spade_forward, context=SPADE_TILE_CONTEXT, overlap=SPADE_TILE_OVERLAP,
+                        workers=SPADE_TILE_WORKERS)
+
+    output, outcome = None, 'full'
+    previous = spade_sessions.get(session_id, params)
+    if previous is not None and previous[0].shape == labels.shape:
+        with stage('spade', 'diff'):
+            boxes = dirty_boxes(previous[0], labels, margin=SPADE_SESSION_MARGIN)
+        dirty = sum((b - t) * (r - l) for t, l, b, r in boxes)
+        if not boxes:
+            output, outcome = previous[1], 'unchanged'
+        elif dirty <= SPADE_SESSION_FULL_FRACTION * labels.size:
+            output, outcome = previous[1].copy(), 'incremental'
+            # One generation per group of boxes sharing generator windows
+            for region, members in group_boxes(boxes, labels.shape, 512, SPADE_TILE_CONTEXT):
+                patch = generate_spade_region(labels, region, **tile_options)
+                with stage('spade', 'composite'):
+                    # Only the changed boxes are blended in; the rest of the region keeps its pixels
+                    for t, l, b, r in members:
+                        box_patch = patch[t - region[0]:b - region[0], l - region[1]:r - region[1]]
+                        composite(output, box_patch, (t, l, b, r), feather=SPADE_SESSION_MARGIN // 2)
+    if output is None:
+        output = np.asarray(spade_generate_labels(labels, tiled, progress))
+    spade_sessions.put(session_id, params, labels, output)
+    spade_sessions.record(outcome)
+    return Image.fromarray(output), outcome
+
+# ---------- Warmup Tasks ----------
+# Readiness tracker shared with /health
+warmup = Warmup()
+
+# Function returning the style names selected for preloading
+def _warmup_style_names():
+    names = WARMUP_STYLES or STYLE_CACHE_PINNED
+    if names == ['*']:
+        names = list_style_names()
+    return names
+
+# Function to load the configured style models (no forward pass)
+# Returns: List of loaded style models
+def _preload_styles():
+    models = []
+    for name in _warmup_style_names():
+        model_path = find_style_model(name)
+        if model_path is None:
+            print(f" Warmup: style model not found: {name}")
+            continue
+        models.append(load_style_model(model_path, DEVICE))
+    return models
+
+# Function to preload the configured style models and run dummy forwards
+# Each size is run on the variant a request of that size would use (INT8,
+# ONNX Runtime or torch, bf16 included) through the same batched forward,
+# so exports, session creation and kernel selection happen before readiness
+def _warmup_styles():
+    for name in _warmup_style_names():
+        model_path = find_style_model(name)
+        if model_path is None:
+            print(f" Warmup: style model not found: {name}")
+            continue
+        # First forwards at typical resolutions warm up the allocator and kernels
+        for size in WARMUP_SIZES:
+            width, height = size, size * 3 // 4
+            precision = style_precision(model_path, STYLE_PRECISION, (width, height))
+            backend = 'torch' if precision == 'int8' else style_backend(model_path, (width, height))
+            model = load_style_for(model_path, precision, backend)
+            dummy = torch.rand(1, 3, height, width, device=DEVICE) * 255
+            style_forward(model, dummy)
+
+# Function to load the SPADE generator and run one full generation
+def _warmup_spade():
+    load_spade_model()
+    generate_image_pil(Image.new('RGB', (512, 512), (117, 158, 223)))
+
+# Function to load (and if needed download) Real-ESRGAN and run one upscale
+def _warmup_esrgan():
+    enhancer = get_enhancer()
+    enhancer.enhance(np.zeros((64, 64, 3), dtype=np.uint8), outscale=4)
+
+# Function to load every available engine's weights without running them
+# Used by the pre-fork server so workers inherit the parent's weights
+# Returns: List of loaded torch modules
+def preload_models():
+    """Load style, SPADE and Real-ESRGAN weights (no forward passes)"""
+    modules = []
+    if STYLE_AVAILABLE:
+        modules.extend(_preload_styles())
+    if SPADE_AVAILABLE:
+        try:
+            modules.append(load_spade_model())
+        except Exception as e:
+            print(f" Preload: SPADE failed: {e}")
+    if ESRGAN_AVAILABLE:
+        try:
+            modules.append(get_enhancer().model)
+        except Exception as e:
+            print(f" Preload: Real-ESRGAN failed: {e}")
+    return modules
+
+# Function to register and start background warmup for every available engine
+def start_warmup():
+    """Preload engines in background threads; /health is not-ready until done"""
+    if STYLE_AVAILABLE:
+        warmup.add('style', _warmup_styles)
+    if SPADE_AVAILABLE:
+        warmup.add('spade', _warmup_spade)
+    if ESRGAN_AVAILABLE:
+        warmup.add('esrgan', _warmup_esrgan)
+    warmup.start()
+
 # Simple image enhancement function (upscaling + sharpening)
 # data: Image data as bytes
 # upscale: Upscaling factor (default: 1.5x)
@@ -265,17 +1124,21 @@ def stylize_image(model, image_path: str, output_path: str, device: str = DEVICE
 def enhance_image_simple(data: bytes, upscale: float = 1.5) -> bytes:
     """Simple image enhancement"""
     # Load image from bytes
-    img = Image.open(io.BytesIO(data)).convert('RGB')
+    with stage('enhance_simple', 'decode'):
+        img = Image.open(io.BytesIO(data)).convert('RGB')
     # Get original dimensions
     w, h = img.size
     # Resize with upscaling factor using high-quality resampling
-    img = img.resize((int(w * upscale), int(h * upscale)), Image.LANCZOS)
+    with stage('enhance_simple', 'resize'):
+        img = img.resize((int(w * upscale), int(h * upscale)), Image.LANCZOS)
     # Apply sharpening filter to improve perceived quality
-    img = img.filter(ImageFilter.SHARPEN)
+    with stage('enhance_simple', 'sharpen'):
+        img = img.filter(ImageFilter.SHARPEN)
     # Create in-memory buffer for output
     out = io.BytesIO()
     # Save as JPEG with high quality
-    img.save(out, format='JPEG', quality=95)
+    with stage('enhance_simple', 'encode'):
+        img.save(out, format='JPEG', quality=95)
     # Reset buffer position to beginning
     out.seek(0)
     # Return image data as bytes
@@ -293,20 +1156,47 @@ def home():
         'endpoints': {
             'health': 'GET /health',
             'models': 'GET /models',
-            'stylize': 'POST /stylize (image, style)',
+            'stylize': 'POST /stylize (image, style[, progressive=1])',
+            'stylize_multi': 'POST /stylize/multi (image, styles) -> zip',
+            'stylize_video': 'POST /stylize/video (video, style) -> job',
             'spade': 'POST /spade (segmentation)',
-            'enhance': 'POST /enhance (image)'
+            'enhance': 'POST /enhance (image)',
+            'jobs': 'POST /jobs (type, ...), GET /jobs/<id>[/result|/events]',
+            'metrics': 'GET /metrics'
         }
     })
 
+# Function returning model cache counters without the per-model breakdown
+def _model_cache_summary():
+    stats = _model_cache.stats(label=_cache_label)
+    stats['load_seconds'] = {name: info['load_seconds'] for name, info in stats.pop('models').items()}
+    return stats
+
 @app.route('/health', methods=['GET'])
 def health():
+    # Not ready while warmup is still loading models: keep the load balancer away
+    if not warmup.ready:
+        return jsonify({
+            'status': 'warming_up',
+            'warmup': warmup.status()
+        }), 503
     return jsonify({
         'status': 'healthy',
+        'warmup': warmup.status(),
         'spade_available': SPADE_AVAILABLE,
         'style_available': STYLE_AVAILABLE,
         'device': DEVICE,
-        'cached_models': len(_model_cache)
+        'cached_models': len(_model_cache),
+        'model_cache': _model_cache_summary(),
+        'style_batching': style_batcher.stats(),
+        'spade_batching': spade_batcher.stats(),
+        'spade_sessions': spade_sessions.stats(),
+        'shape_buckets': shape_buckets.stats(),
+        'perf_profile': PERF_PROFILE_SETTINGS,
+        'style_precision': STYLE_PRECISION,
+        'style_backend': STYLE_BACKEND if ORT_AVAILABLE else 'torch',
+        'result_cache': result_cache.stats(),
+        'admission': {engine: controller.stats() for engine, controller in admission.items()}
     })
 
 @app.route('/models', methods=['GET'])
@@ -330,7 +1220,8 @@ def list_models():
         return jsonify({
             'models': models,
             'count': len(models),
-            'directory': models_dir
+            'directory': models_dir,
+            'cache': _model_cache.stats(label=_cache_label)
         })
     except Exception as e:
         return jsonify({
@@ -338,144 +1229,588 @@ def list_models():
             'error': str(e)
         })
 
-# ---------- SPADE ----------
-@app.route('/spade', methods=['POST'])
-def spade_route():
+# ---------- Metrics ----------
+# Per-stage latency histograms are recorded by stage() in the engines; the
+# counters below are bumped by EngineTask, the rest is read at scrape time
+REQUESTS_IN_FLIGHT = Gauge('creativecollab_requests_in_flight',
+                           'Engine requests currently being processed', ('engine',))
+ENGINE_ERRORS = Counter('creativecollab_errors_total',
+                        'Engine requests that failed, by exception type', ('engine', 'type'))
+RESULT_CACHE_LOOKUPS = Counter('creativecollab_result_cache_requests_total',
+                               'Result cache lookups by outcome', ('engine', 'result'))
+
+# Function returning the number of resident models per engine
+def _loaded_models():
+    return {
+        'style': len(_model_cache),
+        'spade': int(SPADE_AVAILABLE and spade_model_loaded()),
+        'esrgan': int(ESRGAN_AVAILABLE and enhancer_loaded()),
+    }
+
+Gauge('creativecollab_models_loaded', 'Models resident in memory', ('engine',), fn=_loaded_models)
+Gauge('creativecollab_model_cache_bytes', 'Bytes held by cached style models',
+      fn=lambda: _model_cache.resident_bytes)
+Counter('creativecollab_model_cache_requests_total', 'Style model cache lookups by outcome', ('result',),
+        fn=lambda: {(k,): v for k, v in _model_cache.stats().items() if k in ('hits', 'misses')})
+Counter('creativecollab_model_cache_evictions_total', 'Style models evicted from the cache',
+        fn=lambda: _model_cache.stats()['evictions'])
+Gauge('creativecollab_result_cache_bytes', 'Bytes held by the result cache', ('tier',),
+      fn=lambda: {(t,): result_cache.stats()[f'{t}_bytes'] for t in ('memory', 'disk')})
+Counter('creativecollab_result_cache_evictions_total', 'Result cache entries evicted from disk',
+        fn=lambda: result_cache.stats()['evictions'])
+Gauge('creativecollab_jobs', 'Background jobs by status', ('status',),
+      fn=lambda: jobs.stats()['jobs'])
+Gauge('creativecollab_admission_queued', 'Requests waiting for admission budget', ('engine',),
+      fn=lambda: {(e,): c.stats()['queued'] for e, c in admission.items()})
+Gauge('creativecollab_admission_in_flight_cost', 'Admitted cost currently running', ('engine',),
+      fn=lambda: {(e,): c.stats()['in_flight_cost'] for e, c in admission.items()})
+Counter('creativecollab_admission_rejected_total', 'Requests refused with 429', ('engine',),
+        fn=lambda: {(e,): c.stats()['rejected'] for e, c in admission.items()})
+Counter('creativecollab_shape_bucket_requests_total', 'Style forwards by whether their input shape was seen before',
+        ('result',), fn=lambda: {('hit',): shape_buckets.stats()['hits'], ('miss',): shape_buckets.stats()['misses']})
+# Function returning micro-batcher statistics by engine (batch occupancy = items / batches)
+def _batcher_stats():
+    return {'stylize': style_batcher.stats(), 'spade': spade_batcher.stats()}
+
+Counter('creativecollab_batches_total', 'Batched forwards run', ('engine',),
+        fn=lambda: {(e,): s['batches'] for e, s in _batcher_stats().items()})
+Counter('creativecollab_batch_items_total', 'Requests served by batched forwards', ('engine',),
+        fn=lambda: {(e,): s['items'] for e, s in _batcher_stats().items()})
+Gauge('creativecollab_batch_largest', 'Largest batch run so far', ('engine',),
+      fn=lambda: {(e,): s['largest_batch'] for e, s in _batcher_stats().items()})
+Gauge('creativecollab_batch_queued', 'Requests waiting for their batch', ('engine',),
+      fn=lambda: {(e,): s['queued'] for e, s in _batcher_stats().items()})
+Counter('creativecollab_spade_session_requests_total', 'SPADE session requests by how much was regenerated',
+        ('result',), fn=lambda: {(k,): v for k, v in spade_sessions.stats().items()
+                                 if k in ('full', 'incremental', 'unchanged')})
+Gauge('creativecollab_ready', 'Whether warmup has finished', fn=lambda: int(warmup.ready))
+
+# ---------- Engine Requests ----------
+# Each _prepare_* function validates a request and reads its upload, then
+# returns (task, None) where task is an EngineTask producing the encoded
+# result, or (None, error_response). The synchronous routes run the task in
+# the request thread; POST /jobs hands it to the background worker pool.
+
+class EngineTask:
+    """A validated engine request plus the result cache key of its output"""
+
+    # engine: Engine name (stylize, spade, enhance)
+    # work: Callable(progress=None) -> encoded result bytes
+    # key: Result cache key (also used as the response ETag)
+    # path: Inference path reported in metrics and used for admission control
+    #       (defaults to the engine name)
+    # cost: Estimated cost charged against the path's admission budget
+    # headers: Extra response headers describing how the result was produced
+    # preview: Optional cheaper EngineTask producing a low-resolution preview
+    def __init__(self, engine, work, key=None, mimetype='image/jpeg', path=None, cost=None, headers=None,
+                 preview=None):
+        self.engine = engine
+        self.work = work
+        self.key = key
+        self.mimetype = mimetype
+        self.path = path or engine
+        self.cost = cost
+        self.headers = headers or {}
+        self.preview = preview
+        self.cache_hit = False
+
+    # Function to produce the result, answering from the result cache if possible
+    # wait: Wait for admission however long the queue is (background jobs)
+    def run(self, progress=None, wait=False):
+        with REQUESTS_IN_FLIGHT.track(self.path), stage(self.path, 'total'):
+            cached = result_cache.get(self.key)
+            if cached is not None:
+                self.cache_hit = True
+                RESULT_CACHE_LOOKUPS.labels(self.path, 'hit').inc()
+                return cached
+            RESULT_CACHE_LOOKUPS.labels(self.path, 'miss').inc()
+            # Cache misses only: raises AdmissionRejected when the engine is saturated
+            with self._admit(wait):
+                try:
+                    data = self.work(progress)
+                except Exception as e:
+                    ENGINE_ERRORS.labels(self.path, type(e).__name__).inc()
+                    raise
+            result_cache.put(self.key, data)
+            return data
+
+    # Function reserving admission budget for the task (no-op when disabled)
+    def _admit(self, wait):
+        controller = admission.get(self.path) if ADMISSION_ENABLED else None
+        if controller is None or self.cost is None:
+            return contextlib.nullcontext()
+        with stage(self.path, 'admission_wait'):
+            return controller.admit(self.cost, wait=wait)
+
+# Function estimating a style transfer's cost from the upload's dimensions
+# Returns: Megapixels the model will process after the size limits apply
+def _style_cost(size):
+    if size is None:
+        return ADMISSION_DEFAULT_COST
+    w, h = size
+    tiled = TILING_AVAILABLE and STYLE_TILING_ENABLED and max(w, h) > STYLE_MAX_SIZE
+    limit = STYLE_TILED_MAX_SIZE if tiled else STYLE_MAX_SIZE
+    scale = min(1.0, limit / max(w, h, 1))
+    return w * h * scale * scale / 1e6
+
+# Function estimating a Real-ESRGAN enhancement's cost
+# Returns: Megapixels produced by the x4 network (outscale only resizes afterwards)
+def _esrgan_cost(size):
+    if size is None:
+        return ADMISSION_DEFAULT_COST * 16
+    w, h = size
+    return w * h * 16 / 1e6
+
+# Function estimating the simple enhancer's cost
+# Returns: Megapixels of the upscaled output
+def _simple_enhance_cost(size, upscale=1.5):
+    if size is None:
+        return ADMISSION_DEFAULT_COST
+    w, h = size
+    return w * h * upscale * upscale / 1e6
+
+# SPADE generates at its 512x512 crop size, whatever the upload size
+SPADE_COST = 512 * 512 / 1e6
+
+# Function estimating a tiled SPADE generation's cost
+# Returns: Megapixels of the canvas after the size limit applies
+def _spade_tiled_cost(size):
+    if size is None:
+        return ADMISSION_DEFAULT_COST
+    w, h = size
+    scale = min(1.0, SPADE_TILED_MAX_SIZE / max(w, h, 1))
+    return max(SPADE_COST, w * h * scale * scale / 1e6)
+
+# Function to answer a request with the task's image (304 if the client has it)
+def _task_response(task):
+    # The ETag is the content-addressed key, so a client holding it already
+    # has exactly this output: no need to even look at the cache
+    if task.key and task.key in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(task.key)
+        return response
+    try:
+        data = task.run()
+    except AdmissionRejected as e:
+        # Engine saturated: tell the client when to come back
+        response = jsonify({'error': str(e), 'retry_after': e.retry_after})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
+    response = send_file(io.BytesIO(data), mimetype=task.mimetype, as_attachment=False)
+    response.headers.update(task.headers)
+    if task.key:
+        response.set_etag(task.key)
+        response.headers['X-Cache'] = 'HIT' if task.cache_hit else 'MISS'
+    return response
+
+# Boundary between the parts of a progressive response
+PROGRESSIVE_BOUNDARY = 'stylize-frame'
+
+# Function encoding one part of a multipart/x-mixed-replace stream
+def _multipart_part(data, mimetype, stage_name):
+    header = (f'--{PROGRESSIVE_BOUNDARY}\r\nContent-Type: {mimetype}\r\n'
+              f'Content-Length: {len(data)}\r\nX-Stage: {stage_name}\r\n\r\n')
+    return header.encode('ascii') + data + b'\r\n'
+
+# Function to answer with a preview first and the full result on the same connection
+# The preview runs before the response starts, so a saturated engine still gets
+# a proper 429; a failure of the full pass is sent as a final JSON part
+def _progressive_response(task):
+    preview_data = None
+    # No preview when the full result is already cached
+    if task.preview is not None and result_cache.get(task.key) is None:
+        try:
+            preview_data = task.preview.run()
+        except AdmissionRejected as e:
+            response = jsonify({'error': str(e), 'retry_after': e.retry_after})
+            response.status_code = 429
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response
+    
+    def generate():
+        if preview_data is not None:
+            yield _multipart_part(preview_data, 'image/jpeg', 'preview')
+        try:
+            yield _multipart_part(task.run(), task.mimetype, 'final')
+        except Exception as e:
+            body = {'error': str(e), 'type': type(e).__name__}
+            if isinstance(e, AdmissionRejected):
+                body['retry_after'] = e.retry_after
+            yield _multipart_part(json.dumps(body).encode('utf-8'), 'application/json', 'error')
+        yield f'--{PROGRESSIVE_BOUNDARY}--\r\n'.encode('ascii')
+    
+    response = Response(stream_with_context(generate()),
+                        mimetype=f'multipart/x-mixed-replace; boundary={PROGRESSIVE_BOUNDARY}')
+    response.headers.update(task.headers)
+    # Let proxies pass the preview through as soon as it is written
+    response.headers['X-Accel-Buffering'] = 'no'
+    if task.key:
+        response.set_etag(task.key)
+    return response
+
+# Allowed drawing session ids
+SESSION_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]{1,128}')
+
+# Function to prepare a SPADE generation from the current request
+def _prepare_spade(req):
     if not SPADE_AVAILABLE:
-        return jsonify({'error': 'SPADE handler not available'}), 503
-    if 'segmentation' not in request.files:
-        return jsonify({'error': 'Missing segmentation map'}), 400
+        return None, (jsonify({'error': 'SPADE handler not available'}), 503)
+    if 'segmentation' not in req.files:
+        return None, (jsonify({'error': 'Missing segmentation map'}), 400)
     
-    seg_file = request.files['segmentation']
+    seg_file = req.files['segmentation']
     if seg_file.filename == '':
-        return jsonify({'error': 'No file selected'}), 400
-    
-    temp_dir = os.path.join(BASE_DIR, 'temp_images')
-    os.makedirs(temp_dir, exist_ok=True)
+        return None, (jsonify({'error': 'No file selected'}), 400)
     
     base_name = os.path.splitext(seg_file.filename)[0]
     timestamp = int(time.time())
-    seg_path = os.path.join(temp_dir, f'{base_name}_{timestamp}.png')
-    seg_file.save(seg_path)
+    # Read the segmentation map from the upload buffer
+    with stage('spade', 'upload_read'):
+        seg_bytes = seg_file.read()
     
-    try:
-        output_name = f'spade_{base_name}_{timestamp}.jpg'
-        output_path = generate_image(seg_path, output_name=output_name)
-        if not os.path.exists(output_path):
-            return jsonify({'error': 'Output file not created'}), 500
-        
-        return send_file(output_path, mimetype='image/jpeg')
-    except Exception as e:
-        traceback.print_exc()
-        return jsonify({'error': str(e), 'type': type(e).__name__}), 500
-    finally:
-        if os.path.exists(seg_path):
-            try: 
-                os.remove(seg_path)
-            except: 
-                pass
-
-# ---------- Neural Style ----------
-# POST endpoint for applying neural style transfer to uploaded images
-@app.route('/stylize', methods=['POST'])
-def stylize_route():
-    """Apply neural style transfer to an image"""
+    # Tiled mode generates at the canvas' own size (form field 'tiled')
+    tiled = req.form.get('tiled', '1' if SPADE_TILED else '').strip().lower() in ('1', 'true', 'yes', 'on')
+    # Drawing session the canvas belongs to (form field 'session')
+    session_id = req.form.get('session', '').strip() if SPADE_SESSIONS_ENABLED else ''
+    if session_id and not SESSION_ID_PATTERN.fullmatch(session_id):
+        return None, (jsonify({'error': 'Invalid session id (1-128 letters, digits, - or _)'}), 400)
+    headers = {'X-Spade-Mode': 'tiled' if tiled else 'square'}
     
-    # Print request header for debugging
-    print("\n" + "="*70)
-    print("STYLIZE REQUEST RECEIVED")
-    print("="*70)
+    def work(progress=None):
+        with stage('spade', 'decode'):
+            seg_image = decode_image(seg_bytes)
+        label_key = None
+        if session_id:
+            output_image, outcome = spade_generate_session(session_id, seg_image, tiled, progress)
+            headers['X-Spade-Session'] = outcome
+        else:
+            labels = spade_labels(seg_image, tiled)
+            # Uploads of the same drawing share the label map's result
+            label_key = _spade_label_key(labels, params) if SPADE_LABEL_CACHE else None
+            if label_key is not None:
+                cached = result_cache.get(label_key)
+                outcome = 'miss' if cached is None else 'hit'
+                RESULT_CACHE_LOOKUPS.labels('spade_labels', outcome).inc()
+                headers['X-Spade-Label-Cache'] = outcome
+                if cached is not None:
+                    return cached
+            output_image = spade_generate_labels(labels, tiled, progress)
+        with stage('spade', 'encode'):
+            output_bytes = encode_image(output_image)
+        result_cache.put(label_key, output_bytes)
+        
+        # Optional persistence (off the request path)
+        image_sink.save('temp_images', f'{base_name}_{timestamp}.png', seg_bytes)
+        image_sink.save(os.path.join('images', 'spade-output'), f'spade_{base_name}_{timestamp}.jpg', output_bytes)
+        return output_bytes
     
+    if tiled:
+        params = {'mode': 'tiled', 'max_size': SPADE_TILED_MAX_SIZE, 'context': SPADE_TILE_CONTEXT,
+                  'overlap': SPADE_TILE_OVERLAP, 'quality': 95, 'seed': SPADE_SEED}
+        cost = _spade_tiled_cost(image_size(seg_bytes))
+    else:
+        params = {'size': 512, 'quality': 95, 'seed': SPADE_SEED}
+        cost = SPADE_COST
+    # Session outputs depend on the session's history, so they are not cached
+    key = None if session_id else cache_key(seg_bytes, 'spade', file_fingerprint(SPADE_CHECKPOINT_PATH), params)
+    return EngineTask('spade', work, key, cost=cost, headers=headers), None
+
+# Function to prepare a style transfer from the current request
+def _prepare_stylize(req):
     # Check if Neural Style module is available
     if not STYLE_AVAILABLE:
         print(" Neural style module not available")
-        return jsonify({'error': 'Neural style module not available'}), 503
+        return None, (jsonify({'error': 'Neural style module not available'}), 503)
 
     # Validate request: check for image file
-    if 'image' not in request.files:
+    if 'image' not in req.files:
         print(" No image file in request")
-        return jsonify({'error': 'No image file provided (key: image)'}), 400
+        return None, (jsonify({'error': 'No image file provided (key: image)'}), 400)
     
     # Validate request: check for style name
-    if 'style' not in request.form:
+    if 'style' not in req.form:
         print(" No style name in request")
-        return jsonify({'error': 'No style name provided (key: style)'}), 400
+        return None, (jsonify({'error': 'No style name provided (key: style)'}), 400)
 
     # Extract image file and style name from request
-    image_file = request.files['image']
-    style_name = request.form['style']
+    image_file = req.files['image']
+    style_name = req.form['style']
+    # Optional per-request precision (defaults to the deployment's STYLE_PRECISION)
+    precision = req.form.get('precision', STYLE_PRECISION).strip().lower()
+    if precision not in STYLE_PRECISIONS:
+        return None, (jsonify({'error': f"Invalid precision '{precision}'",
+                               'precisions': list(STYLE_PRECISIONS)}), 400)
     
     # Validate that a file was actually selected
     if image_file.filename == '':
         print(" Empty filename")
-        return jsonify({'error': 'No file selected'}), 400
+        return None, (jsonify({'error': 'No file selected'}), 400)
 
     # Print request details for debugging
     print(f"Input: {image_file.filename}")
     print(f"Style: {style_name}")
 
-    # Setup directories for storing input and output images
-    content_dir = os.path.join(BASE_DIR, 'content_images')
-    output_dir = os.path.join(BASE_DIR, 'output_images')
-    # Create directories if they don't exist
-    os.makedirs(content_dir, exist_ok=True)
-    os.makedirs(output_dir, exist_ok=True)
+    # Find model file for requested style (.pth or .model)
+    model_path = find_style_model(style_name)
+    if model_path is None:
+        # Model not found, return error with available models list
+        print(f" Model not found: {style_name}")
+        return None, (jsonify({
+            'error': f"Model '{style_name}' not found",
+            'available_models': list_style_names()
+        }), 404)
 
-    # Generate unique filenames to avoid conflicts
-    # Extract file extension from uploaded file
+    print(f" Model path: {os.path.basename(model_path)}")
+    
+    # Read the upload from memory
+    with stage('stylize', 'upload_read'):
+        input_bytes = image_file.read()
     file_ext = os.path.splitext(image_file.filename)[1] or '.jpg'
-    # Generate unique 8-character ID
-    unique_id = uuid.uuid4().hex[:8]
-    # Create input and output filenames
-    input_filename = f'{unique_id}{file_ext}'
-    output_filename = f'{style_name}_{unique_id}.jpg'
+    size = image_size(input_bytes)
+    precision = style_precision(model_path, precision, size)
+    # INT8 models are torch-quantized; fp32 runs on the configured backend
+    backend = 'torch' if precision == 'int8' else style_backend(model_path, size)
+    
+    # Function loading the model for the selected precision and backend
+    def load():
+        return load_style_for(model_path, precision, backend)
+    
+    def work(progress=None):
+        # Load model and apply style transfer entirely in memory
+        model = load()
+        output_bytes = stylize_image_bytes(model, input_bytes, DEVICE, progress=progress)
+        
+        # Optional persistence (off the request path)
+        unique_id = uuid.uuid4().hex[:8]
+        image_sink.save('content_images', f'{unique_id}{file_ext}', input_bytes)
+        image_sink.save('output_images', f'{style_name}_{unique_id}.jpg', output_bytes)
+        return output_bytes
     
-    # Construct full paths
-    input_path = os.path.join(content_dir, input_filename)
-    output_path = os.path.join(output_dir, output_filename)
+    # Quick low-resolution pass for progressive responses (pointless for small images)
+    preview = None
+    if size is None or max(size) > STYLE_PREVIEW_SIZE:
+        def preview_work(progress=None):
+            return stylize_preview_bytes(load(), input_bytes, STYLE_PREVIEW_SIZE, DEVICE, STYLE_PREVIEW_QUALITY)
+        preview_params = {'preview': STYLE_PREVIEW_SIZE, 'quality': STYLE_PREVIEW_QUALITY,
+                          'precision': precision, 'backend': backend, 'bf16': STYLE_BF16}
+        preview = EngineTask('stylize', preview_work,
+                             cache_key(input_bytes, 'stylize', file_fingerprint(model_path), preview_params),
+                             cost=_style_cost((STYLE_PREVIEW_SIZE, STYLE_PREVIEW_SIZE)))
     
+    key = _stylize_key(input_bytes, model_path, precision, backend)
+    return EngineTask('stylize', work, key, cost=_style_cost(size),
+                      headers={'X-Style-Precision': precision, 'X-Style-Backend': backend},
+                      preview=preview), None
+
+# Function to prepare an image enhancement from the current request
+def _prepare_enhance(req):
+    if 'image' not in req.files:
+        return None, (jsonify({'error': 'No image uploaded'}), 400)
+    file = req.files['image']
+    if file.filename == '':
+        return None, (jsonify({'error': 'No file selected'}), 400)
+    # Optional target height selects the Real-ESRGAN upscaler
+    target_height = req.form.get('target_height', type=int)
+    use_esrgan = bool(target_height and ESRGAN_AVAILABLE)
+    with stage('enhance_esrgan' if use_esrgan else 'enhance_simple', 'upload_read'):
+        data = file.read()
+    
+    def work(progress=None):
+        if use_esrgan:
+            return enhance_bytes(data, target_height)
+        return enhance_image_simple(data)
+    
+    size = image_size(data)
+    if use_esrgan:
+        key = cache_key(data, 'enhance', ESRGAN_MODEL_NAME, {'target_height': target_height})
+        return EngineTask('enhance', work, key, path='enhance_esrgan', cost=_esrgan_cost(size)), None
+    key = cache_key(data, 'enhance', 'simple', {'upscale': 1.5, 'quality': 95})
+    return EngineTask('enhance', work, key, path='enhance_simple', cost=_simple_enhance_cost(size)), None
+
+# Function returning the result cache key of one style applied to an upload
+def _stylize_key(input_bytes, model_path, precision='fp32', backend='torch'):
+    # INT8 outputs differ from fp32 and are keyed by the artifact they came from
+    model_id = file_fingerprint(int8_artifact_path(model_path) if precision == 'int8' else model_path)
+    return cache_key(input_bytes, 'stylize', model_id,
+                     dict(_style_cache_params(), precision=precision, backend=backend))
+
+# Function to prepare a multi-style transfer from the current request
+# Styles come from repeated 'style' fields and/or a comma-separated 'styles' field
+def _prepare_stylize_multi(req):
+    if not STYLE_AVAILABLE:
+        return None, (jsonify({'error': 'Neural style module not available'}), 503)
+    if 'image' not in req.files:
+        return None, (jsonify({'error': 'No image file provided (key: image)'}), 400)
+    image_file = req.files['image']
+    if image_file.filename == '':
+        return None, (jsonify({'error': 'No file selected'}), 400)
+    
+    names = req.form.getlist('style')
+    names += req.form.get('styles', '').split(',')
+    # Drop blanks and duplicates, keeping the requested order
+    style_names = list(dict.fromkeys(n.strip() for n in names if n.strip()))
+    if not style_names:
+        return None, (jsonify({'error': 'No style names provided (key: styles)'}), 400)
+    if len(style_names) > STYLE_MULTI_MAX_STYLES:
+        return None, (jsonify({'error': f'At most {STYLE_MULTI_MAX_STYLES} styles per request'}), 400)
+    
+    model_paths = {name: find_style_model(name) for name in style_names}
+    missing = [name for name, path in model_paths.items() if path is None]
+    if missing:
+        return None, (jsonify({
+            'error': f"Models not found: {', '.join(missing)}",
+            'available_models': list_style_names()
+        }), 404)
+    
+    with stage('stylize', 'upload_read'):
+        input_bytes = image_file.read()
+    size = image_size(input_bytes)
+    # Each style's output is shared with single-style /stylize requests
+    keys = {name: _stylize_key(input_bytes, model_paths[name]) for name in style_names}
+    
+    def work(progress=None):
+        outputs = {name: result_cache.get(keys[name]) for name in style_names}
+        todo = [name for name in style_names if outputs[name] is None]
+        if todo:
+            # Decode and preprocess once, then run the models back to back
+            models = [load_style_model(model_paths[name], DEVICE) for name in todo]
+            with stage('stylize', 'decode'):
+                image = decode_image(input_bytes)
+            images = stylize_pil_multi(models, image, DEVICE, progress=progress)
+            for name, output_image in zip(todo, images):
+                with stage('stylize', 'encode'):
+                    outputs[name] = encode_image(output_image)
+                result_cache.put(keys[name], outputs[name])
+        
+        # JPEGs are already compressed: store them, with a fixed timestamp so
+        # the archive (and its ETag) only depends on its contents
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as archive:
+            for name in style_names:
+                archive.writestr(zipfile.ZipInfo(f'{name}.jpg', (1980, 1, 1, 0, 0, 0)), outputs[name])
+        return buffer.getvalue()
+    
+    # The per-style keys already cover the upload: no need to hash it again
+    key = cache_key('|'.join(keys[name] for name in style_names).encode(), 'stylize_multi')
+    return EngineTask('stylize', work, key, mimetype='application/zip', cost=_style_cost(size) * len(style_names),
+                      headers={'X-Styles': ','.join(style_names)}), None
+
+# Function to prepare a video style transfer from the current request
+def _prepare_stylize_video(req):
+    if not STYLE_AVAILABLE:
+        return None, (jsonify({'error': 'Neural style module not available'}), 503)
+    if not VIDEO_AVAILABLE:
+        return None, (jsonify({'error': 'Video stylization not available'}), 503)
+    if 'video' not in req.files:
+        return None, (jsonify({'error': 'No video file provided (key: video)'}), 400)
+    if 'style' not in req.form:
+        return None, (jsonify({'error': 'No style name provided (key: style)'}), 400)
+    video_file = req.files['video']
+    style_name = req.form['style']
+    if video_file.filename == '':
+        return None, (jsonify({'error': 'No file selected'}), 400)
+    model_path = find_style_model(style_name)
+    if model_path is None:
+        return None, (jsonify({
+            'error': f"Model '{style_name}' not found",
+            'available_models': list_style_names()
+        }), 404)
+    
+    with stage('stylize_video', 'upload_read'):
+        video_bytes = video_file.read()
+    file_ext = os.path.splitext(video_file.filename)[1] or '.mp4'
+    
+    def work(progress=None):
+        model = load_style_model(model_path, DEVICE)
+        # OpenCV reads and writes files, so the clip goes through a private temp dir
+        with tempfile.TemporaryDirectory(prefix='stylize-video-') as tmp:
+            src_path = os.path.join(tmp, f'input{file_ext}')
+            dst_path = os.path.join(tmp, 'output.mp4')
+            with stage('stylize_video', 'file_io'):
+                with open(src_path, 'wb') as f:
+                    f.write(video_bytes)
+            info = stylize_video(
+                src_path, dst_path,
+                lambda batch: run_style_model(model, batch.to(DEVICE)).cpu(),
+                batch_size=STYLE_VIDEO_BATCH,
+                max_size=STYLE_VIDEO_MAX_SIZE,
+                max_frames=STYLE_VIDEO_MAX_FRAMES,
+                queue_frames=STYLE_VIDEO_QUEUE_FRAMES,
+                progress=progress,
+            )
+            print(f" Stylized {info['frames']} frames at {info['width']}x{info['height']}")
+            with stage('stylize_video', 'file_io'):
+                with open(dst_path, 'rb') as f:
+                    return f.read()
+    
+    key = cache_key(video_bytes, 'stylize_video', file_fingerprint(model_path), {
+        'max_size': STYLE_VIDEO_MAX_SIZE,
+        'max_frames': STYLE_VIDEO_MAX_FRAMES,
+        'bf16': STYLE_BF16,
+    })
+    return EngineTask('stylize', work, key, mimetype='video/mp4', path='stylize_video', cost=1.0), None
+
+# Function returning the style settings that influence the output image
+def _style_cache_params():
+    return {
+        'max_size': STYLE_MAX_SIZE,
+        'tiled': TILING_AVAILABLE and STYLE_TILING_ENABLED,
+        'tiled_max_size': STYLE_TILED_MAX_SIZE,
+        'tile': (STYLE_TILE_SIZE, STYLE_TILE_CONTEXT, STYLE_TILE_OVERLAP),
+        'bf16': STYLE_BF16,
+        'shape_bucket_step': shape_buckets.step,
+        'batch_size_tolerance': max(1, STYLE_BATCH_SIZE_TOLERANCE),
+        'quality': 95,
+    }
+
+# Engines that can run synchronously or as jobs
+ENGINES = {
+    'stylize': _prepare_stylize,
+    'stylize_multi': _prepare_stylize_multi,
+    'stylize_video': _prepare_stylize_video,
+    'spade': _prepare_spade,
+    'enhance': _prepare_enhance,
+}
+
+# ---------- SPADE ----------
+@app.route('/spade', methods=['POST'])
+def spade_route():
+    task, error = _prepare_spade(request)
+    if error is not None:
+        return error
     try:
-        # Save uploaded image to disk
-        image_file.save(input_path)
-        print(f" Saved input: {input_filename}")
+        return _task_response(task)
     except Exception as e:
-        # Return error if file save fails
-        print(f" Failed to save input: {e}")
-        return jsonify({'error': f'Failed to save input: {str(e)}'}), 500
-
-    # Find model file for requested style
-    # Try .pth extension first
-    model_path = os.path.join(NEURAL_STYLE_DIR, 'saved_models', f'{style_name}.pth')
-    if not os.path.exists(model_path):
-        # Try .model extension as fallback
-        model_path = os.path.join(NEURAL_STYLE_DIR, 'saved_models', f'{style_name}.model')
-        if not os.path.exists(model_path):
-            # Model not found, return error with available models list
-            print(f" Model not found: {style_name}")
-            models_dir = os.path.join(NEURAL_STYLE_DIR, 'saved_models')
-            available = []
-            # List available models if directory exists
-            if os.path.exists(models_dir):
-                available = [f.replace('.pth','').replace('.model','') 
-                           for f in os.listdir(models_dir) 
-                           if f.endswith(('.pth','.model'))]
-            return jsonify({
-                'error': f"Model '{style_name}' not found",
-                'available_models': available
-            }), 404
+        traceback.print_exc()
+        return jsonify({'error': str(e), 'type': type(e).__name__}), 500
 
-    print(f" Model path: {os.path.basename(model_path)}")
+# ---------- Neural Style ----------
+# POST endpoint for applying neural style transfer to uploaded images
+@app.route('/stylize', methods=['POST'])
+def stylize_route():
+    """Apply neural style transfer to an image"""
+    
+    # Print request header for debugging
+    print("\n" + "="*70)
+    print("STYLIZE REQUEST RECEIVED")
+    print("="*70)
+    
+    task, error = _prepare_stylize(request)
+    if error is not None:
+        return error
+    # Progressive mode: low-resolution preview first, then the full result
+    if request.form.get('progressive', '').strip().lower() in ('1', 'true', 'yes', 'on'):
+        return _progressive_response(task)
 
     try:
-        # Load model and apply style transfer
-        model = load_style_model(model_path, DEVICE)
-        stylize_image(model, input_path, output_path, DEVICE)
+        # Stream the encoded JPEG back from memory (or the result cache)
+        response = _task_response(task)
         
         print(f"Returning stylized image")
         print("="*70 + "\n")
         
-        # Return stylized image as JPEG file
-        return send_file(output_path, mimetype='image/jpeg')
+        return response
         
     except Exception as e:
         # Handle errors during stylization
@@ -489,35 +1824,118 @@ def stylize_route():
             'type': type(e).__name__,
             'details': 'Check server logs for full traceback'
         }), 500
-        
-    finally:
-        # Cleanup input file after processing (always executes)
-        if os.path.exists(input_path):
-            try: 
-                os.remove(input_path)
-            except: 
-                # Ignore cleanup errors
-                pass
+
+# POST /stylize/multi applies several styles to one upload and returns a zip
+# with one <style>.jpg per requested style
+@app.route('/stylize/multi', methods=['POST'])
+def stylize_multi_route():
+    task, error = _prepare_stylize_multi(request)
+    if error is not None:
+        return error
+    try:
+        return _task_response(task)
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'error': str(e), 'type': type(e).__name__}), 500
+
+# POST /stylize/video always runs as a job: poll or stream its progress
+# (frames written) and fetch the MP4 from the job's result URL
+@app.route('/stylize/video', methods=['POST'])
+def stylize_video_route():
+    task, error = _prepare_stylize_video(request)
+    if error is not None:
+        return error
+    return _submit_job('stylize_video', task)
 
 # ---------- Enhance ----------
 @app.route('/enhance', methods=['POST'])
 def enhance_route():
-    if 'image' not in request.files:
-        return jsonify({'error': 'No image uploaded'}), 400
-    file = request.files['image']
-    if file.filename == '':
-        return jsonify({'error': 'No file selected'}), 400
+    task, error = _prepare_enhance(request)
+    if error is not None:
+        return error
     try:
-        enhanced = enhance_image_simple(file.read())
-        return send_file(
-            io.BytesIO(enhanced), 
-            mimetype='image/jpeg', 
-            as_attachment=False
-        )
+        return _task_response(task)
     except Exception as e:
         traceback.print_exc()
         return jsonify({'error': str(e), 'type': type(e).__name__}), 500
 
+# ---------- Jobs ----------
+# POST /jobs enqueues a stylize/spade/enhance job and returns its id at once
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """Queue a generation job (form field 'type': stylize, stylize_multi, stylize_video, spade or enhance)"""
+    kind = request.form.get('type', '')
+    if kind not in ENGINES:
+        return jsonify({
+            'error': f"Unknown job type '{kind}'",
+            'types': sorted(ENGINES)
+        }), 400
+    
+    task, error = ENGINES[kind](request)
+    if error is not None:
+        return error
+    return _submit_job(kind, task)
+
+# Function to queue a prepared task as a background job (202 with its URLs)
+def _submit_job(kind, task):
+    try:
+        # Jobs are already bounded by the job queue: wait for admission, never refuse
+        job = jobs.submit(kind, functools.partial(task.run, wait=True), mimetype=task.mimetype)
+    except JobQueueFull as e:
+        return jsonify({'error': str(e)}), 503
+    
+    body = job.to_dict()
+    body['status_url'] = f'/jobs/{job.id}'
+    body['result_url'] = f'/jobs/{job.id}/result'
+    body['events_url'] = f'/jobs/{job.id}/events'
+    return jsonify(body), 202
+
+# GET /jobs/<id> reports the job status and progress
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    body = job.to_dict()
+    if job.status == 'succeeded':
+        body['result_url'] = f'/jobs/{job.id}/result'
+    return jsonify(body)
+
+# GET /jobs/<id>/result returns the generated image once the job succeeded
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job.status == 'failed':
+        return jsonify(job.to_dict()), 500
+    if job.status != 'succeeded':
+        # Not finished yet: tell the client to poll again
+        return jsonify(job.to_dict()), 202
+    return send_file(io.BytesIO(job.result), mimetype=job.mimetype)
+
+# GET /metrics exposes counters and latency histograms in Prometheus text format
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
+# GET /cache reports result cache statistics
+@app.route('/cache', methods=['GET'])
+def cache_stats():
+    return jsonify(result_cache.stats())
+
+# GET /jobs/<id>/events streams status/progress as server-sent events
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return Response(
+        stream_with_context(jobs.events(job)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 # ---------- Password Reset ----------
 @app.route('/reset-password', methods=['POST'])
 def reset_password():
@@ -584,6 +2002,9 @@ if __name__ == '__main__':
     print(f"Neural Style: {' Available' if STYLE_AVAILABLE else ' Not Available'}")
     print(f"Device:       {DEVICE}")
     print(f"Port:         5000")
+    if TORCH_THREADS > 0:
+        torch.set_num_threads(TORCH_THREADS)
+        print(f"Threads:      {TORCH_THREADS}")
     print("="*70)
     
     # Check for models
@@ -600,4 +2021,8 @@ if __name__ == '__main__':
     
     print("="*70 + "\n")
     
+    # Preload models in the background; /health reports not-ready until done
+    if WARMUP_ENABLED:
+        start_warmup()
+    
     app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=False)
\ No newline at end of file
@@ -0,0 +1,282 @@
+"""
+Autotuner for the inference engines on this host.
+
+Benchmarks TransformerNet (thread count, execution backend, batch size,
+tile size), the Real-ESRGAN RRDBNet (tile size) and, when its checkpoint
+is present, the SPADE generator at representative resolutions. The
+fastest configuration is written to the performance profile
+(backend/perf_profile.json or PERF_PROFILE), which app.py and
+enhance_image.py apply at startup. Run it once per machine type:
+
+    python autotune.py [--quick] [--style-model saved_models/mosaic.pth]
+
+Timings depend on the architecture, not on trained weights, so a random
+TransformerNet is used when no checkpoint is available. INT8 changes the
+output, so it is only selected with --allow-int8.
+"""
+# Import argparse for the command-line interface
+import argparse
+# Import json to write the profile
+import json
+# Import os for paths and CPU count
+import os
+# Import statistics for median timings
+import statistics
+# Import sys to find the neural style modules
+import sys
+# Import tempfile for throwaway ONNX/INT8 exports
+import tempfile
+# Import time for measurements
+import time
+# Import warnings to keep exporter notices out of the report
+import warnings
+
+# Import PyTorch for the benchmarks
+import torch
+
+# Import the profile helpers shared with the server
+from perf_profile import PROFILE_VERSION, host_fingerprint, profile_path
+
+# Make the neural style modules importable (same layout as app.py)
+NEURAL_STYLE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'neural_style_transfer', 'neural_style'))
+if NEURAL_STYLE_DIR not in sys.path:
+    sys.path.insert(0, NEURAL_STYLE_DIR)
+
+from transformer_net import TransformerNet  # noqa: E402
+
+# Candidates within this fraction of the best are treated as equal (the cheaper one wins)
+TOLERANCE = 0.05
+
+
+# Function timing fn() after one warmup call
+# Returns: Median seconds per call
+def _time(fn, runs):
+    with torch.no_grad():
+        fn()
+        samples = []
+        for _ in range(max(1, runs)):
+            start = time.perf_counter()
+            fn()
+            samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+# Function picking the best candidate, preferring earlier (cheaper) ones on near ties
+# timings: List of (candidate, seconds) in order of preference
+def _pick(timings):
+    best = min(seconds for _, seconds in timings)
+    for candidate, seconds in timings:
+        if seconds <= best * (1 + TOLERANCE):
+            return candidate
+
+
+# Function listing thread counts worth trying on this host
+def thread_candidates(cpus=None):
+    cpus = cpus or os.cpu_count() or 1
+    counts = {cpus}
+    n = 1
+    while n < cpus:
+        counts.add(n)
+        n *= 2
+    return sorted(counts)
+
+
+# Function loading the TransformerNet to benchmark
+def _style_model(path):
+    if path:
+        from inference_build import load_eager_model
+        return load_eager_model(path)
+    torch.manual_seed(0)
+    return TransformerNet().eval()
+
+
+def _image(size, batch=1):
+    return torch.rand(batch, 3, size, size) * 255
+
+
+# Function building each style execution backend that is usable on this host
+# Returns: Dict of backend name -> (callable model, settings that select it)
+def style_backends(eager, workdir, allow_int8=False):
+    backends = {'eager': (eager, {'STYLE_BACKEND': 'torch', 'STYLE_FROZEN': 0, 'STYLE_BF16': 0})}
+    try:
+        from inference_build import build_inference_model
+        backends['frozen'] = (build_inference_model(eager),
+                              {'STYLE_BACKEND': 'torch', 'STYLE_FROZEN': 1, 'STYLE_FROZEN_AUTOBUILD': 1,
+                               'STYLE_BF16': 0})
+    except Exception as e:
+        print(f"  frozen: unavailable ({e})")
+    try:
+        import copy
+        from mixed_precision import enable_bf16, forward
+        model = copy.deepcopy(eager)
+        if enable_bf16(model) is not None:
+            backends['bf16'] = (lambda x: forward(model, x), {'STYLE_BACKEND': 'torch', 'STYLE_BF16': 1})
+        else:
+            print("  bf16: unavailable (no CPU support or output mismatch)")
+    except Exception as e:
+        print(f"  bf16: unavailable ({e})")
+    try:
+        from ort_backend import export_onnx, load_ort_model
+        model_path = os.path.join(workdir, 'style.pth')
+        torch.save(eager.state_dict(), model_path)
+        export_onnx(eager, model_path)
+        ort_model = load_ort_model(model_path, torch.get_num_threads(), autoexport=False)
+        if ort_model is not None:
+            backends['onnxruntime'] = (ort_model, {'STYLE_BACKEND': 'onnxruntime', 'STYLE_BF16': 0})
+    except Exception as e:
+        print(f"  onnxruntime: unavailable ({e})")
+    if allow_int8:
+        try:
+            from quantize import quantize_model
+            int8 = quantize_model(eager, [_image(256) for _ in range(2)])
+            backends['int8'] = (int8, {'STYLE_PRECISION': 'int8'})
+        except Exception as e:
+            print(f"  int8: unavailable ({e})")
+    return backends
+
+
+# Function tuning the style transfer engine
+# Returns: (settings, results)
+def tune_style(args, workdir):
+    eager = _style_model(args.style_model)
+    settings, results = {}, {}
+    size = args.size
+
+    print(f"TransformerNet threads at {size}px:")
+    timings = []
+    for threads in thread_candidates():
+        torch.set_num_threads(threads)
+        seconds = _time(lambda: eager(_image(size)), args.runs)
+        timings.append((threads, seconds))
+        print(f"  {threads:>3} threads: {seconds * 1000:.0f} ms")
+    threads = _pick(timings)
+    torch.set_num_threads(threads)
+    settings['TORCH_THREADS'] = threads
+    results['threads'] = {str(t): s for t, s in timings}
+
+    print(f"Style backends at {size}px ({threads} threads):")
+    backends = style_backends(eager, workdir, args.allow_int8)
+    timings = []
+    for name, (model, _) in backends.items():
+        seconds = _time(lambda: model(_image(size)), args.runs)
+        timings.append((name, seconds))
+        print(f"  {name:>12}: {seconds * 1000:.0f} ms")
+    backend = _pick(timings)
+    model, backend_settings = backends[backend]
+    settings.update(backend_settings)
+    results['backends'] = dict(timings)
+
+    print(f"Batch sizes with {backend} (per image):")
+    timings = []
+    for batch in (1, 2, 4):
+        seconds = _time(lambda: model(_image(size // 2, batch)), args.runs) / batch
+        timings.append((batch, seconds))
+        print(f"  batch {batch}: {seconds * 1000:.0f} ms")
+    settings['STYLE_BATCH_MAX_SIZE'] = _pick(timings)
+    results['batch'] = {str(b): s for b, s in timings}
+
+    # Tiles include STYLE_TILE_CONTEXT pixels of context on each side: compare
+    # the time per pixel of the tile's core
+    context = int(os.environ.get('STYLE_TILE_CONTEXT', '64'))
+    print(f"Tile sizes with {backend} (per megapixel of output):")
+    timings = []
+    for tile in args.tiles:
+        core = tile - 2 * context
+        if core <= 0:
+            continue
+        seconds = _time(lambda: model(_image(tile)), args.runs) / (core * core / 1e6)
+        timings.append((tile, seconds))
+        print(f"  tile {tile}: {seconds:.2f} s/MP")
+    if timings:
+        settings['STYLE_TILE_SIZE'] = _pick(sorted(timings, key=lambda t: t[0]))
+        results['tiles'] = {str(t): s for t, s in timings}
+    # Tiles run in parallel threads, each using the per-forward thread count
+    settings['STYLE_TILE_WORKERS'] = max(1, (os.cpu_count() or 1) // threads)
+    return settings, results
+
+
+# Function tuning the Real-ESRGAN tile size
+# Returns: (settings, results), empty if Real-ESRGAN is not installed
+def tune_esrgan(args):
+    try:
+        from basicsr.archs.rrdbnet_arch import RRDBNet
+    except Exception as e:
+        print(f"RRDBNet: skipped ({e})")
+        return {}, {}
+    model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=4).eval()
+    # RealESRGANer pads every tile by tile_pad on each side
+    pad = 10
+    print("RRDBNet tile sizes (per megapixel of input):")
+    timings = []
+    for tile in args.esrgan_tiles:
+        seconds = _time(lambda: model(torch.rand(1, 3, tile + 2 * pad, tile + 2 * pad)), args.runs)
+        timings.append((tile, seconds / (tile * tile / 1e6)))
+        print(f"  tile {tile}: {timings[-1][1]:.1f} s/MP")
+    # Larger tiles use more memory: prefer the smaller one on near ties
+    return {'ESRGAN_TILE': _pick(timings)}, {'tiles': {str(t): s for t, s in timings}}
+
+
+# Function measuring SPADE generation latency with the chosen thread count
+# Returns: Results dict, empty if SPADE is not available
+def tune_spade(args):
+    try:
+        import numpy as np
+        from PIL import Image
+        from spade_handler import generate_image_pil, load_spade_model
+        load_spade_model()
+    except Exception as e:
+        print(f"SPADE: skipped ({e})")
+        return {}
+    label_map = Image.fromarray(np.full((512, 512, 3), (117, 158, 223), dtype=np.uint8))
+    seconds = _time(lambda: generate_image_pil(label_map), args.runs)
+    print(f"SPADE generator: {seconds * 1000:.0f} ms per 512px image")
+    return {'seconds': seconds}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the inference engines and write a performance profile")
+    parser.add_argument("--output", default=profile_path(), help="profile file to write")
+    parser.add_argument("--style-model", help="style checkpoint to benchmark (default: random weights)")
+    parser.add_argument("--size", type=int, default=512, help="representative style image side")
+    parser.add_argument("--runs", type=int, default=3, help="timed runs per measurement")
+    parser.add_argument("--quick", action='store_true', help="fewer candidates and runs")
+    parser.add_argument("--allow-int8", action='store_true', help="allow selecting INT8 precision")
+    parser.add_argument("--skip", default='', help="comma-separated engines to skip: esrgan,spade")
+    args = parser.parse_args()
+    skip = {name.strip() for name in args.skip.split(',') if name.strip()}
+    args.tiles = (384, 512, 768) if args.quick else (256, 384, 512, 768, 1024)
+    args.esrgan_tiles = (128, 256) if args.quick else (96, 128, 192, 256, 384)
+    if args.quick:
+        args.runs = 1
+
+    settings, results = {}, {}
+    with tempfile.TemporaryDirectory(prefix='autotune-') as workdir, warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        settings_style, results['style'] = tune_style(args, workdir)
+        settings.update(settings_style)
+        if 'esrgan' not in skip:
+            settings_esrgan, results['esrgan'] = tune_esrgan(args)
+            settings.update(settings_esrgan)
+        if 'spade' not in skip:
+            results['spade'] = tune_spade(args)
+
+    profile = {
+        'version': PROFILE_VERSION,
+        'host': host_fingerprint(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'torch': torch.__version__,
+        'settings': settings,
+        'results': results,
+    }
+    tmp_path = f'{args.output}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(profile, f, indent=2)
+    os.replace(tmp_path, args.output)
+
+    print(f"\nWrote {args.output}:")
+    for name, value in settings.items():
+        print(f"  {name}={value}")
+
+
+if __name__ == '__main__':
+    main()
@@ -3,16 +3,31 @@ Real-ESRGAN helper utilities for upscaling SPADE outputs.
 This module downloads the pretrained weights on first use and keeps
 the enhancer in memory for subsequent requests.
 """
+# Import copy to give every call its own view of the shared enhancer
+import copy
 # Import os for file system operations
 import os
 # Import sys for module manipulation
 import sys
+# Import threading so concurrent first requests build the enhancer only once
+import threading
 # Import types for creating dynamic modules
 import types
-# Import cv2 (OpenCV) for image reading and writing
+# Import cv2 (OpenCV) for image decoding, encoding and resizing
 import cv2
+# Import numpy to wrap in-memory buffers for OpenCV
+import numpy as np
 # Import PyTorch for tensor operations
 import torch
+# Import stage timers reported by /metrics
+from metrics import stage
+# Import the per-host settings written by autotune.py
+from perf_profile import apply_profile
+
+# Install this host's autotuned settings (no-op if app.py already did)
+apply_profile()
+# Tile size for Real-ESRGAN (0 = whole image at once)
+ESRGAN_TILE = int(os.environ.get('ESRGAN_TILE', '0'))
 
 
 # Function to ensure torchvision.functional_tensor module exists
@@ -91,6 +106,8 @@ MODEL_NAME = "RealESRGAN_x4plus.pth"
 
 # Global enhancer instance (singleton pattern)
 _enhancer = None
+# Lock held while the enhancer is being built (warmup and requests may race)
+_enhancer_lock = threading.Lock()
 
 
 # Function to ensure model weights are downloaded
@@ -113,6 +130,11 @@ def _ensure_model_weights():
     return model_path
 
 
+# Function reporting whether the enhancer has been built
+def enhancer_loaded():
+    return _enhancer is not None
+
+
 # Function to get or create Real-ESRGAN enhancer instance (singleton pattern)
 # Returns: RealESRGANer instance
 def get_enhancer():
@@ -123,6 +145,15 @@ def get_enhancer():
     if _enhancer is not None:
         return _enhancer
 
+    with _enhancer_lock:
+        # Another thread may have finished loading while we waited
+        if _enhancer is None:
+            _enhancer = _build_enhancer()
+    return _enhancer
+
+
+# Function building the Real-ESRGAN enhancer (called with _enhancer_lock held)
+def _build_enhancer():
     # Ensure model weights are downloaded
     model_path = _ensure_model_weights()
     # Initialize RRDBNet architecture
@@ -136,36 +167,43 @@ def get_enhancer():
     )
 
     # Create Real-ESRGAN enhancer instance
-    _enhancer = RealESRGANer(
+    enhancer = RealESRGANer(
         scale=4,                    # Upscaling factor
         model_path=model_path,      # Path to model weights
         model=model,                # Model architecture
-        tile=0,                     # Tile size (0 = no tiling)
+        tile=ESRGAN_TILE,           # Tile size (0 = no tiling)
         tile_pad=10,                # Padding for tiles
         pre_pad=0,                  # Pre-padding
         half=torch.cuda.is_available(),  # Use half precision if GPU available
     )
     print("Real-ESRGAN enhancer ready!")
-    return _enhancer
+    return enhancer
 
 
-# Function to enhance/upscale an image using Real-ESRGAN
-# input_path: Path to input image file
-# output_path: Path where enhanced image will be saved
+# Function to run the shared enhancer with a per-call tile size
+# RealESRGANer keeps per-call state (input, output, padding) on the instance,
+# so concurrent requests each enhance through a shallow copy: the network
+# weights are shared, the per-call state and tile settings are not
+# tile: Tile size for this call (0 = whole image at once)
+# Returns: (enhanced BGR array, alpha mode) as returned by RealESRGANer.enhance
+def _enhance_call(enhancer, image, scale, tile):
+    call = copy.copy(enhancer)
+    call.tile_size = tile
+    call.tile_pad = 10
+    with stage('enhance_esrgan', 'forward'):
+        return call.enhance(image, outscale=scale)
+
+
+# Function to enhance/upscale an in-memory image using Real-ESRGAN
+# image: Input image as a BGR numpy array (OpenCV layout)
 # target_height: Desired height in pixels (aspect ratio preserved)
-# Returns: Path to saved enhanced image
-def enhance_image(input_path, output_path, target_height):
+# Returns: Enhanced BGR numpy array
+def enhance_array(image, target_height):
     """
-    Enhance input_path to the requested target_height (keeping aspect ratio).
-    Saves the enhanced image to output_path and returns that path.
+    Enhance a BGR image array to the requested target_height (keeping aspect ratio).
     """
     # Get or create Real-ESRGAN enhancer instance
     enhancer = get_enhancer()
-    # Read input image using OpenCV (BGR format)
-    image = cv2.imread(input_path, cv2.IMREAD_COLOR)
-    # Check if image was loaded successfully
-    if image is None:
-        raise ValueError(f"Unable to read image: {input_path}")
 
     # Get original image dimensions (height, width)
     orig_height, orig_width = image.shape[:2]
@@ -183,18 +221,14 @@ def enhance_image(input_path, output_path, target_height):
     try:
         # Enhance image using Real-ESRGAN
         # Returns enhanced image and optional alpha channel (ignored here)
-        enhanced, _ = enhancer.enhance(image, outscale=scale)
+        enhanced, _ = _enhance_call(enhancer, image, scale, ESRGAN_TILE)
     except RuntimeError as err:
         # Retry with tiles to reduce memory usage if enhancement fails
         # This happens when image is too large for GPU memory
         print(f"Real-ESRGAN tile fallback due to: {err}")
-        # Enable tiling with 128x128 tiles
-        enhancer.tile = 128
-        enhancer.tile_pad = 10
-        # Retry enhancement with tiling
-        enhanced, _ = enhancer.enhance(image, outscale=scale)
-        # Reset tile size for next request
-        enhancer.tile = 0
+        # Retry with 128x128 tiles (half the configured size if already tiling),
+        # for this call only
+        enhanced, _ = _enhance_call(enhancer, image, scale, max(32, ESRGAN_TILE // 2) if ESRGAN_TILE else 128)
 
     # Final resize to exact target height while preserving aspect ratio
     # Real-ESRGAN may not produce exact target size, so resize if needed
@@ -202,9 +236,57 @@ def enhance_image(input_path, output_path, target_height):
         # Calculate target width maintaining aspect ratio
         target_width = int(enhanced.shape[1] * (target_height / enhanced.shape[0]))
         # Resize using cubic interpolation for high quality
-        enhanced = cv2.resize(enhanced, (target_width, target_height), interpolation=cv2.INTER_CUBIC)
+        with stage('enhance_esrgan', 'resize'):
+            enhanced = cv2.resize(enhanced, (target_width, target_height), interpolation=cv2.INTER_CUBIC)
+
+    return enhanced
+
+
+# Function to enhance/upscale encoded image bytes without touching disk
+# data: Encoded input image (JPEG, PNG, ...)
+# target_height: Desired height in pixels (aspect ratio preserved)
+# ext: Output encoding passed to cv2.imencode (default: JPEG)
+# Returns: Encoded enhanced image bytes
+def enhance_bytes(data, target_height, ext=".jpg"):
+    """
+    Decode data, enhance it to target_height and return the encoded result.
+    """
+    # Decode directly from the in-memory buffer (BGR format)
+    with stage('enhance_esrgan', 'decode'):
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    # Check if image was decoded successfully
+    if image is None:
+        raise ValueError("Unable to decode image data")
+
+    enhanced = enhance_array(image, target_height)
+    # Encode into an in-memory buffer
+    with stage('enhance_esrgan', 'encode'):
+        ok, buffer = cv2.imencode(ext, enhanced)
+    if not ok:
+        raise ValueError(f"Unable to encode enhanced image as {ext}")
+    return buffer.tobytes()
+
+
+# Function to enhance/upscale an image file using Real-ESRGAN
+# input_path: Path to input image file
+# output_path: Path where enhanced image will be saved
+# target_height: Desired height in pixels (aspect ratio preserved)
+# Returns: Path to saved enhanced image
+def enhance_image(input_path, output_path, target_height):
+    """
+    Enhance input_path to the requested target_height (keeping aspect ratio).
+    Saves the enhanced image to output_path and returns that path.
+    """
+    # Read input image using OpenCV (BGR format)
+    with stage('enhance_esrgan', 'file_io'):
+        image = cv2.imread(input_path, cv2.IMREAD_COLOR)
+    # Check if image was loaded successfully
+    if image is None:
+        raise ValueError(f"Unable to read image: {input_path}")
+
+    enhanced = enhance_array(image, target_height)
 
     # Save enhanced image to output path
-    cv2.imwrite(output_path, enhanced)
+    with stage('enhance_esrgan', 'file_io'):
+        cv2.imwrite(output_path, enhanced)
     return output_path
-
@@ -0,0 +1,108 @@
+"""
+In-memory image I/O for the request path.
+Uploads are decoded straight from memory and results are encoded into
+buffers, so a request never touches the filesystem. Writing inputs and
+outputs to disk is an optional sink that runs off the request thread.
+"""
+# Import io for in-memory buffers
+import io
+# Import os for path handling in the disk sink
+import os
+# Import ThreadPoolExecutor so disk writes never block a request
+from concurrent.futures import ThreadPoolExecutor
+# Import PIL Image for decoding and encoding
+from PIL import Image
+# Import Flask's Request class to control where uploads are buffered
+from flask import Request
+
+
+class InMemoryRequest(Request):
+    """
+    Flask request that buffers uploaded files in memory.
+    Werkzeug spools uploads larger than 500KB to a temporary file by
+    default; the upload size is bounded by MAX_CONTENT_LENGTH instead.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return io.BytesIO()
+
+
+# Function to decode an image from bytes or a file-like object
+# source: Raw image bytes, or a readable binary stream (e.g. FileStorage.stream)
+# mode: PIL mode to convert to (default: RGB)
+# Returns: Decoded PIL Image
+def decode_image(source, mode='RGB'):
+    """Decode image bytes or a stream into a PIL image without touching disk."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    elif hasattr(source, 'seek'):
+        source.seek(0)
+    image = Image.open(source)
+    # Force decoding now so the source buffer can be released
+    image.load()
+    return image.convert(mode) if mode and image.mode != mode else image
+
+
+# Function to read an image's dimensions from its header only
+# data: Raw image bytes
+# Returns: (width, height), or None if the header cannot be parsed
+def image_size(data):
+    """Return the pixel size of encoded image bytes without decoding them."""
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            return image.size
+    except Exception:
+        return None
+
+
+# Function to encode a PIL image into bytes
+# image: PIL Image to encode
+# fmt: Output format (JPEG, PNG, ...)
+# quality: JPEG quality (ignored by lossless formats)
+# Returns: Encoded image bytes
+def encode_image(image, fmt='JPEG', quality=95):
+    """Encode a PIL image into an in-memory buffer and return its bytes."""
+    out = io.BytesIO()
+    if fmt.upper() in ('JPEG', 'JPG'):
+        image.save(out, format='JPEG', quality=quality)
+    else:
+        image.save(out, format=fmt)
+    return out.getvalue()
+
+
+class DiskSink:
+    """
+    Optional persistence of request inputs/outputs.
+    When disabled every call is a no-op; when enabled files are written by
+    a single background thread so the response is not delayed by I/O.
+    """
+
+    # enabled: Whether anything is written at all
+    # root: Base directory that relative sub-directories are resolved against
+    def __init__(self, enabled=False, root='.'):
+        self.enabled = enabled
+        self.root = root
+        self._executor = None
+
+    # Function to queue bytes for writing to root/subdir/filename
+    # Returns: The Future of the write, or None if the sink is disabled
+    def save(self, subdir, filename, data):
+        """Persist data in the background if the sink is enabled."""
+        if not self.enabled:
+            return None
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='disk-sink')
+        return self._executor.submit(self._write, os.path.join(self.root, subdir), filename, data)
+
+    @staticmethod
+    def _write(directory, filename, data):
+        try:
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, filename)
+            with open(path, 'wb') as f:
+                f.write(data)
+            return path
+        except OSError as e:
+            # Persistence is best-effort and must never fail a request
+            print(f" Disk sink write failed for {filename}: {e}")
+            return None
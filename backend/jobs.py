@@ -0,0 +1,190 @@
+"""
+Asynchronous job execution for long-running generations.
+Jobs are queued into a bounded worker pool and return an id immediately;
+clients poll the job status, stream progress events, and fetch the
+result once it is ready. Finished jobs are kept for a limited time, and
+their number and result bytes are bounded (oldest dropped first).
+"""
+# Import json to serialise server-sent events
+import json
+# Import threading for job state synchronisation
+import threading
+# Import time for timestamps and expiry
+import time
+# Import uuid to generate job ids
+import uuid
+# Import ThreadPoolExecutor for the bounded worker pool
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobQueueFull(Exception):
+    """Raised when the job queue has reached its configured capacity."""
+
+
+class Job:
+    """State of one queued/running/finished job."""
+
+    def __init__(self, kind, mimetype='image/jpeg'):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        # queued -> running -> succeeded | failed
+        self.status = 'queued'
+        self.mimetype = mimetype
+        self.progress = {'done': 0, 'total': None, 'message': None}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        # Bumped on every change so event streams know when to emit
+        self.version = 0
+        self._changed = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in ('succeeded', 'failed')
+
+    # Function used by engines to report progress (e.g. tiles done)
+    # done: Units of work completed
+    # total: Total units of work (None if unknown)
+    # message: Optional human-readable stage description
+    def report(self, done, total=None, message=None):
+        with self._changed:
+            self.progress = {'done': done, 'total': total, 'message': message}
+            self.version += 1
+            self._changed.notify_all()
+
+    # Function to change the job status and wake up listeners
+    def _set(self, **fields):
+        with self._changed:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self.version += 1
+            self._changed.notify_all()
+
+    # Function to wait until the job changes after a given version
+    # Returns: The current version (equal to `version` on timeout)
+    def wait_for_change(self, version, timeout):
+        with self._changed:
+            if self.version == version and not self.finished:
+                self._changed.wait(timeout)
+            return self.version
+
+    # Function returning the JSON-serialisable job status
+    def to_dict(self):
+        data = {
+            'id': self.id,
+            'type': self.kind,
+            'status': self.status,
+            'progress': dict(self.progress),
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+        if self.error is not None:
+            data['error'] = self.error
+        return data
+
+
+class JobManager:
+    """
+    Runs jobs on a bounded thread pool with a bounded queue.
+    Finished jobs are dropped after result_ttl seconds, or earlier (oldest
+    first) when more than max_finished of them, or more than max_result_bytes
+    of results, are retained.
+    """
+
+    # max_workers: Number of jobs executed concurrently
+    # max_queued: Maximum number of jobs waiting or running (beyond -> JobQueueFull)
+    # result_ttl: Seconds a finished job (and its result) is retained
+    # max_finished: Maximum number of finished jobs retained
+    # max_result_bytes: Maximum total size of the retained results
+    def __init__(self, max_workers=2, max_queued=32, result_ttl=600, max_finished=256,
+                 max_result_bytes=256 * 1024 * 1024):
+        self.max_workers = max(1, int(max_workers))
+        self.max_queued = max(1, int(max_queued))
+        self.result_ttl = result_ttl
+        self.max_finished = max(1, int(max_finished))
+        self.max_result_bytes = max_result_bytes
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    # Function to enqueue a job
+    # kind: Job type (stylize, spade, enhance, ...)
+    # work: Callable(progress) -> bytes executed on the worker pool
+    # mimetype: Content type of the result
+    # Returns: The queued Job
+    def submit(self, kind, work, mimetype='image/jpeg'):
+        """Queue work for background execution and return its Job."""
+        self._expire()
+        job = Job(kind, mimetype=mimetype)
+        with self._lock:
+            active = sum(1 for j in self._jobs.values() if not j.finished)
+            if active >= self.max_queued:
+                raise JobQueueFull(f'Job queue is full ({active} jobs pending)')
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, work)
+        return job
+
+    # Function to look up a job by id (None if unknown or expired)
+    def get(self, job_id):
+        self._expire()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    # Function returning queue counters
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            result_bytes = sum(_result_size(job) for job in self._jobs.values())
+        return {'workers': self.max_workers, 'max_queued': self.max_queued, 'jobs': counts,
+                'result_bytes': result_bytes}
+
+    # Function yielding server-sent events until the job finishes
+    # keepalive: Seconds between comment lines sent while nothing changes
+    def events(self, job, keepalive=15.0):
+        """Generate text/event-stream chunks describing the job's progress."""
+        version = -1
+        while True:
+            if job.version != version:
+                version = job.version
+                yield f"event: {job.status}\ndata: {json.dumps(job.to_dict())}\n\n"
+                if job.finished:
+                    return
+            elif job.wait_for_change(version, keepalive) == version and not job.finished:
+                # Comment line keeps proxies from closing an idle stream
+                yield ": keepalive\n\n"
+
+    def _run(self, job, work):
+        job._set(status='running', started_at=time.time())
+        try:
+            result = work(job.report)
+            # Status last: a job seen as finished always has its result and finished_at
+            job._set(result=result, finished_at=time.time(), status='succeeded')
+        except Exception as e:
+            print(f"Job {job.id} ({job.kind}) failed: {type(e).__name__}: {e}")
+            job._set(error=f'{type(e).__name__}: {e}', finished_at=time.time(), status='failed')
+        self._expire()
+
+    def _expire(self):
+        cutoff = time.time() - self.result_ttl
+        with self._lock:
+            finished = sorted((job for job in self._jobs.values() if job.finished),
+                              key=lambda job: job.finished_at)
+            count = len(finished)
+            total = sum(_result_size(job) for job in finished)
+            for job in finished:
+                # Oldest first: past the TTL, or over the count/bytes budget
+                if job.finished_at >= cutoff and count <= self.max_finished and total <= self.max_result_bytes:
+                    break
+                del self._jobs[job.id]
+                count -= 1
+                total -= _result_size(job)
+
+
+# Function returning the size of a job's retained result
+def _result_size(job):
+    return len(job.result) if isinstance(job.result, (bytes, bytearray)) else 0
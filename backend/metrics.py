@@ -0,0 +1,262 @@
+"""
+In-process metrics exposed in the Prometheus text format.
+Hot paths only bump a few numbers under a per-series lock; the text
+exposition (cumulative buckets, sorting, formatting) is built when
+/metrics is scraped, so the instrumentation can stay on in production.
+Values that other components already track (cache counters, loaded
+models) are read through callbacks at scrape time instead.
+"""
+# Import bisect to find histogram buckets quickly
+import bisect
+# Import math for the +Inf bucket
+import math
+# Import threading to guard the series
+import threading
+# Import time for the stage timers
+import time
+
+
+# Default latency buckets in seconds (1 ms .. 60 s)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+# Function to format a sample value the way Prometheus expects
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, bool):
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+# Function to render a label set ({a="x",b="y"})
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"') for _, v in pairs)
+    return '{' + ','.join(f'{n}="{v}"' for (n, _), v in zip(pairs, escaped)) + '}'
+
+
+class Registry:
+    """Collection of metrics rendered together by /metrics."""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    # Function returning the full exposition text
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+# Base class holding one series per label combination
+class _Metric:
+    kind = 'untyped'
+
+    # name: Metric name
+    # documentation: HELP text
+    # labelnames: Names of the labels that identify a series
+    # fn: Optional callable evaluated at scrape time; returns a number for an
+    #     unlabelled metric or a {label values tuple: number} dict otherwise
+    def __init__(self, name, documentation, labelnames=(), fn=None, registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+        self._series = {}
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    # Function returning the series for the given label values
+    def labels(self, *values):
+        series = self._series.get(values)
+        if series is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f'{self.name} expects labels {self.labelnames}, got {values}')
+            with self._lock:
+                series = self._series.setdefault(values, self._new_series())
+        return series
+
+    def _new_series(self):
+        raise NotImplementedError
+
+    def _values(self):
+        if self.fn is not None:
+            try:
+                value = self.fn()
+            except Exception as e:
+                print(f"Metric callback {self.name} failed: {e}")
+                return []
+            if isinstance(value, dict):
+                return [(k if isinstance(k, tuple) else (k,), v) for k, v in value.items()]
+            return [((), value)]
+        with self._lock:
+            return [(k, s.value) for k, s in self._series.items()]
+
+    def samples(self):
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+                for key, value in sorted(self._values(), key=lambda kv: kv[0])]
+
+
+# A single counter or gauge series
+class _Value:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class Counter(_Metric):
+    """Monotonic counter (errors, cache hits, ...)."""
+    kind = 'counter'
+
+    def _new_series(self):
+        return _Value()
+
+    # Shortcut for unlabelled counters
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    """Value that can go up and down (in-flight requests, loaded models)."""
+    kind = 'gauge'
+
+    def _new_series(self):
+        return _Value()
+
+    # Function to count a block of code as in flight while it runs
+    def track(self, *values):
+        return _InFlight(self.labels(*values))
+
+
+# Context manager incrementing a gauge for the duration of a block
+class _InFlight:
+    __slots__ = ('_series',)
+
+    def __init__(self, series):
+        self._series = series
+
+    def __enter__(self):
+        self._series.inc()
+        return self
+
+    def __exit__(self, *exc):
+        self._series.dec()
+        return False
+
+
+# A single histogram series: per-bucket (non-cumulative) counts and the sum
+class _Buckets:
+    __slots__ = ('bounds', 'counts', 'total', '_lock')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.total += value
+
+    # Function returning a timer that observes the elapsed seconds on exit
+    def time(self):
+        return _Timer(self)
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.total
+
+
+# Context manager measuring the duration of a block
+class _Timer:
+    __slots__ = ('_buckets', '_start')
+
+    def __init__(self, buckets):
+        self._buckets = buckets
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._buckets.observe(time.perf_counter() - self._start)
+        return False
+
+
+class Histogram(_Metric):
+    """Latency histogram with fixed buckets."""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry=registry)
+
+    def _new_series(self):
+        return _Buckets(self.buckets)
+
+    def samples(self):
+        with self._lock:
+            series = sorted(self._series.items(), key=lambda kv: kv[0])
+        lines = []
+        for key, buckets in series:
+            counts, total = buckets.snapshot()
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ('le', _format_value(float(bound))))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+# Default registry served by /metrics
+REGISTRY = Registry()
+
+# Per-stage latency of every inference path
+STAGE_SECONDS = Histogram(
+    'creativecollab_stage_seconds',
+    'Time spent in each processing stage',
+    ('engine', 'stage'),
+)
+
+
+# Function to time one processing stage
+# engine: Inference path (stylize, spade, enhance_esrgan, enhance_simple)
+# name: Stage name (upload_read, decode, resize, to_tensor, forward, convert, encode, file_io, ...)
+# Usage: with stage('stylize', 'decode'): ...
+def stage(engine, name):
+    return STAGE_SECONDS.labels(engine, name).time()
@@ -0,0 +1,201 @@
+"""
+Dynamic micro-batching for model inference.
+Requests that share a grouping key (same model, similar input size) are
+collected over a short time window and executed together as one batch,
+each caller receiving its own slice of the result. With eager dispatch a
+group whose key has no batch running starts at once (a lone request never
+waits for the window); requests arriving while its batch runs are
+collected into the next one.
+"""
+# Import threading for the dispatcher threads and synchronisation
+import threading
+# Import time for wait-window bookkeeping
+import time
+# Import OrderedDict so groups are served in arrival order
+from collections import OrderedDict
+
+
+# A single queued request waiting for its batch to run
+class _Pending:
+    __slots__ = ('item', 'enqueued_at', 'done', 'result', 'error')
+
+    def __init__(self, item):
+        # Payload handed to run_batch (e.g. a tensor)
+        self.item = item
+        # Arrival time used to enforce the wait window
+        self.enqueued_at = time.monotonic()
+        # Set once the result (or error) is available
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher:
+    """
+    Collects items submitted under the same key and runs them in batches.
+
+    run_batch(key, items) must return one result per item, in order.
+    submit() blocks the calling thread until its own result is ready.
+    """
+
+    # run_batch: Callable executing one batch: run_batch(key, items) -> list of results
+    # max_batch_size: Maximum number of items per batch (<= 1 disables batching)
+    # max_wait_ms: How long the oldest item of a group may wait for companions
+    # num_workers: Number of dispatcher threads executing batches (batches of
+    #              different keys run in parallel up to this number)
+    # eager: Start a group at once when no batch of its key is running
+    def __init__(self, run_batch, max_batch_size=4, max_wait_ms=10.0, num_workers=1, name='batcher',
+                 eager=False):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.num_workers = max(1, int(num_workers))
+        self.name = name
+        self.eager = eager
+
+        # Pending requests per key, in arrival order of each key's first item
+        self._groups = OrderedDict()
+        # Condition guarding _groups and waking up dispatchers
+        self._cond = threading.Condition()
+        # Number of batches currently running per key
+        self._running = {}
+        # Dispatcher threads (started lazily on first submit)
+        self._workers = []
+        self._closed = False
+
+        # Running statistics (reported by stats())
+        self._batches = 0
+        self._items = 0
+        self._max_seen = 0
+
+    @property
+    def enabled(self):
+        """Batching is active only when more than one item may share a batch."""
+        return self.max_batch_size > 1
+
+    # Function to submit one item and wait for its result
+    # key: Grouping key; only items with equal keys are batched together
+    # item: Payload for run_batch
+    # Returns: The result produced for this item
+    def submit(self, key, item):
+        """Queue an item and block until its batch has been executed."""
+        # Batching disabled: run inline in the caller's thread
+        if not self.enabled:
+            result = self.run_batch(key, [item])[0]
+            self._record(1)
+            return result
+
+        pending = _Pending(item)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError(f"{self.name} is shut down")
+            self._ensure_workers()
+            self._groups.setdefault(key, []).append(pending)
+            self._cond.notify_all()
+
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    # Function returning scheduler statistics for health/metrics endpoints
+    def stats(self):
+        """Return batch counters and current queue depth."""
+        with self._cond:
+            queued = sum(len(p) for p in self._groups.values())
+            return {
+                'enabled': self.enabled,
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000.0,
+                'workers': self.num_workers,
+                'eager': self.eager,
+                'batches': self._batches,
+                'items': self._items,
+                'avg_batch_size': (self._items / self._batches) if self._batches else 0.0,
+                'largest_batch': self._max_seen,
+                'queued': queued,
+            }
+
+    # Function to stop dispatcher threads (pending items are failed)
+    def shutdown(self):
+        """Stop the dispatchers and fail anything still queued."""
+        with self._cond:
+            self._closed = True
+            leftovers = [p for group in self._groups.values() for p in group]
+            self._groups.clear()
+            self._cond.notify_all()
+        for pending in leftovers:
+            pending.error = RuntimeError(f"{self.name} is shut down")
+            pending.done.set()
+
+    # ---------- internals ----------
+    def _ensure_workers(self):
+        # Called with the condition held
+        while len(self._workers) < self.num_workers:
+            thread = threading.Thread(
+                target=self._dispatch_loop,
+                name=f"{self.name}-{len(self._workers)}",
+                daemon=True,
+            )
+            self._workers.append(thread)
+            thread.start()
+
+    def _record(self, size):
+        self._batches += 1
+        self._items += size
+        self._max_seen = max(self._max_seen, size)
+
+    def _take_ready_batch(self):
+        """Block until some group is full or its wait window expired; pop it."""
+        with self._cond:
+            while True:
+                if self._closed:
+                    return None, None
+                now = time.monotonic()
+                next_deadline = None
+                for key, group in self._groups.items():
+                    deadline = group[0].enqueued_at + self.max_wait
+                    idle = self.eager and not self._running.get(key)
+                    if len(group) >= self.max_batch_size or now >= deadline or idle:
+                        batch = group[:self.max_batch_size]
+                        rest = group[self.max_batch_size:]
+                        if rest:
+                            self._groups[key] = rest
+                            # Leftovers keep their place but go behind other keys
+                            self._groups.move_to_end(key)
+                        else:
+                            del self._groups[key]
+                        self._record(len(batch))
+                        self._running[key] = self._running.get(key, 0) + 1
+                        return key, batch
+                    if next_deadline is None or deadline < next_deadline:
+                        next_deadline = deadline
+                timeout = None if next_deadline is None else max(0.0, next_deadline - now)
+                self._cond.wait(timeout)
+
+    def _dispatch_loop(self):
+        while True:
+            key, batch = self._take_ready_batch()
+            if batch is None:
+                return
+            try:
+                results = self.run_batch(key, [p.item for p in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(
+                        f"{self.name}: run_batch returned {len(results)} results for {len(batch)} items"
+                    )
+                for pending, result in zip(batch, results):
+                    pending.result = result
+            except Exception as e:
+                # Every caller of the failed batch receives the error
+                for pending in batch:
+                    pending.error = e
+            finally:
+                for pending in batch:
+                    pending.done.set()
+                with self._cond:
+                    self._running[key] -= 1
+                    if not self._running[key]:
+                        del self._running[key]
+                    # Eager groups of this key may start now
+                    self._cond.notify_all()
@@ -0,0 +1,76 @@
+"""
+Palette lookup for color segmentation maps.
+A Palette maps every 24-bit RGB color to a class id through a
+precomputed lookup table (16 MB of uint8, built once on first use), so
+converting a whole HxWx3 canvas is one packed-index gather instead of a
+pass per palette entry. Matching rules:
+- a color equal to a palette entry gets that entry's class;
+- otherwise the first entry (in palette order) whose channels are all
+  within `tolerance` of the color wins;
+- colors matching no entry get `default`.
+"""
+# Import threading so concurrent first requests build the table only once
+import threading
+# Import numpy for the lookup table
+import numpy as np
+
+
+# Pixels converted per band (the packed indices of a band fit in L2 cache)
+CHUNK_PIXELS = 64 * 1024
+
+
+class Palette:
+    """RGB color -> class id lookup with explicit tolerance and first-match ties."""
+
+    # colors: Ordered mapping of (r, g, b) -> class id (0-255)
+    # tolerance: Largest per-channel difference still matching an entry
+    # default: Class id of colors matching no entry
+    def __init__(self, colors, tolerance=30, default=0):
+        self.colors = dict(colors)
+        self.tolerance = int(tolerance)
+        self.default = int(default)
+        self._lut = None
+        self._lock = threading.Lock()
+
+    # Function returning the flat lookup table indexed by (r << 16) | (g << 8) | b
+    @property
+    def lut(self):
+        if self._lut is None:
+            with self._lock:
+                if self._lut is None:
+                    self._lut = self._build()
+        return self._lut
+
+    def _build(self):
+        lut = np.full((256, 256, 256), self.default, dtype=np.uint8)
+        t = self.tolerance
+        # Paint the tolerance cubes last-to-first so earlier entries win overlaps
+        for (r, g, b), class_id in reversed(list(self.colors.items())):
+            lut[max(0, r - t):r + t + 1, max(0, g - t):g + t + 1, max(0, b - t):b + t + 1] = class_id
+        # Exact colors win over any other entry's tolerance cube
+        for (r, g, b), class_id in self.colors.items():
+            lut[r, g, b] = class_id
+        return lut.reshape(-1)
+
+    # Function converting an RGB array to class ids in one pass
+    # rgb: [H, W, 3] uint8 array
+    # Returns: [H, W] uint8 label array
+    def label_map(self, rgb):
+        rgb = np.asarray(rgb, dtype=np.uint8)
+        lut = self.lut
+        labels = np.empty(rgb.shape[:2], dtype=np.uint8)
+        # Work in bands of rows so the packed indices stay in cache
+        rows = max(1, CHUNK_PIXELS // max(1, rgb.shape[1]))
+        for y in range(0, rgb.shape[0], rows):
+            band = rgb[y:y + rows]
+            packed = band[..., 0].astype(np.uint32)
+            packed <<= 8
+            packed |= band[..., 1]
+            packed <<= 8
+            packed |= band[..., 2]
+            np.take(lut, packed, out=labels[y:y + rows])
+        return labels
+
+    # Function returning the class id of a single color
+    def class_id(self, r, g, b):
+        return int(self.lut[(int(r) << 16) | (int(g) << 8) | int(b)])
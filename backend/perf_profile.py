@@ -0,0 +1,76 @@
+"""
+Per-host performance profile written by autotune.py.
+The profile maps configuration variables (TORCH_THREADS, STYLE_BACKEND,
+STYLE_TILE_SIZE, ESRGAN_TILE, ...) to the values measured fastest on
+this machine. apply_profile() installs them as defaults before the
+modules read their configuration, so variables set explicitly in the
+environment still win. A profile recorded on different hardware is
+ignored.
+"""
+# Import json to read the profile
+import json
+# Import os for paths and the environment
+import os
+# Import platform to identify the host
+import platform
+
+
+# Bumped when the profile layout changes
+PROFILE_VERSION = 1
+# Default location of the profile (override with PERF_PROFILE)
+DEFAULT_PROFILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'perf_profile.json')
+
+
+# Function returning the profile path from PERF_PROFILE or the default
+def profile_path():
+    return os.environ.get('PERF_PROFILE') or DEFAULT_PROFILE_PATH
+
+
+# Function identifying the hardware a profile was measured on
+def host_fingerprint():
+    cpu = platform.processor() or platform.machine()
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    cpu = line.split(':', 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    return {'machine': platform.machine(), 'cpu': cpu, 'cpus': os.cpu_count() or 1}
+
+
+# Function reading a profile file
+# Returns: Profile dict, or None if missing, unreadable or of another version
+def load_profile(path=None):
+    path = path or profile_path()
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            profile = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f" Ignoring unreadable performance profile {path}: {e}")
+        return None
+    if profile.get('version') != PROFILE_VERSION:
+        print(f" Ignoring performance profile {path}: version {profile.get('version')}")
+        return None
+    return profile
+
+
+# Function installing a profile's settings as environment defaults
+# Returns: Names of the settings applied (explicit environment variables are kept)
+def apply_profile(path=None):
+    """Apply this host's autotuned settings unless they are set explicitly."""
+    profile = load_profile(path)
+    if profile is None:
+        return []
+    if profile.get('host') != host_fingerprint():
+        print(f" Ignoring performance profile measured on other hardware: {profile.get('host')}")
+        return []
+    applied = []
+    for name, value in profile.get('settings', {}).items():
+        if name not in os.environ:
+            os.environ[name] = str(value)
+            applied.append(name)
+    return applied
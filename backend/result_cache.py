@@ -0,0 +1,329 @@
+"""
+Content-addressed cache for generated images.
+Results are keyed by a hash of the input bytes, the engine, the model
+identity and the processing parameters. Hot entries live in a bounded
+in-memory LRU tier; everything is also written to a bounded on-disk
+store that evicts the least recently used files when it grows too big.
+The on-disk store may be shared by several processes (the forked
+serve.py workers): lookups open the entry's file directly, writes happen
+on a background thread, and the size budget is enforced for the whole
+directory under a file lock. Writers keep a running total of the store's
+size in a small index file next to the entries, so a write only costs a
+read and rewrite of that file; the directory is scanned at startup and
+when the total goes over budget, with file modification times as the
+shared LRU order.
+"""
+# Import hashlib to build content-addressed keys
+import hashlib
+# Import json for a canonical encoding of the parameters
+import json
+# Import os for the on-disk store
+import os
+# Import threading to guard both tiers
+import threading
+# Import time for the LRU timestamps of disk entries
+import time
+# Import ThreadPoolExecutor so disk writes never block a request
+from concurrent.futures import ThreadPoolExecutor
+# Import OrderedDict for the in-memory LRU tier
+from collections import OrderedDict
+
+# Import fcntl for the directory lock shared between processes (POSIX only)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# Function to build a cache key for one generation
+# data: Raw input bytes (or any bytes-like canonical input)
+# engine: Engine name (stylize, spade, enhance, ...)
+# model: Model identity (name, path fingerprint or checksum)
+# params: Dict of processing parameters that influence the output
+# Returns: Hex digest usable as cache key and ETag
+def cache_key(data, engine, model=None, params=None):
+    """Hash the input bytes together with everything that affects the output."""
+    digest = hashlib.sha256()
+    header = json.dumps({'engine': engine, 'model': model, 'params': params or {}},
+                        sort_keys=True, default=str)
+    digest.update(header.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(data)
+    return digest.hexdigest()
+
+
+# Function to fingerprint a model file without hashing its contents
+# Returns: String combining file name, size and modification time
+def file_fingerprint(path):
+    """Cheap identity for a checkpoint: changes whenever the file is replaced."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return os.path.basename(path)
+    return f'{os.path.basename(path)}:{st.st_size}:{st.st_mtime_ns}'
+
+
+class ResultCache:
+    """
+    Two-tier (memory + disk) byte cache with size-based LRU eviction.
+    A disabled cache never stores anything and always misses.
+    """
+
+    # directory: Root of the on-disk store (None = memory tier only)
+    # max_disk_bytes: Size budget of the on-disk store
+    # max_memory_bytes: Size budget of the in-memory tier
+    def __init__(self, directory=None, max_disk_bytes=1 << 30, max_memory_bytes=64 << 20, enabled=True):
+        self.enabled = enabled
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.max_memory_bytes = max_memory_bytes
+
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        # Size of the on-disk store as of the last directory scan
+        self._disk_entries = 0
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        # Background writer, created lazily in the process that uses it
+        self._executor = None
+        self._executor_pid = None
+        self._pending = set()
+
+        self._hits = {'memory': 0, 'disk': 0}
+        self._misses = 0
+        self._evictions = 0
+
+        if self.enabled and self.directory:
+            self._rebuild_index()
+
+    # Function to look up a cached result
+    # Returns: Cached bytes, or None on a miss
+    def get(self, key):
+        if not self.enabled or key is None:
+            return None
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self._hits['memory'] += 1
+                return data
+        # No index: another process may have written the entry
+        if self.directory:
+            data = self._read_disk(key)
+            if data is not None:
+                with self._lock:
+                    self._hits['disk'] += 1
+                    self._remember(key, data)
+                return data
+        with self._lock:
+            self._misses += 1
+        return None
+
+    # Function to store a result in both tiers (the disk write happens in the background)
+    def put(self, key, data):
+        if not self.enabled or key is None or data is None:
+            return
+        with self._lock:
+            self._remember(key, data)
+            if not self.directory:
+                return
+            # Forked workers must not reuse the parent's (threadless) executor
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='result-cache')
+                self._executor_pid = os.getpid()
+                self._pending = set()
+            future = self._executor.submit(self._write_disk, key, data)
+            self._pending.add(future)
+        future.add_done_callback(self._write_done)
+
+    # Function waiting until queued disk writes have finished
+    def flush(self):
+        with self._lock:
+            pending = list(self._pending)
+        for future in pending:
+            future.result()
+
+    def _write_done(self, future):
+        with self._lock:
+            self._pending.discard(future)
+
+    # Function returning hit/miss counters and tier sizes
+    def stats(self):
+        with self._lock:
+            hits = self._hits['memory'] + self._hits['disk']
+            lookups = hits + self._misses
+            return {
+                'enabled': self.enabled,
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+                'max_memory_bytes': self.max_memory_bytes,
+                'disk_entries': self._disk_entries,
+                'disk_bytes': self._disk_bytes,
+                'max_disk_bytes': self.max_disk_bytes if self.directory else 0,
+                'memory_hits': self._hits['memory'],
+                'disk_hits': self._hits['disk'],
+                'misses': self._misses,
+                'hit_rate': (hits / lookups) if lookups else 0.0,
+                'evictions': self._evictions,
+            }
+
+    # ---------- memory tier (called with self._lock held) ----------
+    def _remember(self, key, data):
+        if len(data) > self.max_memory_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old)
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_memory_bytes and self._memory:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    # ---------- disk tier ----------
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f'{key}.bin')
+
+    def _scan_disk(self):
+        # Returns: List of (mtime_ns, path, size), least recently used first
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith('.bin'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime_ns, path, st.st_size))
+        entries.sort()
+        with self._lock:
+            self._disk_entries = len(entries)
+            self._disk_bytes = sum(size for _, _, size in entries)
+        return entries
+
+    def _read_disk(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            # Touch the file: modification times are the LRU order of all processes
+            now = time.time_ns()
+            os.utime(path, ns=(now, now))
+            return data
+        except OSError:
+            return None
+
+    def _write_disk(self, key, data):
+        path = self._path(key)
+        # Unique per process and thread: workers may write the same key at once
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            now = time.time_ns()
+            os.utime(tmp_path, ns=(now, now))
+        except OSError as e:
+            print(f"Result cache write failed: {e}")
+            return
+        lock_fd = self._lock_directory()
+        try:
+            try:
+                replaced = os.stat(path).st_size
+            except OSError:
+                replaced = None
+            try:
+                # Atomic rename: readers never see a partially written entry
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"Result cache write failed: {e}")
+                return
+            if lock_fd is None:
+                return
+            index = self._read_index()
+            if index is None:
+                entries, total = self._account(self._scan_disk())
+            else:
+                entries, total = index
+                if replaced is None:
+                    entries += 1
+                total += len(data) - (replaced or 0)
+            if total > self.max_disk_bytes:
+                entries, total = self._evict()
+            self._write_index(entries, total)
+            with self._lock:
+                self._disk_entries = entries
+                self._disk_bytes = total
+        finally:
+            if lock_fd is not None:
+                os.close(lock_fd)
+
+    # ---------- shared size index (called with the directory lock held) ----------
+    def _index_path(self):
+        return os.path.join(self.directory, '.size')
+
+    # Function taking the directory lock shared by every process using the store
+    # Returns: Open descriptor holding the lock, or None if it cannot be taken
+    def _lock_directory(self):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            lock_fd = os.open(os.path.join(self.directory, '.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError as e:
+            print(f"Result cache size accounting skipped: {e}")
+            return None
+        if fcntl is not None:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        return lock_fd
+
+    # Returns: (entries, bytes) recorded by the last writer, or None if missing or unreadable
+    def _read_index(self):
+        try:
+            with open(self._index_path()) as f:
+                entries, total = (int(v) for v in f.read().split())
+        except (OSError, ValueError):
+            return None
+        return entries, total
+
+    def _write_index(self, entries, total):
+        try:
+            with open(self._index_path(), 'w') as f:
+                f.write(f'{entries} {total}')
+        except OSError as e:
+            print(f"Result cache index write failed: {e}")
+
+    @staticmethod
+    def _account(entries):
+        return len(entries), sum(size for _, _, size in entries)
+
+    # Function rescanning the directory into the index (used at startup)
+    def _rebuild_index(self):
+        lock_fd = self._lock_directory()
+        if lock_fd is None:
+            self._scan_disk()
+            return
+        try:
+            self._write_index(*self._account(self._scan_disk()))
+        finally:
+            os.close(lock_fd)
+
+    # Function enforcing max_disk_bytes over the whole (shared) directory
+    # Returns: (entries, bytes) left in the store after eviction
+    def _evict(self):
+        entries = self._scan_disk()
+        count, total = self._account(entries)
+        evicted = 0
+        # Always keep the newest entry, even if it alone exceeds the budget
+        for _, path, size in entries[:-1]:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+        with self._lock:
+            self._evictions += evicted
+        return count - evicted, total
@@ -0,0 +1,188 @@
+"""
+Pre-fork multi-process server for the CreativeCollab backend.
+
+The parent process loads every model once, moves the weights into shared
+memory and then forks the workers, which all accept connections on the
+same listening socket. Workers map the parent's weight pages instead of
+loading their own copies, so total RSS stays roughly constant as workers
+are added, and each worker gets its own slice of the CPU cores for torch
+intra-op parallelism.
+
+Limitation: background jobs (JobManager), SPADE drawing sessions and the
+admission budgets live in each process's memory. With several workers a
+job polled through another worker would 404 (making /stylize/video
+unusable), sessions would lose their previous canvas, and the admission
+limits would allow workers x the budget. Until that state is shared,
+the server refuses to start more than MAX_WORKERS worker(s); the
+worker still preloads in the parent, shares weights and restarts on
+crashes.
+
+Usage:
+    python serve.py --port 5000
+"""
+# Import argparse for command-line options
+import argparse
+# Import os for fork/wait and CPU count
+import os
+# Import signal to stop workers cleanly
+import signal
+# Import socket to create the shared listening socket
+import socket
+# Import sys to exit from worker processes
+import sys
+# Import time to throttle worker restarts
+import time
+
+# Import torch to configure thread pools and share weights
+import torch
+# Import werkzeug's server so workers can serve on an inherited socket
+from werkzeug.serving import make_server
+
+
+# Largest number of workers while job, session and admission state is per-process
+MAX_WORKERS = 1
+
+
+# Function to move a module's parameters and buffers into shared memory
+# module: torch.nn.Module whose tensors should be shared with forked workers
+# Returns: Number of bytes moved into shared memory
+def share_model_memory(module):
+    """Place all parameters and buffers of module in shared memory."""
+    total = 0
+    for tensor in list(module.parameters()) + list(module.buffers()):
+        if tensor.device.type != 'cpu':
+            # GPU tensors cannot be shared across fork
+            continue
+        # Storages that cannot be resized wrap external memory (mapped weight
+        # files): their pages are already shared with the forked workers
+        if not tensor.is_shared() and tensor.untyped_storage().resizable():
+            tensor.share_memory_()
+        total += tensor.numel() * tensor.element_size()
+    return total
+
+
+# Function to split the machine's cores between workers
+# workers: Number of worker processes
+# cpus: Number of available cores (default: os.cpu_count())
+# Returns: Intra-op thread count per worker (at least 1)
+def worker_thread_budget(workers, cpus=None):
+    cpus = cpus or os.cpu_count() or 1
+    return max(1, cpus // max(1, workers))
+
+
+# Function executed in each forked worker
+def _run_worker(app_module, sock, threads, index):
+    # Each worker owns a share of the cores for intra-op parallelism
+    torch.set_num_threads(threads)
+    print(f"[worker {index}] pid={os.getpid()} torch threads={threads}")
+
+    # Warm up in the worker: dummy forwards run here, after fork, so the
+    # parent never starts an OpenMP thread pool that children would inherit
+    if app_module.WARMUP_ENABLED:
+        app_module.start_warmup()
+
+    server = make_server(
+        sock.getsockname()[0], sock.getsockname()[1], app_module.app,
+        threaded=True, fd=sock.fileno(),
+    )
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.serve_forever()
+    finally:
+        os._exit(0)
+
+
+# Function to fork one worker process
+# Returns: Child pid (in the parent)
+def _spawn(app_module, sock, threads, index):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            _run_worker(app_module, sock, threads, index)
+        finally:
+            os._exit(1)
+    return pid
+
+
+# Function to parse and validate the command line
+# argv: Arguments (default: sys.argv[1:])
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-fork multi-process backend server")
+    parser.add_argument("--host", default=os.environ.get('HOST', '0.0.0.0'),
+                        help="interface to listen on")
+    parser.add_argument("--port", type=int, default=int(os.environ.get('PORT', '5000')),
+                        help="port to listen on, default is 5000")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get('SERVE_WORKERS', '1')),
+                        help=f"number of worker processes (at most {MAX_WORKERS}, see the module docstring)")
+    parser.add_argument("--threads-per-worker", type=int, default=int(os.environ.get('SERVE_THREADS_PER_WORKER', '0')),
+                        help="torch intra-op threads per worker, default splits the cores evenly")
+    parser.add_argument("--backlog", type=int, default=128,
+                        help="listen backlog of the shared socket")
+    args = parser.parse_args(argv)
+    if not 1 <= args.workers <= MAX_WORKERS:
+        parser.error(f"--workers must be between 1 and {MAX_WORKERS}: jobs, SPADE sessions and "
+                     f"admission budgets are kept per process and would not be seen by other workers")
+    return args
+
+
+def main():
+    args = parse_args()
+    workers = args.workers
+    threads = args.threads_per_worker or worker_thread_budget(workers)
+
+    # Load weights with a single thread: the parent must not create an
+    # OpenMP pool before forking (it is not fork-safe)
+    torch.set_num_threads(1)
+    import app as app_module
+
+    print(f"Preloading models in parent pid={os.getpid()}...")
+    modules = app_module.preload_models()
+    shared = sum(share_model_memory(m) for m in modules)
+    print(f"Shared {len(modules)} models ({shared / (1024 * 1024):.1f} MB) with workers")
+
+    # One listening socket shared by every worker
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(args.backlog)
+    sock.set_inheritable(True)
+    print(f"Listening on {args.host}:{args.port} with {workers} workers x {threads} threads")
+
+    children = {}
+    for index in range(workers):
+        children[_spawn(app_module, sock, threads, index)] = index
+
+    stopping = False
+
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    # Supervise: restart workers that die unexpectedly
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        index = children.pop(pid, None)
+        if index is None or stopping:
+            continue
+        print(f"[worker {index}] pid={pid} exited with status {status}, restarting")
+        time.sleep(1)
+        children[_spawn(app_module, sock, threads, index)] = index
+
+    sock.close()
+
+
+if __name__ == '__main__':
+    main()
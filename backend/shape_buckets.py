@@ -0,0 +1,75 @@
+"""
+Shape bucketing for style model inputs.
+Uploads come in arbitrary sizes, and every new input shape makes the
+compiled graph and the oneDNN primitive caches warm up again. Rounding
+each side up to a canonical bucket (a multiple of 4, so TransformerNet's
+two stride-2 convolutions and two upsamples round-trip exactly) keeps
+the number of distinct shapes small. The caller pads to the bucket and
+crops the output back. Padding reflects the image, which keeps its
+statistics close to the original; reflection cannot pad by as much as
+the image side, so small inputs in a large bucket are padded by
+replicating the edge pixels instead. Hit rates are tracked either way, so it is easy to
+see how often the model gets a shape it has already run.
+"""
+# Import threading for the statistics lock
+import threading
+# Import OrderedDict to bound the set of remembered shapes
+from collections import OrderedDict
+
+
+class ShapeBuckets:
+    """Rounds input sizes up to canonical buckets and counts shape reuse."""
+
+    # step: Bucket granularity in pixels, rounded up to a multiple of 4 (0 = no bucketing)
+    # max_shapes: Number of distinct shapes remembered for hit/miss accounting
+    def __init__(self, step=0, max_shapes=1024):
+        step = max(0, int(step))
+        self.step = -(-step // 4) * 4
+        self.max_shapes = max_shapes
+        # shape key -> number of runs
+        self._shapes = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.step > 0
+
+    # Function returning the padded (height, width) a batch of this size runs at
+    def bucket(self, h, w):
+        if not self.step:
+            return h, w
+        return -(-h // self.step) * self.step, -(-w // self.step) * self.step
+
+    # Function recording one forward at a shape
+    # key: Anything identifying the compiled graph, e.g. (model id, batch, height, width)
+    # Returns: True if this shape has been run before
+    def record(self, key):
+        with self._lock:
+            hit = key in self._shapes
+            if hit:
+                self._hits += 1
+                self._shapes[key] += 1
+                self._shapes.move_to_end(key)
+            else:
+                self._misses += 1
+                self._shapes[key] = 1
+                while len(self._shapes) > self.max_shapes:
+                    self._shapes.popitem(last=False)
+            return hit
+
+    # Function returning bucket counters and the most used shapes
+    def stats(self, top=5):
+        with self._lock:
+            total = self._hits + self._misses
+            busiest = sorted(self._shapes.items(), key=lambda kv: kv[1], reverse=True)[:top]
+            return {
+                'enabled': self.enabled,
+                'step': self.step,
+                'shapes': len(self._shapes),
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': (self._hits / total) if total else 0.0,
+                'top': [{'shape': list(key[-3:]), 'runs': runs} for key, runs in busiest],
+            }
@@ -2,6 +2,10 @@
 import os
 # Import sys for path manipulation
 import sys
+# Import threading so concurrent first requests load the model only once
+import threading
+# Import functools to cache palettes built for non-default tolerances
+import functools
 # Import cv2 (OpenCV) for image processing (not directly used but may be needed)
 import cv2
 # Import numpy for array operations
@@ -10,8 +14,16 @@ import numpy as np
 from PIL import Image
 # Import PyTorch for deep learning operations
 import torch
+# Import functional API for padding tiles
+import torch.nn.functional as F
 # Import ToPILImage for converting tensors back to PIL Images
 from torchvision.transforms import ToPILImage
+# Import stage timers reported by /metrics
+from metrics import stage
+# Import the palette lookup shared by both color -> class conversions
+from palette import Palette
+# Import the overlapping tile runner shared with style transfer
+from tiled_inference import run_tiled
 
 # Add spade folder to Python path so we can import SPADE modules
 spade_flask_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../spade/gaugan/flask'))
@@ -53,8 +65,20 @@ from spade.dataset import get_transform
 # Global model instance (loaded once using singleton pattern)
 # This avoids reloading the model on every request, improving performance
 _model = None
+# Lock held while the model is being loaded (warmup and requests may race)
+_model_lock = threading.Lock()
 # Determine computation device: use CUDA GPU if available, otherwise CPU
 _device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+# Directory holding the pretrained SPADE generator checkpoint
+TRAINED_MODEL_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../spade/gaugan/trained_model/landscapes'))
+# Generator checkpoint file (its identity is part of result cache keys)
+CHECKPOINT_PATH = os.path.join(TRAINED_MODEL_DIR, 'latest_net_G.pth')
+# Seed of the generator's noise input (the latent of VAE models): every image
+# draws it from its own generator seeded with this value, so an identical label
+# map gives the same image whatever batch it is part of
+GENERATION_SEED = int(os.environ.get('SPADE_SEED', '0'))
+# Latent size of VAE models whose options do not say otherwise
+DEFAULT_Z_DIM = 256
 
 # Function to load SPADE model using singleton pattern
 # Returns: Loaded SPADE model instance
@@ -67,11 +91,24 @@ def load_spade_model():
     if _model is not None:
         return _model
     
+    with _model_lock:
+        # Another thread may have finished loading while we waited
+        if _model is not None:
+            return _model
+        return _load_spade_model_locked()
+
+
+# Function reporting whether the SPADE model is resident
+def spade_model_loaded():
+    return _model is not None
+
+
+# Function doing the actual SPADE model load (called with _model_lock held)
+def _load_spade_model_locked():
+    global _model
     try:
         # Path to pretrained model directory
-        base_dir = os.path.dirname(__file__)
-        # Construct path to trained model directory
-        trainedmodel_dir = os.path.abspath(os.path.join(base_dir, '../spade/gaugan/trained_model/landscapes'))
+        trainedmodel_dir = TRAINED_MODEL_DIR
         
         print(f"Looking for trained model in: {trainedmodel_dir}")
         
@@ -80,7 +117,7 @@ def load_spade_model():
             raise FileNotFoundError(f"model directory not found: {trainedmodel_dir}")
         
         # Check if model checkpoint file exists
-        model_file = os.path.join(trainedmodel_dir, 'latest_net_G.pth')
+        model_file = CHECKPOINT_PATH
         if not os.path.exists(model_file):
             raise FileNotFoundError(f"Model file not found: {model_file}")
         
@@ -132,144 +169,252 @@ COLOR_TO_CLASS = {
     (0, 0, 0): 181,        # unknown/background (black)
 }
 
+# Largest per-channel difference between a drawn color and its palette color
+COLOR_TOLERANCE = 30
+# Class id of colors matching no palette entry (last valid class of 182)
+UNKNOWN_CLASS = 181
+# Palette lookup used for whole label maps and single colors alike: an exact
+# color wins, otherwise the first COLOR_TO_CLASS entry within tolerance
+SPADE_PALETTE = Palette(COLOR_TO_CLASS, tolerance=COLOR_TOLERANCE, default=UNKNOWN_CLASS)
+
+
+# Function returning the palette for a tolerance (each one holds a 16 MB table)
+@functools.lru_cache(maxsize=4)
+def _palette(tolerance):
+    if tolerance == SPADE_PALETTE.tolerance:
+        return SPADE_PALETTE
+    return Palette(COLOR_TO_CLASS, tolerance=tolerance, default=UNKNOWN_CLASS)
+
+
 # Function to convert RGB color to class ID with tolerance matching
 # r, g, b: RGB color values (0-255)
 # tolerance: Maximum allowed difference in each channel for matching (default: 30)
 # Returns: Class ID (0-181) or 181 (unknown) if no match found
-def rgb_to_class_id(r, g, b, tolerance=30):
+def rgb_to_class_id(r, g, b, tolerance=COLOR_TOLERANCE):
     """
     Convert RGB color to class ID with tolerance for color matching.
     Returns class ID or 181 (unknown) if no match found.
     """
-    # Try exact match first (fastest path)
-    if (r, g, b) in COLOR_TO_CLASS:
-        return COLOR_TO_CLASS[(r, g, b)]
-    
-    # Try approximate match with tolerance
-    # Iterate through all color mappings
-    for (cr, cg, cb), class_id in COLOR_TO_CLASS.items():
-        # Check if all channels are within tolerance
-        if abs(r - cr) <= tolerance and abs(g - cg) <= tolerance and abs(b - cb) <= tolerance:
-            return class_id
+    return _palette(tolerance).class_id(r, g, b)
+
+
+# Function to convert a color segmentation map to class IDs
+# seg_array: [H, W, 3] uint8 RGB array
+# Returns: [H, W] uint8 label array (same rules as rgb_to_class_id)
+def label_array_from_rgb(seg_array, tolerance=COLOR_TOLERANCE):
+    return _palette(tolerance).label_map(seg_array)
+
+# Number of semantic classes of the generator (0-181)
+LABEL_NC = 182
+# Side of the square label map the generator runs at
+SPADE_SIZE = 512
+
+# Transform configuration for the generator's input
+_transform_opt = {
+    'label_nc': LABEL_NC,  # Number of classes
+    'crop_size': SPADE_SIZE,  # Size to crop to
+    'load_size': SPADE_SIZE,  # Size to load at
+    'aspect_ratio': 1.0,  # Square aspect ratio
+    'isTrain': False,  # Inference mode
+}
+
+
+# Function to convert a segmentation map to class IDs at its own resolution
+# seg_image: PIL Image (RGB image with semantic colors)
+# Returns: [H, W] uint8 label array
+def label_array_from_image(seg_image):
+    """Convert a color segmentation map to a class ID array"""
+    # Convert PIL image to numpy array for processing
+    seg_array = np.asarray(seg_image.convert('RGB'))
     
-    # Default to unknown class (181) if no match found
-    return 181
+    # Convert RGB colors to class IDs with one palette lookup per pixel
+    height, width = seg_array.shape[:2]
+    print(f"Converting {height}x{width} image to label map...")
+    with stage('spade', 'label_map'):
+        return label_array_from_rgb(seg_array)
 
-# Main function to generate image from segmentation map using SPADE model
-# segmentation_path: Path to input segmentation map image (RGB image with semantic colors)
-# output_name: Filename for the generated output image
-# Returns: Path to the generated image file
-def generate_image(segmentation_path, output_name="output.jpg"):
-    """
-    Generate image from segmentation map using SPADE model
+
+# Function to resize a label array to the generator's label tensor
+# label_array: [H, W] uint8 class IDs
+# Returns: Long tensor [1, SPADE_SIZE, SPADE_SIZE] of class IDs
+def label_tensor_from_array(label_array):
+    """Resize a class ID array to the generator's square input"""
+    # Create labelmap image from numpy array (grayscale mode)
+    labelmap = Image.fromarray(label_array, mode='L')
     
-    Args:
-        segmentation_path: Path to segmentation map image
-        output_name: Name for output file
+    # Get transform for label map (nearest neighbor, no normalization)
+    transform_label = get_transform(_transform_opt, method=Image.NEAREST, normalize=False)
     
-    Returns:
-        Path to generated image
-    """
-    try:
-        # Create output directory if it doesn't exist
-        os.makedirs("images/spade-output", exist_ok=True)
-        # Construct full output path
-        output_path = os.path.join("images/spade-output", output_name)
-        
-        # Load SPADE model (singleton pattern - loads once, reuses)
-        model = load_spade_model()
-        
-        # Load segmentation map image
-        seg_image = Image.open(segmentation_path).convert('RGB')
-        # Convert PIL image to numpy array for processing
-        seg_array = np.array(seg_image)
-        
-        # Convert RGB colors to class IDs using vectorized operations
-        # Get image dimensions
-        height, width = seg_array.shape[:2]
-        # Use 181 as unknown (last valid class for 182 classes: 0-181)
-        # Initialize label array with unknown class ID
-        label_array = np.full((height, width), 181, dtype=np.uint8)  # Default to unknown
-        
-        print(f"Converting {height}x{width} image to label map...")
-        
-        # Vectorized color matching with tolerance (much faster than pixel-by-pixel)
-        for (cr, cg, cb), class_id in COLOR_TO_CLASS.items():
-            # Create masks for pixels within tolerance in each channel
-            # Convert to int16 to handle negative differences
-            r_diff = np.abs(seg_array[:, :, 0].astype(np.int16) - cr)
-            g_diff = np.abs(seg_array[:, :, 1].astype(np.int16) - cg)
-            b_diff = np.abs(seg_array[:, :, 2].astype(np.int16) - cb)
-            
-            # Match if all channels are within tolerance (30 pixels)
-            mask = (r_diff <= 30) & (g_diff <= 30) & (b_diff <= 30)
-            # Assign class ID to matching pixels
-            label_array[mask] = class_id
-        
-        # Create labelmap image from numpy array (grayscale mode)
-        labelmap = Image.fromarray(label_array, mode='L')
-        
-        # Setup transform configuration
-        opt = {
-            'label_nc': 182,  # Number of classes
-            'crop_size': 512,  # Size to crop to
-            'load_size': 512,  # Size to load at
-            'aspect_ratio': 1.0,  # Square aspect ratio
-            'isTrain': False,  # Inference mode
-        }
-        
-        # Get transform for label map (nearest neighbor, no normalization)
-        transform_label = get_transform(opt, method=Image.NEAREST, normalize=False)
-        # Get transform for image (used for blank image)
-        transform_image = get_transform(opt)
-        
+    # Resize the label map and build the input tensor
+    with stage('spade', 'to_tensor'):
         # Transform label map
         # transforms.ToTensor rescales from [0,255] to [0.0,1.0]
         # Rescale back to [0,255] to match label IDs
         label_tensor = transform_label(labelmap) * 255.0
         # Ensure values are integers and in valid range [0, 181] for 182 classes
-        label_tensor = label_tensor.long()
+        label_tensor = label_tensor.round().long()
         # Clamp values to valid range (0 to label_nc-1, which is 0-181)
-        label_tensor = torch.clamp(label_tensor, 0, opt['label_nc'] - 1)
-        # The model expects label_nc (182) as unknown, but we'll use 181 (last valid class)
-        # Map any out-of-range values to 181
-        label_tensor[label_tensor >= opt['label_nc']] = opt['label_nc'] - 1
-        
-        # Create blank image for encoder (not used in inference mode but required by model)
-        image_tensor = transform_image(Image.new('RGB', (512, 512)))
-        
-        # Prepare data dictionary for model input
-        data = {
-            'label': label_tensor.unsqueeze(0).long(),  # Add batch dimension, ensure long type
-            'instance': label_tensor.unsqueeze(0).long(),  # Instance map same as label map
-            'image': image_tensor.unsqueeze(0)  # Blank image (not used in inference)
-        }
-        
-        # Generate image using SPADE model
-        print("Generating image with SPADE model...")
-        # Disable gradient computation for inference (saves memory)
-        with torch.no_grad():
-            # Run model in inference mode
+        # The model expects label_nc (182) as unknown, but we use 181 (last valid class)
+        return torch.clamp(label_tensor, 0, LABEL_NC - 1)
+
+
+# Function to convert a segmentation map to the generator's label tensor
+# seg_image: PIL Image (RGB image with semantic colors)
+# Returns: Long tensor [1, SPADE_SIZE, SPADE_SIZE] of class IDs
+def label_tensor_from_image(seg_image):
+    """Convert a color segmentation map to a resized class ID tensor"""
+    return label_tensor_from_array(label_array_from_image(seg_image))
+
+
+# Function to read a generator option (opt may be a dict or a namespace)
+def _model_option(model, name, default=None):
+    opt = getattr(model, 'opt', None)
+    if isinstance(opt, dict):
+        return opt.get(name, default)
+    return getattr(opt, name, default)
+
+
+# Function to build the noise input of a batch
+# count: Number of images in the batch
+# z_dim: Latent size of the generator
+# Returns: [count, z_dim] tensor; row i only depends on GENERATION_SEED
+def item_noise(count, z_dim=DEFAULT_Z_DIM):
+    """One latent per image, each drawn from its own seeded generator"""
+    rows = []
+    for _ in range(count):
+        generator = torch.Generator().manual_seed(GENERATION_SEED)
+        rows.append(torch.randn(1, z_dim, generator=generator))
+    return torch.cat(rows)
+
+
+# Function to run the generator on several label maps in one forward pass
+# label_tensors: List of label tensors [1, SPADE_SIZE, SPADE_SIZE], as returned by label_tensor_from_image
+# Returns: List of generated [3, H, W] tensors in [-1, 1], in the same order
+def generate_tensors(label_tensors):
+    """Stack label maps into one batch, run the SPADE generator once and split the outputs"""
+    # Load SPADE model (singleton pattern - loads once, reuses)
+    model = load_spade_model()
+    
+    labels = torch.stack(label_tensors).long()
+    # Blank image for the encoder (not used in inference mode but required by model)
+    image_tensor = get_transform(_transform_opt)(Image.new('RGB', tuple(labels.shape[-2:])[::-1]))
+    
+    # Prepare data dictionary for model input
+    data = {
+        'label': labels,  # [N, 1, H, W] class IDs
+        'instance': labels,  # Instance map same as label map
+        'image': image_tensor.unsqueeze(0).expand(len(label_tensors), -1, -1, -1)  # Blank images
+    }
+    
+    # Generate images using SPADE model
+    print(f"Generating {len(label_tensors)} image(s) with SPADE model...")
+    # Disable gradient computation for inference (saves memory)
+    with torch.no_grad(), stage('spade', 'forward'):
+        if _model_option(model, 'use_vae', False):
+            # Pass the noise explicitly instead of letting the model draw it from the global RNG
+            input_semantics, _ = model.preprocess_input(data)
+            z = item_noise(len(label_tensors), _model_option(model, 'z_dim', DEFAULT_Z_DIM))
+            generated = model.netG(input_semantics, z=z.to(input_semantics.device))
+        else:
+            # Run model in inference mode (deterministic without a VAE)
             generated = model(data, mode='inference')
-        
-        # Convert to PIL Image
-        to_img = ToPILImage()
-        # Normalize from [-1, 1] to [0, 255]
-        # Handle batch dimension: generated is [1, 3, H, W] or [3, H, W]
-        if len(generated.shape) == 4:
-            generated = generated.squeeze(0)  # Remove batch dimension if present
-        # Convert from [-1, 1] range to [0, 255]
-        normalized_img = ((generated + 1) / 2.0) * 255.0
-        # Clamp to valid pixel range
-        normalized_img = torch.clamp(normalized_img, 0, 255)
-        # Convert tensor to PIL Image
-        output_image = to_img(normalized_img.byte().cpu())
-        
-        # Save output image as JPEG
-        output_image.save(output_path, 'JPEG')
-        
-        print(f"Generated image saved to: {output_path}")
-        return output_path
+    # Handle a missing batch dimension: generated is [N, 3, H, W] or [3, H, W]
+    if len(generated.shape) == 3:
+        generated = generated.unsqueeze(0)
+    return list(generated.cpu())
+
+
+# Function to convert a generator output to a PIL Image
+# generated: [3, H, W] tensor in [-1, 1]
+def tensor_to_image(generated):
+    with stage('spade', 'convert'):
+        # Convert from [-1, 1] range to [0, 255] and clamp to valid pixel range
+        normalized = torch.clamp(((generated + 1) / 2.0) * 255.0, 0, 255)
+        return ToPILImage()(normalized.byte().cpu())
+
+
+# Function to run the generator on several label maps in one forward pass
+# Returns: List of generated PIL Images, in the same order
+def generate_batch(label_tensors):
+    """Generate one PIL image per label tensor with a single forward pass"""
+    return [tensor_to_image(t) for t in generate_tensors(label_tensors)]
+
+
+# Function to generate at a label map's own size and aspect ratio
+# The generator only takes SPADE_SIZE squares, so it runs over overlapping
+# windows of the label map (a core plus context on every side, so both sides
+# of a seam see the same scene) and the cores are feather-blended
+# label_array: [H, W] uint8 class IDs
+# forward: Callable(label tensor [1, SPADE_SIZE, SPADE_SIZE]) -> [3, SPADE_SIZE, SPADE_SIZE]
+#          tensor in [-1, 1] (default: a forward of its own; the server batches tiles)
+# context: Pixels of label context around each tile's core
+# overlap: Pixels blended between neighbouring cores
+# workers: Tiles in flight at once
+# progress: Optional callback(done, total) invoked after every tile
+# Returns: Generated PIL Image of size (W, H)
+def generate_tiled(label_array, forward=None, context=64, overlap=32, workers=1, progress=None):
+    """Generate an image of any size tile by tile"""
+    if forward is None:
+        def forward(label):
+            return generate_tensors([label])[0]
+
+    def window_forward(window):
+        h, w = window.shape[-2:]
+        # Windows of sides shorter than a tile are padded up to the generator's input
+        if (h, w) != (SPADE_SIZE, SPADE_SIZE):
+            window = F.pad(window, (0, SPADE_SIZE - w, 0, SPADE_SIZE - h), mode='replicate')
+        return forward(window[0].round().long())[None, :, :h, :w]
+
+    labels = torch.from_numpy(np.ascontiguousarray(label_array)).float()[None, None]
+    if max(labels.shape[-2:]) <= SPADE_SIZE:
+        # One window holds the whole map: no tiles, no context needed
+        generated = window_forward(labels)
+        if progress is not None:
+            progress(1, 1)
+    else:
+        generated = run_tiled(window_forward, labels, tile_size=SPADE_SIZE, context=context,
+                              overlap=overlap, workers=workers, scale=1, align=1, progress=progress)
+    return tensor_to_image(generated[0])
+
+
+# Function to regenerate one region of a label map's tiled output
+# box: (top, left, bottom, right) of the region in label map pixels
+# The region is generated from a crop grown by context (and up to a full
+# generator window), so it sees the same surrounding labels as a full run
+# Returns: [bottom - top, right - left, 3] uint8 array
+def generate_region(label_array, box, forward=None, context=64, overlap=32, workers=1):
+    """Generate only the pixels of box, using the labels around it as context"""
+    height, width = label_array.shape
+    top, left, bottom, right = box
+
+    def grow(start, end, length):
+        start, end = max(0, start - context), min(length, end + context)
+        # Short crops are widened, around their centre, to a full window of real labels
+        size = max(end - start, min(SPADE_SIZE, length))
+        start = min(max(0, (start + end - size) // 2), length - size)
+        return start, start + size
+
+    y0, y1 = grow(top, bottom, height)
+    x0, x1 = grow(left, right, width)
+    image = generate_tiled(label_array[y0:y1, x0:x1], forward, context, overlap, workers)
+    return np.asarray(image)[top - y0:bottom - y0, left - x0:right - x0]
+
+
+# Main function to generate an image from an in-memory segmentation map
+# seg_image: PIL Image (RGB image with semantic colors)
+# Returns: Generated PIL Image
+def generate_image_pil(seg_image):
+    """
+    Generate image from an in-memory segmentation map using SPADE model
+    
+    Args:
+        seg_image: PIL Image of the segmentation map
+    
+    Returns:
+        Generated PIL Image
+    """
+    try:
+        return generate_batch([label_tensor_from_image(seg_image)])[0]
     
     except FileNotFoundError as e:
         # Handle file not found errors
@@ -282,4 +427,37 @@ def generate_image(segmentation_path, output_name="output.jpg"):
         print(f"Error in generate_image: {error_msg}")
         import traceback
         traceback.print_exc()
-        raise RuntimeError(error_msg) from e
\ No newline at end of file
+        raise RuntimeError(error_msg) from e
+
+
+# Function to generate image from segmentation map file using SPADE model
+# segmentation_path: Path to input segmentation map image (RGB image with semantic colors)
+# output_name: Filename for the generated output image
+# Returns: Path to the generated image file
+def generate_image(segmentation_path, output_name="output.jpg"):
+    """
+    Generate image from segmentation map using SPADE model
+    
+    Args:
+        segmentation_path: Path to segmentation map image
+        output_name: Name for output file
+    
+    Returns:
+        Path to generated image
+    """
+    # Create output directory if it doesn't exist
+    os.makedirs("images/spade-output", exist_ok=True)
+    # Construct full output path
+    output_path = os.path.join("images/spade-output", output_name)
+    
+    # Load segmentation map image and generate
+    with stage('spade', 'file_io'):
+        seg_image = Image.open(segmentation_path).convert('RGB')
+    output_image = generate_image_pil(seg_image)
+    
+    # Save output image as JPEG
+    with stage('spade', 'file_io'):
+        output_image.save(output_path, 'JPEG')
+    
+    print(f"Generated image saved to: {output_path}")
+    return output_path
@@ -0,0 +1,226 @@
+"""
+Per-session state for incremental SPADE regeneration.
+The drawing UI sends the whole canvas after every stroke. A session keeps
+the previous label map and generated output, the next label map is diffed
+against it, and only the changed regions (grown by a margin) have to be
+regenerated and blended into the previous output; regions close enough
+to share a generator window are generated together. Sessions are bounded
+by total memory (least recently used ones are dropped) and expire after
+a period without requests.
+"""
+# Import threading for the store lock
+import threading
+# Import time for session expiry
+import time
+# Import OrderedDict for least recently used eviction
+from collections import OrderedDict
+# Import numpy for the label diff and compositing
+import numpy as np
+
+
+# Previous canvas of one session
+class _Session:
+    __slots__ = ('params', 'labels', 'output', 'nbytes', 'updated')
+
+    def __init__(self, params, labels, output):
+        self.params = params
+        self.labels = labels
+        self.output = output
+        self.nbytes = labels.nbytes + output.nbytes
+        self.updated = time.monotonic()
+
+
+class SessionStore:
+    """Previous label map and output per session id, bounded by memory and age."""
+
+    # max_bytes: Total size of the label maps and outputs kept
+    # ttl: Seconds after which an idle session is forgotten
+    def __init__(self, max_bytes=256 * 1024 * 1024, ttl=900.0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Requests by outcome (full, incremental, unchanged)
+        self._outcomes = {'full': 0, 'incremental': 0, 'unchanged': 0}
+
+    # Function returning a session's previous (labels, output)
+    # params: Generation settings; a session recorded with others is not reused
+    # Returns: (labels, output) arrays, or None
+    def get(self, session_id, params):
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(session_id)
+            if session is None or session.params != params:
+                return None
+            self._sessions.move_to_end(session_id)
+            return session.labels, session.output
+
+    # Function storing a session's latest label map and output
+    def put(self, session_id, params, labels, output):
+        session = _Session(params, labels, output)
+        with self._lock:
+            old = self._sessions.pop(session_id, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            if session.nbytes > self.max_bytes:
+                return
+            self._sessions[session_id] = session
+            self._bytes += session.nbytes
+            while self._bytes > self.max_bytes:
+                _, evicted = self._sessions.popitem(last=False)
+                self._bytes -= evicted.nbytes
+
+    # Function counting one request by how it was answered
+    def record(self, outcome):
+        with self._lock:
+            self._outcomes[outcome] += 1
+
+    # Function returning session counters
+    def stats(self):
+        with self._lock:
+            return {'sessions': len(self._sessions), 'bytes': self._bytes, **self._outcomes}
+
+    def _expire(self):
+        # Called with the lock held; oldest sessions come first
+        now = time.monotonic()
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.updated <= self.ttl:
+                break
+            del self._sessions[session_id]
+            self._bytes -= session.nbytes
+
+
+# Function finding the changed regions between two label maps
+# old, new: [H, W] label arrays of the same shape
+# margin: Pixels added around the changes (changes closer than this share a region)
+# cell: Granularity of the search in pixels
+# Returns: List of (top, left, bottom, right) boxes, empty if nothing changed
+def dirty_boxes(old, new, margin=32, cell=16):
+    """Bounding boxes of the changed areas of a label map, grown by margin."""
+    changed = old != new
+    if not changed.any():
+        return []
+    height, width = changed.shape
+    gh, gw = -(-height // cell), -(-width // cell)
+    padded = np.zeros((gh * cell, gw * cell), dtype=bool)
+    padded[:height, :width] = changed
+    grid = padded.reshape(gh, cell, gw, cell).any(axis=(1, 3))
+
+    # Grow the changed cells by the margin so nearby strokes form one region
+    reach = -(-margin // cell)
+    grown = grid.copy()
+    for dy in range(-reach, reach + 1):
+        for dx in range(-reach, reach + 1):
+            src = grid[max(0, -dy):gh - max(0, dy), max(0, -dx):gw - max(0, dx)]
+            grown[max(0, dy):gh - max(0, -dy), max(0, dx):gw - max(0, -dx)] |= src
+
+    # Connected regions of grown cells
+    boxes = []
+    seen = np.zeros_like(grown)
+    for y, x in zip(*np.nonzero(grown)):
+        if seen[y, x]:
+            continue
+        seen[y, x] = True
+        stack, top, left, bottom, right = [(y, x)], y, x, y, x
+        while stack:
+            cy, cx = stack.pop()
+            top, left, bottom, right = min(top, cy), min(left, cx), max(bottom, cy), max(right, cx)
+            for ny, nx in ((cy - 1, cx), (cy + 1, cx), (cy, cx - 1), (cy, cx + 1)):
+                if 0 <= ny < gh and 0 <= nx < gw and grown[ny, nx] and not seen[ny, nx]:
+                    seen[ny, nx] = True
+                    stack.append((ny, nx))
+        boxes.append((int(top) * cell, int(left) * cell,
+                      min(height, (int(bottom) + 1) * cell), min(width, (int(right) + 1) * cell)))
+
+    # Bounding boxes of separate regions may still overlap: merge them
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                a, b = boxes[i], boxes[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    boxes[i] = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                    del boxes[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return boxes
+
+
+# Function estimating how many generator windows regenerating a box takes
+# (the box grown by context, and a tiled run once a side exceeds the window)
+def _window_cost(box, shape, window, context):
+    top, left, bottom, right = box
+    cost = 1
+    for start, end, length in ((top, bottom, shape[0]), (left, right, shape[1])):
+        side = min(length, end - start + 2 * context)
+        if side > window:
+            cost *= -(-side // max(1, window - 2 * context))
+    return cost
+
+
+# Function grouping changed regions into the regions generated together
+# boxes: (top, left, bottom, right) boxes from dirty_boxes()
+# shape: (H, W) of the label map
+# window: Side of the generator's square input
+# context: Label context the generator sees around a region
+# Returns: List of (region box, member boxes); every member lies inside its region
+def group_boxes(boxes, shape, window=512, context=64):
+    """Merge boxes whenever one generation of their union costs no more than separate ones"""
+    def cost(box):
+        return _window_cost(box, shape, window, context)
+
+    groups = [(box, [box]) for box in boxes]
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(groups)):
+            for j in range(i + 1, len(groups)):
+                (a, members_a), (b, members_b) = groups[i], groups[j]
+                union = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                # Boxes within one window (always the case at 512x512) share its forward
+                if cost(union) <= cost(a) + cost(b):
+                    groups[i] = (union, members_a + members_b)
+                    del groups[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    # Scattered regions costing as much as the whole canvas: one full run instead
+    whole = (0, 0, shape[0], shape[1])
+    if len(groups) > 1 and sum(cost(region) for region, _ in groups) >= cost(whole):
+        return [(whole, list(boxes))]
+    return groups
+
+
+# Function returning a 1-D blending ramp (0 -> 1 over feather pixels at inner edges)
+def _ramp(size, feather, start, end):
+    weights = np.ones(size, dtype=np.float32)
+    n = min(feather, size // 2)
+    if n > 0:
+        ramp = np.arange(1, n + 1, dtype=np.float32) / (n + 1)
+        if start:
+            weights[:n] = ramp
+        if end:
+            weights[size - n:] = np.minimum(weights[size - n:], ramp[::-1])
+    return weights
+
+
+# Function blending a regenerated region into a previous output (in place)
+# output: [H, W, 3] uint8 previous output
+# patch: [h, w, 3] uint8 regenerated pixels of box
+# box: (top, left, bottom, right) in output pixels
+# feather: Width of the blend at edges bordering unchanged pixels (keep it within the margin)
+def composite(output, patch, box, feather=16):
+    top, left, bottom, right = box
+    height, width = output.shape[:2]
+    weight = np.outer(_ramp(bottom - top, feather, top > 0, bottom < height),
+                      _ramp(right - left, feather, left > 0, right < width))[..., None]
+    region = output[top:bottom, left:right].astype(np.float32)
+    blended = region + (patch.astype(np.float32) - region) * weight
+    output[top:bottom, left:right] = np.clip(np.rint(blended), 0, 255).astype(np.uint8)
+    return output
@@ -24,3 +24,88 @@ def test_rgb_to_class_id_matches_exact_color():
 def test_rgb_to_class_id_unknown_defaults():
     assert spade_handler.rgb_to_class_id(1, 2, 3) == 181
 
+
+
+def test_label_map_agrees_with_rgb_to_class_id():
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    colors = np.array(list(spade_handler.COLOR_TO_CLASS), dtype=np.int16)
+    # Palette colors plus antialiasing-like noise around them
+    noisy = colors[rng.integers(0, len(colors), (32, 48))] + rng.integers(-40, 41, (32, 48, 3))
+    seg = np.clip(noisy, 0, 255).astype(np.uint8)
+    labels = spade_handler.label_array_from_rgb(seg)
+    expected = [[spade_handler.rgb_to_class_id(*map(int, px)) for px in row] for row in seg]
+    assert labels.tolist() == expected
+
+
+def test_generate_tiled_keeps_size_and_feeds_generator_sized_windows():
+    import numpy as np
+
+    shapes = []
+
+    def fake_forward(label):
+        shapes.append(tuple(label.shape))
+        # Encode the label in the output so the blend can be checked
+        return (label.float() / 100 - 1).expand(3, -1, -1)
+
+    labels = np.repeat(np.arange(300, dtype=np.uint8)[:, None] % 150, 900, axis=1)
+    image = spade_handler.generate_tiled(labels, fake_forward, workers=2)
+
+    assert image.size == (900, 300)
+    assert set(shapes) == {(1, spade_handler.SPADE_SIZE, spade_handler.SPADE_SIZE)}
+    expected = np.clip(labels / 100 / 2 * 255, 0, 255)
+    assert np.abs(np.asarray(image)[..., 0] - expected).max() <= 1
+
+
+def test_vae_noise_does_not_depend_on_the_batch(monkeypatch):
+    import types
+    import torch
+
+    latents = []
+
+    class FakeVaeModel:
+        opt = {"use_vae": True, "z_dim": 8}
+
+        def preprocess_input(self, data):
+            return data["label"].float(), None
+
+        def netG(self, semantics, z):
+            latents.append(z)
+            return torch.zeros(semantics.shape[0], 3, 4, 4)
+
+    monkeypatch.setattr(spade_handler, "load_spade_model", lambda: FakeVaeModel())
+    monkeypatch.setattr(spade_handler, "get_transform",
+                        lambda opt, **kw: lambda image: torch.zeros(3, *image.size[::-1]))
+    label = torch.zeros(1, 4, 4, dtype=torch.long)
+
+    spade_handler.generate_tensors([label])
+    state = torch.get_rng_state()
+    spade_handler.generate_tensors([label, label, label])
+
+    assert torch.equal(latents[1][0], latents[0][0])
+    assert torch.equal(latents[1][2], latents[0][0])
+    # The process-wide RNG is left alone
+    assert torch.equal(torch.get_rng_state(), state)
+
+
+def test_region_covering_two_boxes_runs_one_forward():
+    import numpy as np
+    from spade_sessions import group_boxes
+
+    forwards = []
+
+    def fake_forward(label):
+        forwards.append(tuple(label.shape))
+        return (label.float() / 100 - 1).expand(3, -1, -1)
+
+    labels = np.zeros((512, 512), dtype=np.uint8)
+    labels[20:40, 20:40] = 100
+    labels[440:470, 400:430] = 150
+    boxes = [(0, 0, 72, 72), (408, 368, 502, 462)]
+    [(region, members)] = group_boxes(boxes, labels.shape)
+
+    patch = spade_handler.generate_region(labels, region, fake_forward)
+
+    assert len(forwards) == 1
+    assert patch.shape[:2] == (region[2] - region[0], region[3] - region[1])
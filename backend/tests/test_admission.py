@@ -0,0 +1,88 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+TEST_ROOT = os.path.dirname(__file__)
+PROJECT_ROOT = os.path.abspath(os.path.join(TEST_ROOT, ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from admission import AdmissionController, AdmissionRejected  # noqa: E402
+
+
+def test_requests_within_budget_run_concurrently():
+    controller = AdmissionController("stylize", budget=2.0, max_queue=0)
+    with controller.admit(1.0), controller.admit(1.0):
+        assert controller.stats()["in_flight"] == 2
+    assert controller.stats()["in_flight_cost"] == 0
+
+
+def test_oversized_request_runs_alone():
+    controller = AdmissionController("stylize", budget=1.0, max_queue=0)
+    with controller.admit(5.0):
+        with pytest.raises(AdmissionRejected):
+            controller.admit(0.1)
+
+
+def test_queued_request_waits_for_budget():
+    controller = AdmissionController("stylize", budget=1.0, max_queue=1, queue_timeout=5)
+    order = []
+    first = controller.admit(1.0)
+
+    def waiter():
+        with controller.admit(1.0):
+            order.append("queued")
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    while controller.stats()["queued"] == 0:
+        time.sleep(0.001)
+    # The queue is full now: a third request is refused with a retry hint
+    with pytest.raises(AdmissionRejected) as exc:
+        controller.admit(1.0)
+    assert exc.value.retry_after >= 1
+
+    order.append("first done")
+    first.__exit__(None, None, None)
+    thread.join(timeout=5)
+    assert order == ["first done", "queued"]
+    assert controller.stats()["rejected"] == 1
+
+
+def test_queue_timeout_rejects():
+    controller = AdmissionController("spade", budget=1.0, max_queue=4, queue_timeout=0.05)
+    with controller.admit(1.0):
+        with pytest.raises(AdmissionRejected) as exc:
+            controller.admit(1.0)
+    assert exc.value.reason == "queue timeout"
+    assert controller.stats()["queued"] == 0
+
+
+def test_wait_ignores_queue_limit():
+    controller = AdmissionController("stylize", budget=1.0, max_queue=0)
+    held = controller.admit(1.0)
+    done = threading.Event()
+
+    def job():
+        with controller.admit(1.0, wait=True):
+            done.set()
+
+    thread = threading.Thread(target=job)
+    thread.start()
+    assert not done.wait(0.05)
+    held.__exit__(None, None, None)
+    assert done.wait(5)
+    thread.join(timeout=5)
+
+
+def test_retry_after_follows_drain_rate():
+    controller = AdmissionController("stylize", budget=1.0, max_queue=0)
+    for _ in range(10):
+        with controller.admit(1.0):
+            pass
+    with controller.admit(1.0):
+        # ~10 units drained in the last second, 1 unit outstanding
+        assert controller.retry_after() == 1
@@ -15,7 +15,7 @@ def client(monkeypatch):
     fake_torch = types.ModuleType("torch")
     fake_torch.cuda = types.SimpleNamespace(is_available=lambda: False)
     fake_torch.load = lambda *args, **kwargs: {}
-    sys.modules["torch"] = fake_torch
+    monkeypatch.setitem(sys.modules, "torch", fake_torch)
 
     fake_tv = types.ModuleType("torchvision")
     fake_tv.transforms = types.SimpleNamespace(
@@ -23,7 +23,7 @@ def client(monkeypatch):
         ToTensor=lambda *a, **k: lambda y: y,
         Lambda=lambda f: f,
     )
-    sys.modules["torchvision"] = fake_tv
+    monkeypatch.setitem(sys.modules, "torchvision", fake_tv)
 
     import app  # noqa: E402
 
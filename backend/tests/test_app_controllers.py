@@ -29,7 +29,11 @@ import app  # noqa: E402
 
 
 @pytest.fixture()
-def client():
+def client(monkeypatch):
+    # Isolate tests from results cached by earlier runs
+    from result_cache import ResultCache
+
+    monkeypatch.setattr(app, "result_cache", ResultCache(enabled=False))
     return app.app.test_client()
 
 
@@ -71,3 +75,708 @@ def test_reset_password_missing_fields(client):
     assert resp.status_code == 400
     assert "required" in resp.get_json()["error"].lower()
 
+
+
+def test_stylize_runs_in_memory_without_writing_files(client, monkeypatch, tmp_path):
+    models_dir = tmp_path / "saved_models"
+    models_dir.mkdir()
+    (models_dir / "mosaic.pth").write_bytes(b"")
+    monkeypatch.setattr(app, "NEURAL_STYLE_DIR", str(tmp_path))
+    monkeypatch.setattr(app, "STYLE_AVAILABLE", True)
+    monkeypatch.setattr(app, "load_style_model", lambda path, device: object())
+    monkeypatch.setattr(app, "stylize_image_bytes", lambda model, data, device, **kwargs: b"styled:" + data)
+    monkeypatch.setattr(app.image_sink, "enabled", False)
+    content_dir = os.path.join(app.BASE_DIR, "content_images")
+    before = set(os.listdir(content_dir)) if os.path.exists(content_dir) else set()
+
+    resp = client.post("/stylize", data={"style": "mosaic", "image": (io.BytesIO(b"raw"), "a.jpg")})
+
+    assert resp.status_code == 200
+    assert resp.data == b"styled:raw"
+    after = set(os.listdir(content_dir)) if os.path.exists(content_dir) else set()
+    assert after == before
+
+
+def test_health_not_ready_during_warmup(client, monkeypatch):
+    import threading
+    from warmup import Warmup
+
+    release = threading.Event()
+    warming = Warmup()
+    warming.add("style", release.wait)
+    warming.start()
+    monkeypatch.setattr(app, "warmup", warming)
+    try:
+        resp = client.get("/health")
+        assert resp.status_code == 503
+        assert resp.get_json()["status"] == "warming_up"
+    finally:
+        release.set()
+    assert warming.wait(timeout=5)
+    assert client.get("/health").status_code == 200
+
+
+def test_job_lifecycle_for_enhance(client, monkeypatch):
+    monkeypatch.setattr(app, "enhance_image_simple", lambda data: b"enhanced:" + data)
+
+    resp = client.post("/jobs", data={"type": "enhance", "image": (io.BytesIO(b"abc"), "a.jpg")})
+    assert resp.status_code == 202
+    job_id = resp.get_json()["id"]
+
+    job = app.jobs.get(job_id)
+    for _ in range(100):
+        if job.finished:
+            break
+        job.wait_for_change(job.version, 0.05)
+    status = client.get(f"/jobs/{job_id}").get_json()
+    assert status["status"] == "succeeded"
+
+    result = client.get(f"/jobs/{job_id}/result")
+    assert result.status_code == 200
+    assert result.data == b"enhanced:abc"
+
+    events = client.get(f"/jobs/{job_id}/events")
+    assert events.mimetype == "text/event-stream"
+    assert b"event: succeeded" in events.data
+
+
+def test_job_rejects_unknown_type(client):
+    resp = client.post("/jobs", data={"type": "teleport"})
+    assert resp.status_code == 400
+
+
+def test_unknown_job_returns_404(client):
+    assert client.get("/jobs/does-not-exist").status_code == 404
+
+
+def test_enhance_result_cache_and_etag(client, monkeypatch):
+    from result_cache import ResultCache
+
+    calls = []
+
+    def fake_enhance(data):
+        calls.append(data)
+        return b"enhanced"
+
+    monkeypatch.setattr(app, "result_cache", ResultCache(directory=None))
+    monkeypatch.setattr(app, "enhance_image_simple", fake_enhance)
+
+    first = client.post("/enhance", data={"image": (io.BytesIO(b"same"), "a.jpg")})
+    assert first.status_code == 200
+    assert first.headers["X-Cache"] == "MISS"
+    etag = first.headers["ETag"]
+
+    second = client.post("/enhance", data={"image": (io.BytesIO(b"same"), "b.jpg")})
+    assert second.headers["X-Cache"] == "HIT"
+    assert second.data == b"enhanced"
+
+    third = client.post("/enhance", data={"image": (io.BytesIO(b"same"), "c.jpg")},
+                        headers={"If-None-Match": etag})
+    assert third.status_code == 304
+    assert len(calls) == 1
+
+
+def test_metrics_endpoint_reports_stages_and_errors(client, monkeypatch):
+    def failing_enhance(data):
+        raise ValueError("broken")
+
+    from PIL import Image
+
+    png = io.BytesIO()
+    Image.new("RGB", (8, 8), (10, 20, 30)).save(png, "PNG")
+    ok = client.post("/enhance", data={"image": (io.BytesIO(png.getvalue()), "a.png")})
+    assert ok.status_code == 200
+
+    monkeypatch.setattr(app, "enhance_image_simple", failing_enhance)
+    failed = client.post("/enhance", data={"image": (io.BytesIO(b"x"), "b.png")})
+    assert failed.status_code == 500
+
+    resp = client.get("/metrics")
+    assert resp.status_code == 200
+    assert resp.mimetype == "text/plain"
+    text = resp.get_data(as_text=True)
+    assert 'creativecollab_stage_seconds_count{engine="enhance_simple",stage="decode"}' in text
+    assert 'creativecollab_stage_seconds_count{engine="enhance_simple",stage="upload_read"}' in text
+    assert 'creativecollab_errors_total{engine="enhance_simple",type="ValueError"}' in text
+    assert 'creativecollab_requests_in_flight{engine="enhance_simple"} 0' in text
+    assert 'creativecollab_models_loaded{engine="style"}' in text
+
+
+def test_enhance_returns_429_when_engine_is_saturated(client, monkeypatch):
+    from admission import AdmissionController
+
+    controller = AdmissionController("enhance_simple", budget=1.0, max_queue=0)
+    monkeypatch.setitem(app.admission, "enhance_simple", controller)
+    monkeypatch.setattr(app, "enhance_image_simple", lambda data: b"enhanced")
+
+    with controller.admit(1.0):
+        resp = client.post("/enhance", data={"image": (io.BytesIO(b"busy"), "a.jpg")})
+    assert resp.status_code == 429
+    assert int(resp.headers["Retry-After"]) >= 1
+
+    resp = client.post("/enhance", data={"image": (io.BytesIO(b"busy"), "a.jpg")})
+    assert resp.status_code == 200
+
+
+def test_stylize_precision_selection(client, monkeypatch, tmp_path):
+    models_dir = tmp_path / "saved_models"
+    models_dir.mkdir()
+    (models_dir / "mosaic.pth").write_bytes(b"")
+    monkeypatch.setattr(app, "NEURAL_STYLE_DIR", str(tmp_path))
+    monkeypatch.setattr(app, "STYLE_AVAILABLE", True)
+    monkeypatch.setattr(app, "load_style_model", lambda path, device: "fp32")
+    monkeypatch.setattr(app, "load_int8_style_model", lambda path: "int8")
+    monkeypatch.setattr(app, "stylize_image_bytes", lambda model, data, device, **kwargs: model.encode())
+    monkeypatch.setattr(app.image_sink, "enabled", False)
+
+    def post(**form):
+        return client.post("/stylize", data=dict(form, style="mosaic", image=(io.BytesIO(b"raw"), "a.jpg")))
+
+    assert post(precision="fp16").status_code == 400
+
+    # No INT8 artifact yet: int8 requests are served in fp32
+    resp = post(precision="int8")
+    assert resp.data == b"fp32"
+    assert resp.headers["X-Style-Precision"] == "fp32"
+
+    (models_dir / "mosaic.int8.pt").write_bytes(b"")
+    monkeypatch.setattr(app, "QUANTIZE_AVAILABLE", True)
+    monkeypatch.setattr(app, "int8_artifact_path", lambda path: os.path.splitext(path)[0] + ".int8.pt",
+                        raising=False)
+    resp = post(precision="int8")
+    assert resp.data == b"int8"
+    assert resp.headers["X-Style-Precision"] == "int8"
+    assert post().data == b"fp32"
+
+    # Deployment default
+    monkeypatch.setattr(app, "STYLE_PRECISION", "int8")
+    assert post().data == b"int8"
+
+
+def test_stylize_backend_selection(client, monkeypatch, tmp_path):
+    models_dir = tmp_path / "saved_models"
+    models_dir.mkdir()
+    (models_dir / "mosaic.pth").write_bytes(b"")
+    monkeypatch.setattr(app, "NEURAL_STYLE_DIR", str(tmp_path))
+    monkeypatch.setattr(app, "STYLE_AVAILABLE", True)
+    monkeypatch.setattr(app, "load_style_model", lambda path, device: "torch")
+    monkeypatch.setattr(app, "load_ort_style_model", lambda path: "onnxruntime")
+    monkeypatch.setattr(app, "stylize_image_bytes", lambda model, data, device, **kwargs: model.encode())
+    monkeypatch.setattr(app.image_sink, "enabled", False)
+    monkeypatch.setattr(app, "ORT_AVAILABLE", True)
+    monkeypatch.setattr(app, "onnx_path", lambda path: os.path.splitext(path)[0] + ".onnx", raising=False)
+
+    def post():
+        return client.post("/stylize", data={"style": "mosaic", "image": (io.BytesIO(b"raw"), "a.jpg")})
+
+    assert post().data == b"torch"
+
+    monkeypatch.setattr(app, "STYLE_BACKEND", "onnxruntime")
+    resp = post()
+    assert resp.data == b"onnxruntime"
+    assert resp.headers["X-Style-Backend"] == "onnxruntime"
+
+    # Without auto-export the backend is only used once the .onnx exists
+    monkeypatch.setattr(app, "STYLE_ORT_AUTOEXPORT", False)
+    assert post().data == b"torch"
+    (models_dir / "mosaic.onnx").write_bytes(b"")
+    assert post().data == b"onnxruntime"
+
+
+def test_stylize_multi_returns_zip_and_shares_single_style_results(client, monkeypatch, tmp_path):
+    import zipfile
+    from result_cache import ResultCache
+
+    models_dir = tmp_path / "saved_models"
+    models_dir.mkdir()
+    for name in ("mosaic", "candy", "udnie"):
+        (models_dir / f"{name}.pth").write_bytes(b"")
+    monkeypatch.setattr(app, "NEURAL_STYLE_DIR", str(tmp_path))
+    monkeypatch.setattr(app, "STYLE_AVAILABLE", True)
+    monkeypatch.setattr(app, "result_cache", ResultCache(max_memory_bytes=1 << 20))
+    monkeypatch.setattr(app, "load_style_model", lambda path, device: os.path.basename(path))
+    monkeypatch.setattr(app, "decode_image", lambda data: data)
+    monkeypatch.setattr(app, "encode_image", lambda image, **kwargs: image.encode())
+    runs = []
+
+    def fake_multi(models, image, device, progress=None):
+        runs.append(list(models))
+        return [f"{m}:{image.decode()}" for m in models]
+
+    monkeypatch.setattr(app, "stylize_pil_multi", fake_multi)
+    monkeypatch.setattr(app, "stylize_image_bytes", lambda model, data, device, **kwargs: b"single")
+    monkeypatch.setattr(app.image_sink, "enabled", False)
+
+    # A single-style result already in the cache is reused
+    resp = client.post("/stylize", data={"style": "candy", "image": (io.BytesIO(b"raw"), "a.jpg")})
+    assert resp.data == b"single"
+
+    resp = client.post("/stylize/multi", data={
+        "styles": "mosaic, candy,mosaic", "style": "udnie", "image": (io.BytesIO(b"raw"), "a.jpg")})
+    assert resp.status_code == 200
+    assert resp.mimetype == "application/zip"
+    assert resp.headers["X-Styles"] == "udnie,mosaic,candy"
+    archive = zipfile.ZipFile(io.BytesIO(resp.data))
+    assert archive.namelist() == ["udnie.jpg", "mosaic.jpg", "candy.jpg"]
+    assert archive.read("mosaic.jpg") == b"mosaic.pth:raw"
+    assert archive.read("candy.jpg") == b"single"
+    # One decode and one run for the two uncached styles
+    assert runs == [["udnie.pth", "mosaic.pth"]]
+
+    resp = client.post("/stylize/multi", data={"styles": "mosaic,nope", "image": (io.BytesIO(b"raw"), "a.jpg")})
+    assert resp.status_code == 404
+    assert client.post("/stylize/multi", data={"image": (io.BytesIO(b"raw"), "a.jpg")}).status_code == 400
+
+
+def test_stylize_video_runs_as_job(client, monkeypatch, tmp_path):
+    models_dir = tmp_path / "saved_models"
+    models_dir.mkdir()
+    (models_dir / "mosaic.pth").write_bytes(b"")
+    monkeypatch.setattr(app, "NEURAL_STYLE_DIR", str(tmp_path))
+    monkeypatch.setattr(app, "STYLE_AVAILABLE", True)
+    monkeypatch.setattr(app, "VIDEO_AVAILABLE", True)
+    monkeypatch.setattr(app, "load_style_model", lambda path, device: object())
+
+    def fake_video(src, dst, forward, progress=None, **kwargs):
+        with open(src, "rb") as f, open(dst, "wb") as out:
+            out.write(b"styled:" + f.read())
+        progress(3, 3)
+        return {"frames": 3, "width": 4, "height": 4}
+
+    monkeypatch.setattr(app, "stylize_video", fake_video, raising=False)
+
+    assert client.post("/stylize/video", data={"style": "mosaic"}).status_code == 400
+    resp = client.post("/stylize/video", data={"style": "mosaic", "video": (io.BytesIO(b"clip"), "a.webm")})
+    assert resp.status_code == 202
+    job = app.jobs.get(resp.get_json()["id"])
+    for _ in range(100):
+        if job.finished:
+            break
+        job.wait_for_change(job.version, 0.05)
+    assert job.status == "succeeded"
+    assert job.progress["done"] == 3
+
+    result = client.get(f"/jobs/{job.id}/result")
+    assert result.mimetype == "video/mp4"
+    assert result.data == b"styled:clip"
+
+
+def test_progressive_stylize_streams_preview_then_final(client, monkeypatch, tmp_path):
+    models_dir = tmp_path / "saved_models"
+    models_dir.mkdir()
+    (models_dir / "mosaic.pth").write_bytes(b"")
+    monkeypatch.setattr(app, "NEURAL_STYLE_DIR", str(tmp_path))
+    monkeypatch.setattr(app, "STYLE_AVAILABLE", True)
+    monkeypatch.setattr(app, "load_style_model", lambda path, device: object())
+    monkeypatch.setattr(app, "stylize_image_bytes", lambda model, data, device, **kwargs: b"full")
+    monkeypatch.setattr(app, "stylize_preview_bytes", lambda model, data, size, device, quality: b"small")
+    monkeypatch.setattr(app.image_sink, "enabled", False)
+
+    resp = client.post("/stylize", data={
+        "style": "mosaic", "progressive": "1", "image": (io.BytesIO(b"raw"), "a.jpg")})
+
+    assert resp.status_code == 200
+    assert resp.mimetype == "multipart/x-mixed-replace"
+    body = resp.get_data()
+    preview = body.index(b"X-Stage: preview\r\n\r\nsmall\r\n")
+    final = body.index(b"X-Stage: final\r\n\r\nfull\r\n")
+    assert preview < final
+    assert body.endswith(b"--stylize-frame--\r\n")
+
+
+def test_progressive_stylize_reports_final_failure_in_stream(client, monkeypatch, tmp_path):
+    models_dir = tmp_path / "saved_models"
+    models_dir.mkdir()
+    (models_dir / "mosaic.pth").write_bytes(b"")
+    monkeypatch.setattr(app, "NEURAL_STYLE_DIR", str(tmp_path))
+    monkeypatch.setattr(app, "STYLE_AVAILABLE", True)
+    monkeypatch.setattr(app, "load_style_model", lambda path, device: object())
+    monkeypatch.setattr(app, "stylize_preview_bytes", lambda model, data, size, device, quality: b"small")
+
+    def fail(model, data, device, **kwargs):
+        raise RuntimeError("out of memory")
+
+    monkeypatch.setattr(app, "stylize_image_bytes", fail)
+    resp = client.post("/stylize", data={
+        "style": "mosaic", "progressive": "1", "image": (io.BytesIO(b"raw"), "a.jpg")})
+    body = resp.get_data()
+    assert b"X-Stage: preview" in body
+    assert b"Content-Type: application/json" in body
+    assert b"out of memory" in body
+
+
+def test_concurrent_spade_requests_share_one_generator_batch(client, monkeypatch):
+    import threading
+    import numpy as np
+    from PIL import Image
+    from micro_batcher import MicroBatcher
+
+    batches = []
+
+    def fake_batch(label_tensors):
+        batches.append(len(label_tensors))
+        return [np.full((3, 4, 4), t[0, 0, 0]) for t in label_tensors]
+
+    monkeypatch.setattr(app, "SPADE_AVAILABLE", True)
+    monkeypatch.setattr(app, "SPADE_CHECKPOINT_PATH", "latest_net_G.pth", raising=False)
+    monkeypatch.setattr(app, "SPADE_SEED", 0, raising=False)
+    monkeypatch.setattr(app, "spade_label_array",
+                        lambda image: np.full((4, 4), image.getpixel((0, 0))[0], dtype=np.uint8), raising=False)
+    monkeypatch.setattr(app, "spade_label_tensor_from_array",
+                        lambda labels: np.full((1, 4, 4), labels[0, 0], dtype=np.int64), raising=False)
+    monkeypatch.setattr(app, "generate_spade_tensors", fake_batch, raising=False)
+    monkeypatch.setattr(app, "spade_tensor_to_image",
+                        lambda t: Image.new("RGB", (8, 8), (int(t[0, 0, 0]), 0, 0)), raising=False)
+    monkeypatch.setattr(app, "spade_batcher",
+                        MicroBatcher(app._run_spade_batch, max_batch_size=3, max_wait_ms=2000, name="test-spade"))
+
+    def upload(red):
+        png = io.BytesIO()
+        Image.new("RGB", (16, 16), (red, 0, 0)).save(png, "PNG")
+        return {"segmentation": (io.BytesIO(png.getvalue()), "canvas.png")}
+
+    responses = {}
+
+    def post(red):
+        responses[red] = app.app.test_client().post("/spade", data=upload(red))
+
+    threads = [threading.Thread(target=post, args=(red,)) for red in (10, 120, 240)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # One forward for the three requests, each receiving its own image
+    assert batches == [3]
+    for red, resp in responses.items():
+        assert resp.status_code == 200
+        pixel = Image.open(io.BytesIO(resp.data)).convert("RGB").getpixel((4, 4))
+        assert abs(pixel[0] - red) < 8
+
+    text = client.get("/metrics").get_data(as_text=True)
+    assert 'creativecollab_batch_items_total{engine="spade"} 3' in text
+    assert 'creativecollab_batches_total{engine="spade"} 1' in text
+
+
+def test_tiled_spade_keeps_canvas_size_and_batches_tiles(client, monkeypatch):
+    import numpy as np
+    from PIL import Image
+
+    calls = {}
+
+    def fake_tiled(label_array, forward, context, overlap, workers, progress):
+        calls.update(shape=label_array.shape, forward=forward, workers=workers)
+        return Image.new("RGB", label_array.shape[::-1], (0, 90, 0))
+
+    monkeypatch.setattr(app, "SPADE_AVAILABLE", True)
+    monkeypatch.setattr(app, "SPADE_CHECKPOINT_PATH", "latest_net_G.pth", raising=False)
+    monkeypatch.setattr(app, "SPADE_SEED", 0, raising=False)
+    monkeypatch.setattr(app, "SPADE_TILED_MAX_SIZE", 96)
+    monkeypatch.setattr(app, "spade_label_array",
+                        lambda image: np.zeros(image.size[::-1], dtype=np.uint8), raising=False)
+    monkeypatch.setattr(app, "generate_spade_tiled", fake_tiled, raising=False)
+
+    png = io.BytesIO()
+    Image.new("RGB", (192, 64), (117, 158, 223)).save(png, "PNG")
+    resp = client.post("/spade", data={"segmentation": (io.BytesIO(png.getvalue()), "wide.png"), "tiled": "1"})
+
+    assert resp.status_code == 200
+    assert resp.headers["X-Spade-Mode"] == "tiled"
+    # Aspect ratio kept, longest side limited to SPADE_TILED_MAX_SIZE
+    assert Image.open(io.BytesIO(resp.data)).size == (96, 32)
+    assert calls["shape"] == (32, 96)
+    # Tiles go through the shared batcher
+    assert calls["forward"] is app.spade_forward
+
+
+def test_spade_session_regenerates_only_changed_regions(client, monkeypatch):
+    import numpy as np
+    from PIL import Image
+    from spade_sessions import SessionStore
+
+    calls = {"full": 0, "regions": []}
+
+    def full_forward(labels):
+        calls["full"] += 1
+        return labels
+
+    def fake_region(labels, box, **kwargs):
+        calls["regions"].append(box)
+        t, l, b, r = box
+        return np.repeat(labels[t:b, l:r, None], 3, axis=2)
+
+    monkeypatch.setattr(app, "SPADE_AVAILABLE", True)
+    monkeypatch.setattr(app, "SPADE_CHECKPOINT_PATH", "latest_net_G.pth", raising=False)
+    monkeypatch.setattr(app, "SPADE_SEED", 0, raising=False)
+    monkeypatch.setattr(app, "spade_sessions", SessionStore())
+    monkeypatch.setattr(app, "spade_label_array",
+                        lambda image: np.asarray(image.convert("RGB"))[..., 0].copy(), raising=False)
+    monkeypatch.setattr(app, "spade_label_tensor_from_array", lambda labels: labels, raising=False)
+    monkeypatch.setattr(app, "spade_forward", full_forward)
+    monkeypatch.setattr(app, "spade_tensor_to_image",
+                        lambda labels: Image.fromarray(np.repeat(labels[..., None], 3, axis=2)), raising=False)
+    monkeypatch.setattr(app, "generate_spade_region", fake_region, raising=False)
+
+    canvas = np.full((512, 512, 3), 100, dtype=np.uint8)
+
+    def post(array, session="s-1"):
+        png = io.BytesIO()
+        Image.fromarray(array).save(png, "PNG")
+        return client.post("/spade", data={"segmentation": (io.BytesIO(png.getvalue()), "canvas.png"),
+                                           "session": session})
+
+    first = post(canvas)
+    assert first.status_code == 200
+    assert first.headers["X-Spade-Session"] == "full"
+    assert "ETag" not in first.headers
+
+    assert post(canvas).headers["X-Spade-Session"] == "unchanged"
+    assert calls["full"] == 1
+
+    stroke = canvas.copy()
+    stroke[400:440, 400:440] = 220
+    resp = post(stroke)
+    assert resp.headers["X-Spade-Session"] == "incremental"
+    assert calls["full"] == 1 and len(calls["regions"]) == 1
+    output = np.asarray(Image.open(io.BytesIO(resp.data)).convert("RGB")).astype(int)
+    assert abs(output[420, 420, 0] - 220) < 8
+    assert abs(output[100, 100, 0] - 100) < 8
+
+    assert client.post("/spade", data={"segmentation": (io.BytesIO(b"x"), "c.png"),
+                                       "session": "../bad"}).status_code == 400
+    text = client.get("/metrics").get_data(as_text=True)
+    assert 'creativecollab_spade_session_requests_total{result="incremental"} 1' in text
+
+
+def test_spade_reuses_output_of_an_identical_label_map(client, monkeypatch):
+    import numpy as np
+    from PIL import Image
+    from result_cache import ResultCache
+
+    forwards = []
+
+    def fake_forward(labels):
+        forwards.append(labels)
+        return labels
+
+    monkeypatch.setattr(app, "SPADE_AVAILABLE", True)
+    monkeypatch.setattr(app, "SPADE_CHECKPOINT_PATH", "latest_net_G.pth", raising=False)
+    monkeypatch.setattr(app, "SPADE_SEED", 0, raising=False)
+    monkeypatch.setattr(app, "result_cache", ResultCache(directory=None))
+    # Colors within tolerance of a palette entry map to the same class
+    monkeypatch.setattr(app, "spade_label_array",
+                        lambda image: (np.asarray(image.convert("RGB"))[..., 0] // 32).astype(np.uint8),
+                        raising=False)
+    monkeypatch.setattr(app, "spade_label_tensor_from_array", lambda labels: labels, raising=False)
+    monkeypatch.setattr(app, "spade_forward", fake_forward)
+    monkeypatch.setattr(app, "spade_tensor_to_image",
+                        lambda labels: Image.fromarray(np.repeat(labels[..., None] * 30, 3, axis=2)), raising=False)
+
+    def post(red, fmt="PNG"):
+        buf = io.BytesIO()
+        Image.new("RGB", (300, 200), (red, 0, 0)).save(buf, fmt)
+        return client.post("/spade", data={"segmentation": (io.BytesIO(buf.getvalue()), "canvas.png")})
+
+    first = post(70)
+    assert first.headers["X-Spade-Label-Cache"] == "miss"
+    # Different upload bytes (noise and encoding), same label map
+    second = post(75, fmt="BMP")
+    assert second.status_code == 200
+    assert second.headers["X-Spade-Label-Cache"] == "hit"
+    assert second.data == first.data
+    assert len(forwards) == 1
+
+    assert post(200).headers["X-Spade-Label-Cache"] == "miss"
+    assert len(forwards) == 2
+    text = client.get("/metrics").get_data(as_text=True)
+    assert 'creativecollab_result_cache_requests_total{engine="spade_labels",result="hit"} 1' in text
+
+
+def _style_batch_keys(monkeypatch, shapes):
+    torch = pytest.importorskip("torch")
+    if not hasattr(torch, "zeros"):
+        pytest.skip("real torch is required")
+    keys = []
+
+    class RecordingBatcher:
+        def submit(self, key, item):
+            keys.append(key)
+
+    monkeypatch.setattr(app, "style_batcher", RecordingBatcher())
+    monkeypatch.setattr(app.shape_buckets, "step", 0)
+    model = object()
+    for h, w in shapes:
+        app.style_forward(model, torch.zeros(1, 3, h, w))
+    return keys
+
+
+def test_style_batches_only_identical_shapes_by_default(monkeypatch):
+    monkeypatch.setattr(app, "STYLE_BATCH_SIZE_TOLERANCE", 1)
+    keys = _style_batch_keys(monkeypatch, [(100, 120), (100, 120), (101, 120)])
+    assert keys[0] == keys[1]
+    assert keys[0] != keys[2]
+
+
+def test_padded_mixed_size_batches_change_the_output(monkeypatch):
+    # Opt-in tolerance: neighbouring sizes share a padded batch
+    monkeypatch.setattr(app, "STYLE_BATCH_SIZE_TOLERANCE", 32)
+    keys = _style_batch_keys(monkeypatch, [(100, 120), (101, 120)])
+    assert keys[0] == keys[1]
+
+    import torch
+    torch.manual_seed(0)
+    model = torch.nn.Sequential(torch.nn.Conv2d(3, 3, 3, padding=1), torch.nn.InstanceNorm2d(3))
+    small = torch.rand(1, 3, 40, 50)
+    large = torch.rand(1, 3, 64, 64) * 255
+
+    alone = app._run_style_batch(keys[0], [(model, small)])[0]
+    shared = app._run_style_batch(keys[0], [(model, small), (model, large)])[0]
+    assert shared.shape == alone.shape
+    # Instance norm statistics include the padding: the documented difference
+    assert not torch.allclose(shared, alone, atol=1e-3)
+
+
+
+def test_bucket_larger_than_the_image_pads_by_replication(monkeypatch):
+    torch = pytest.importorskip("torch")
+    if not hasattr(torch, "zeros"):
+        pytest.skip("real torch is required")
+    # A 10x20 input in a 64x64 bucket pads by more than either image side
+    monkeypatch.setattr(app.shape_buckets, "step", 64)
+    torch.manual_seed(0)
+    model = torch.nn.Conv2d(3, 3, 3, padding=1)
+    image = torch.rand(1, 3, 10, 20)
+
+    output = app._run_style_batch(("m", "cpu", None), [(model, image)])[0]
+    assert output.shape == (1, 3, 10, 20)
+    with torch.no_grad():
+        padded = torch.nn.functional.pad(image, (0, 44, 0, 54), mode="replicate")
+        expected = model(padded)[:, :, :10, :20]
+    assert torch.allclose(output, expected)
+
+def _style_fixture(monkeypatch, tmp_path):
+    models_dir = tmp_path / "saved_models"
+    models_dir.mkdir()
+    (models_dir / "mosaic.pth").write_bytes(b"")
+    monkeypatch.setattr(app, "NEURAL_STYLE_DIR", str(tmp_path))
+    monkeypatch.setattr(app, "STYLE_AVAILABLE", True)
+    monkeypatch.setattr(app, "load_style_model", lambda path, device: "torch")
+    monkeypatch.setattr(app, "stylize_image_bytes", lambda model, data, device, **kwargs: model.encode())
+    monkeypatch.setattr(app.image_sink, "enabled", False)
+    monkeypatch.setattr(app, "_style_variant_failures", {})
+    return models_dir
+
+
+def test_failed_onnx_export_is_served_and_keyed_as_torch(client, monkeypatch, tmp_path):
+    _style_fixture(monkeypatch, tmp_path)
+    exports = []
+
+    def failed_export(*args):
+        exports.append(args)
+        return None
+
+    monkeypatch.setattr(app, "ORT_AVAILABLE", True)
+    monkeypatch.setattr(app, "STYLE_BACKEND", "onnxruntime")
+    monkeypatch.setattr(app, "STYLE_ORT_INTRA_THREADS", 1)
+    monkeypatch.setattr(app, "onnx_path", lambda path: os.path.splitext(path)[0] + ".onnx", raising=False)
+    monkeypatch.setattr(app, "load_ort_model", failed_export, raising=False)
+    keys = []
+    stylize_key = app._stylize_key
+    monkeypatch.setattr(app, "_stylize_key", lambda *args: keys.append(args) or stylize_key(*args))
+
+    for _ in range(2):
+        resp = client.post("/stylize", data={"style": "mosaic", "image": (io.BytesIO(b"raw"), "a.jpg")})
+        assert resp.data == b"torch"
+        assert resp.headers["X-Style-Backend"] == "torch"
+    assert all(args[-1] == "torch" for args in keys)
+    # The failure is remembered (no export per request) and nothing is cached under the .onnx key
+    assert len(exports) == 1
+    assert app._model_cache.get(str(tmp_path / "saved_models" / "mosaic.onnx")) is None
+
+
+def test_stale_int8_artifact_is_served_and_keyed_as_fp32(client, monkeypatch, tmp_path):
+    models_dir = _style_fixture(monkeypatch, tmp_path)
+    (models_dir / "mosaic.int8.pt").write_bytes(b"")
+    monkeypatch.setattr(app, "QUANTIZE_AVAILABLE", True)
+    monkeypatch.setattr(app, "int8_artifact_path", lambda path: os.path.splitext(path)[0] + ".int8.pt",
+                        raising=False)
+    monkeypatch.setattr(app, "load_quantized_model", lambda path: None, raising=False)
+    keys = []
+    stylize_key = app._stylize_key
+    monkeypatch.setattr(app, "_stylize_key", lambda *args: keys.append(args) or stylize_key(*args))
+
+    resp = client.post("/stylize", data={"style": "mosaic", "precision": "int8",
+                                         "image": (io.BytesIO(b"raw"), "a.jpg")})
+    assert resp.data == b"torch"
+    assert resp.headers["X-Style-Precision"] == "fp32"
+    assert keys[0][2] == "fp32"
+    assert app._model_cache.get(str(models_dir / "mosaic.int8.pt")) is None
+
+
+def test_style_warmup_runs_the_variant_requests_will_use(monkeypatch, tmp_path):
+    torch = pytest.importorskip("torch")
+    if not hasattr(torch, "rand"):
+        pytest.skip("real torch is required")
+    _style_fixture(monkeypatch, tmp_path)
+    forwards = []
+
+    monkeypatch.setattr(app, "WARMUP_STYLES", ["mosaic"])
+    monkeypatch.setattr(app, "WARMUP_SIZES", [64, 2048])
+    monkeypatch.setattr(app, "STYLE_MAX_SIZE", 1024)
+    monkeypatch.setattr(app, "ORT_AVAILABLE", True)
+    monkeypatch.setattr(app, "STYLE_BACKEND", "onnxruntime")
+    monkeypatch.setattr(app, "onnx_path", lambda path: os.path.splitext(path)[0] + ".onnx", raising=False)
+    monkeypatch.setattr(app, "load_ort_style_model", lambda path: "onnxruntime")
+    monkeypatch.setattr(app, "style_forward", lambda model, tensor: forwards.append((model, tuple(tensor.shape))))
+
+    app._warmup_styles()
+
+    # Tiled sizes stay on torch; everything goes through the batched forward
+    expected_large = "torch" if app.TILING_AVAILABLE and app.STYLE_TILING_ENABLED else "onnxruntime"
+    assert forwards == [("onnxruntime", (1, 3, 48, 64)), (expected_large, (1, 3, 1536, 2048))]
+
+
+def test_spade_session_generates_nearby_strokes_in_one_forward(client, monkeypatch):
+    import numpy as np
+    from PIL import Image
+    from spade_sessions import SessionStore
+
+    regions = []
+
+    def fake_region(labels, box, **kwargs):
+        regions.append(box)
+        t, l, b, r = box
+        return np.repeat(labels[t:b, l:r, None], 3, axis=2)
+
+    monkeypatch.setattr(app, "SPADE_AVAILABLE", True)
+    monkeypatch.setattr(app, "SPADE_CHECKPOINT_PATH", "latest_net_G.pth", raising=False)
+    monkeypatch.setattr(app, "SPADE_SEED", 0, raising=False)
+    monkeypatch.setattr(app, "spade_sessions", SessionStore())
+    monkeypatch.setattr(app, "spade_label_array",
+                        lambda image: np.asarray(image.convert("RGB"))[..., 0].copy(), raising=False)
+    monkeypatch.setattr(app, "spade_label_tensor_from_array", lambda labels: labels, raising=False)
+    monkeypatch.setattr(app, "spade_forward", lambda labels: labels)
+    monkeypatch.setattr(app, "spade_tensor_to_image",
+                        lambda labels: Image.fromarray(np.repeat(labels[..., None], 3, axis=2)), raising=False)
+    monkeypatch.setattr(app, "generate_spade_region", fake_region, raising=False)
+
+    def post(array):
+        png = io.BytesIO()
+        Image.fromarray(array).save(png, "PNG")
+        return client.post("/spade", data={"segmentation": (io.BytesIO(png.getvalue()), "canvas.png"),
+                                           "session": "two-strokes"})
+
+    canvas = np.full((512, 512, 3), 100, dtype=np.uint8)
+    post(canvas)
+    strokes = canvas.copy()
+    strokes[20:40, 20:40] = 220
+    strokes[440:470, 400:430] = 30
+    resp = post(strokes)
+
+    assert resp.headers["X-Spade-Session"] == "incremental"
+    # Two dirty boxes, one generator window: a single region generation
+    assert len(regions) == 1
+    output = np.asarray(Image.open(io.BytesIO(resp.data)).convert("RGB")).astype(int)
+    assert abs(output[30, 30, 0] - 220) < 8
+    assert abs(output[455, 415, 0] - 30) < 8
+    assert abs(output[250, 250, 0] - 100) < 8
@@ -0,0 +1,99 @@
+import os
+import sys
+import threading
+import time
+import types
+
+import pytest
+
+TEST_ROOT = os.path.dirname(__file__)
+PROJECT_ROOT = os.path.abspath(os.path.join(TEST_ROOT, ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("cv2")
+torch = pytest.importorskip("torch")
+if not hasattr(torch, "nn"):
+    pytest.skip("real torch is required", allow_module_level=True)
+
+
+def _install_realesrgan_stubs(monkeypatch):
+    """Minimal realesrgan/basicsr modules so enhance_image imports without them."""
+    if "realesrgan" in sys.modules or _importable("realesrgan"):
+        return
+    realesrgan = types.ModuleType("realesrgan")
+    realesrgan.RealESRGANer = object
+    utils = types.ModuleType("realesrgan.utils")
+    utils.load_file_from_url = lambda **kwargs: None
+    archs = types.ModuleType("basicsr.archs.rrdbnet_arch")
+    archs.RRDBNet = object
+    for name, module in {"realesrgan": realesrgan, "realesrgan.utils": utils,
+                         "basicsr": types.ModuleType("basicsr"),
+                         "basicsr.archs": types.ModuleType("basicsr.archs"),
+                         "basicsr.archs.rrdbnet_arch": archs}.items():
+        monkeypatch.setitem(sys.modules, name, module)
+
+
+def _importable(name):
+    import importlib.util
+    return importlib.util.find_spec(name) is not None
+
+
+class FakeEnhancer:
+    """Keeps per-call state on the instance, like RealESRGANer."""
+
+    def __init__(self, tile_size=0, fail_untiled=False):
+        self.tile_size = tile_size
+        self.tile_pad = 10
+        self.fail_untiled = fail_untiled
+        self.tiles = []
+
+    def enhance(self, image, outscale=None):
+        self.img = image
+        self.tiles.append(self.tile_size)
+        if self.fail_untiled and not self.tile_size:
+            raise RuntimeError("out of memory")
+        time.sleep(0.05)
+        return np.repeat(np.repeat(self.img, 2, axis=0), 2, axis=1), None
+
+
+@pytest.fixture()
+def enhance_image(monkeypatch):
+    _install_realesrgan_stubs(monkeypatch)
+    monkeypatch.delitem(sys.modules, "enhance_image", raising=False)
+    import enhance_image
+    yield enhance_image
+    sys.modules.pop("enhance_image", None)
+
+
+def test_concurrent_calls_do_not_share_per_call_state(enhance_image, monkeypatch):
+    shared = FakeEnhancer()
+    monkeypatch.setattr(enhance_image, "get_enhancer", lambda: shared)
+    results = {}
+
+    def run(value):
+        image = np.full((4, 4, 3), value, dtype=np.uint8)
+        results[value] = enhance_image.enhance_array(image, 8)
+
+    threads = [threading.Thread(target=run, args=(v,)) for v in (10, 200)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for value, enhanced in results.items():
+        assert enhanced.shape == (8, 8, 3)
+        assert (enhanced == value).all()
+
+
+def test_tile_fallback_only_applies_to_the_failing_call(enhance_image, monkeypatch):
+    shared = FakeEnhancer(fail_untiled=True)
+    monkeypatch.setattr(enhance_image, "get_enhancer", lambda: shared)
+    monkeypatch.setattr(enhance_image, "ESRGAN_TILE", 0)
+
+    enhance_image.enhance_array(np.zeros((4, 4, 3), dtype=np.uint8), 8)
+
+    assert shared.tiles == [0, 128]
+    # The shared enhancer keeps its configured tile size
+    assert shared.tile_size == 0
@@ -0,0 +1,45 @@
+import io
+import os
+import sys
+
+TEST_ROOT = os.path.dirname(__file__)
+PROJECT_ROOT = os.path.abspath(os.path.join(TEST_ROOT, ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from PIL import Image  # noqa: E402
+
+import image_io  # noqa: E402
+
+
+def _png_bytes(size=(8, 6), color=(10, 20, 30)):
+    buf = io.BytesIO()
+    Image.new("RGB", size, color).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def test_decode_from_bytes_and_stream():
+    data = _png_bytes()
+    assert image_io.decode_image(data).size == (8, 6)
+    stream = io.BytesIO(data)
+    stream.read()
+    assert image_io.decode_image(stream).getpixel((0, 0)) == (10, 20, 30)
+
+
+def test_encode_image_roundtrip_png():
+    image = Image.new("RGB", (4, 4), (1, 2, 3))
+    decoded = image_io.decode_image(image_io.encode_image(image, fmt="PNG"))
+    assert decoded.getpixel((3, 3)) == (1, 2, 3)
+
+
+def test_disabled_sink_writes_nothing(tmp_path):
+    sink = image_io.DiskSink(enabled=False, root=str(tmp_path))
+    assert sink.save("out", "a.jpg", b"x") is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_enabled_sink_writes_in_background(tmp_path):
+    sink = image_io.DiskSink(enabled=True, root=str(tmp_path))
+    path = sink.save("out", "a.jpg", b"x").result(timeout=5)
+    with open(path, "rb") as f:
+        assert f.read() == b"x"
@@ -0,0 +1,89 @@
+import os
+import sys
+import pytest
+
+TEST_ROOT = os.path.dirname(__file__)
+NEURAL_STYLE_DIR = os.path.abspath(
+    os.path.join(TEST_ROOT, "..", "..", "neural_style_transfer", "neural_style")
+)
+if NEURAL_STYLE_DIR not in sys.path:
+    sys.path.insert(0, NEURAL_STYLE_DIR)
+
+torch = pytest.importorskip("torch")
+
+try:
+    import inference_build  # noqa: E402
+    from transformer_net import TransformerNet  # noqa: E402
+except Exception as exc:  # pragma: no cover - defensive
+    pytest.skip(f"inference_build import failed: {exc}", allow_module_level=True)
+
+
+@pytest.fixture()
+def eager():
+    torch.manual_seed(0)
+    model = TransformerNet().eval()
+    # Non-trivial affine norms so the check is meaningful
+    for module in model.modules():
+        if isinstance(module, torch.nn.InstanceNorm2d):
+            module.weight.data.uniform_(0.5, 1.5)
+            module.bias.data.uniform_(-0.2, 0.2)
+    return model
+
+
+def test_inference_model_matches_eager_on_odd_sizes(eager):
+    built = inference_build.build_inference_model(eager)
+    assert inference_build.max_difference(eager, built, sizes=((37, 53), (64, 64))) < 1e-3
+
+
+def test_artifact_round_trip_and_staleness(eager, tmp_path):
+    model_path = str(tmp_path / "mosaic.pth")
+    torch.save(eager.state_dict(), model_path)
+
+    path, difference = inference_build.save_inference_artifact(eager, model_path)
+    assert path == str(tmp_path / "mosaic.frozen.pt")
+    assert difference < 1e-3
+
+    loaded = inference_build.load_inference_model(model_path)
+    assert loaded is not None
+    # Layers stay reachable for the tiled engine
+    assert loaded.in1.weight.shape == (32,)
+    x = torch.rand(2, 3, 40, 44) * 255
+    with torch.no_grad():
+        assert (loaded(x) - eager(x)).abs().max().item() < 1e-3
+
+    # Replacing the checkpoint invalidates the artifact
+    torch.save(eager.state_dict(), model_path)
+    os.utime(model_path, ns=(0, 0))
+    assert inference_build.load_inference_model(model_path) is None
+
+
+def test_missing_artifact_returns_none(tmp_path):
+    assert inference_build.load_inference_model(str(tmp_path / "none.pth")) is None
+
+
+def test_atomic_path_is_unique_per_writer_and_cleans_up(tmp_path):
+    import threading
+
+    target = str(tmp_path / "mosaic.frozen.pt")
+    names = []
+
+    def write(data):
+        with inference_build.atomic_path(target) as tmp:
+            names.append(tmp)
+            with open(tmp, "wb") as f:
+                f.write(data)
+
+    thread = threading.Thread(target=write, args=(b"other",))
+    thread.start()
+    thread.join()
+    write(b"mine")
+    assert len(set(names)) == 2
+    assert open(target, "rb").read() == b"mine"
+
+    with pytest.raises(RuntimeError):
+        with inference_build.atomic_path(target) as tmp:
+            open(tmp, "wb").write(b"half")
+            raise RuntimeError("export failed")
+    # A failed writer neither replaces the artifact nor leaves its temporary file
+    assert open(target, "rb").read() == b"mine"
+    assert os.listdir(tmp_path) == ["mosaic.frozen.pt"]
@@ -0,0 +1,84 @@
+import os
+import sys
+import threading
+
+import pytest
+
+TEST_ROOT = os.path.dirname(__file__)
+PROJECT_ROOT = os.path.abspath(os.path.join(TEST_ROOT, ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from jobs import JobManager, JobQueueFull  # noqa: E402
+
+
+def _wait(job):
+    for _ in range(100):
+        if job.finished:
+            return
+        job.wait_for_change(job.version, 0.05)
+
+
+def test_progress_and_result_are_recorded():
+    manager = JobManager(max_workers=1)
+
+    def work(progress):
+        progress(1, 2)
+        progress(2, 2)
+        return b"done"
+
+    job = manager.submit("stylize", work)
+    _wait(job)
+    assert job.status == "succeeded"
+    assert job.result == b"done"
+    assert job.progress["done"] == 2
+
+
+def test_failures_are_reported():
+    manager = JobManager(max_workers=1)
+
+    def work(progress):
+        raise ValueError("bad image")
+
+    job = manager.submit("enhance", work)
+    _wait(job)
+    assert job.status == "failed"
+    assert "bad image" in job.error
+
+
+def test_queue_is_bounded():
+    release = threading.Event()
+    manager = JobManager(max_workers=1, max_queued=1)
+    manager.submit("spade", lambda progress: release.wait())
+    with pytest.raises(JobQueueFull):
+        manager.submit("spade", lambda progress: b"")
+    release.set()
+
+
+def test_event_stream_ends_with_final_status():
+    manager = JobManager(max_workers=1)
+    job = manager.submit("stylize", lambda progress: b"x")
+    events = list(manager.events(job, keepalive=0.05))
+    assert events[-1].startswith("event: succeeded")
+
+
+def test_finished_jobs_are_bounded_by_count_and_bytes():
+    manager = JobManager(max_workers=1, max_finished=3, max_result_bytes=10)
+    done = []
+    for i in range(4):
+        job = manager.submit("stylize", lambda progress: b"1234")
+        _wait(job)
+        done.append(job)
+
+    # 4 bytes each: only the two newest results fit in 10 bytes
+    assert manager.get(done[0].id) is None
+    assert manager.get(done[1].id) is None
+    assert manager.get(done[3].id) is done[3]
+    assert manager.stats()["result_bytes"] == 8
+
+    small = [manager.submit("spade", lambda progress: b"") for _ in range(3)]
+    for job in small:
+        _wait(job)
+    # Count limit: the three newest finished jobs are kept
+    assert manager.get(done[3].id) is None
+    assert all(manager.get(job.id) is job for job in small)
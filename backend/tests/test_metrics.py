@@ -0,0 +1,55 @@
+import os
+import sys
+
+TEST_ROOT = os.path.dirname(__file__)
+PROJECT_ROOT = os.path.abspath(os.path.join(TEST_ROOT, ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from metrics import Counter, Gauge, Histogram, Registry  # noqa: E402
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    hist = Histogram("t_seconds", "test", ("stage",), buckets=(0.1, 1.0), registry=registry)
+    hist.labels("decode").observe(0.05)
+    hist.labels("decode").observe(0.5)
+    hist.labels("decode").observe(5.0)
+    text = registry.render()
+    assert "# TYPE t_seconds histogram" in text
+    assert 't_seconds_bucket{stage="decode",le="0.1"} 1' in text
+    assert 't_seconds_bucket{stage="decode",le="1.0"} 2' in text
+    assert 't_seconds_bucket{stage="decode",le="+Inf"} 3' in text
+    assert 't_seconds_count{stage="decode"} 3' in text
+    assert 't_seconds_sum{stage="decode"} 5.55' in text
+
+
+def test_timer_observes_elapsed_time():
+    registry = Registry()
+    hist = Histogram("t_seconds", "test", registry=registry)
+    with hist.labels().time():
+        pass
+    assert "t_seconds_count 1" in registry.render()
+
+
+def test_counter_gauge_and_callbacks():
+    registry = Registry()
+    errors = Counter("t_errors_total", "test", ("type",), registry=registry)
+    errors.labels("ValueError").inc()
+    errors.labels("ValueError").inc()
+    in_flight = Gauge("t_in_flight", "test", ("engine",), registry=registry)
+    with in_flight.track("stylize"):
+        assert 't_in_flight{engine="stylize"} 1' in registry.render()
+    Gauge("t_loaded", "test", ("engine",), fn=lambda: {"style": 2}, registry=registry)
+    Gauge("t_ready", "test", fn=lambda: True, registry=registry)
+    text = registry.render()
+    assert 't_errors_total{type="ValueError"} 2' in text
+    assert 't_in_flight{engine="stylize"} 0' in text
+    assert 't_loaded{engine="style"} 2' in text
+    assert "t_ready 1" in text
+
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    Counter("t_total", "test", ("msg",), registry=registry).labels('a "b"\n').inc()
+    assert 't_total{msg="a \\"b\\"\\n"} 1' in registry.render()
@@ -0,0 +1,133 @@
+import os
+import sys
+import threading
+
+TEST_ROOT = os.path.dirname(__file__)
+PROJECT_ROOT = os.path.abspath(os.path.join(TEST_ROOT, ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from micro_batcher import MicroBatcher  # noqa: E402
+
+
+def _submit_concurrently(batcher, jobs):
+    results = {}
+
+    def worker(key, item):
+        results[item] = batcher.submit(key, item)
+
+    threads = [threading.Thread(target=worker, args=job) for job in jobs]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=5)
+    return results
+
+
+def test_concurrent_items_with_same_key_share_a_batch():
+    seen = []
+
+    def run_batch(key, items):
+        seen.append(list(items))
+        return [item * 10 for item in items]
+
+    batcher = MicroBatcher(run_batch, max_batch_size=3, max_wait_ms=200)
+    results = _submit_concurrently(batcher, [("a", 1), ("a", 2), ("a", 3)])
+
+    assert results == {1: 10, 2: 20, 3: 30}
+    assert [sorted(batch) for batch in seen] == [[1, 2, 3]]
+    assert batcher.stats()["largest_batch"] == 3
+    batcher.shutdown()
+
+
+def test_different_keys_are_not_mixed():
+    seen = []
+
+    def run_batch(key, items):
+        seen.append((key, list(items)))
+        return items
+
+    batcher = MicroBatcher(run_batch, max_batch_size=4, max_wait_ms=20)
+    _submit_concurrently(batcher, [("a", 1), ("b", 2)])
+
+    assert sorted((key, tuple(items)) for key, items in seen) == [("a", (1,)), ("b", (2,))]
+    batcher.shutdown()
+
+
+def test_errors_propagate_to_every_caller():
+    def run_batch(key, items):
+        raise ValueError("boom")
+
+    batcher = MicroBatcher(run_batch, max_batch_size=2, max_wait_ms=5)
+    try:
+        batcher.submit("a", 1)
+    except ValueError as exc:
+        assert "boom" in str(exc)
+    else:
+        raise AssertionError("expected ValueError")
+    batcher.shutdown()
+
+
+def test_batch_size_one_runs_inline():
+    calls = []
+
+    def run_batch(key, items):
+        calls.append(threading.current_thread())
+        return items
+
+    batcher = MicroBatcher(run_batch, max_batch_size=1)
+    assert batcher.submit("a", 7) == 7
+    assert calls == [threading.current_thread()]
+
+
+def test_eager_lone_item_does_not_wait_for_the_window():
+    import time
+
+    batcher = MicroBatcher(lambda key, items: items, max_batch_size=4, max_wait_ms=2000, eager=True)
+    start = time.monotonic()
+    assert batcher.submit("a", 1) == 1
+    assert time.monotonic() - start < 1.0
+    batcher.shutdown()
+
+
+def test_eager_items_arriving_during_a_batch_form_the_next_one():
+    started, release = threading.Event(), threading.Event()
+    seen = []
+
+    def run_batch(key, items):
+        seen.append(sorted(items))
+        if items == [0]:
+            started.set()
+            release.wait(5)
+        return items
+
+    batcher = MicroBatcher(run_batch, max_batch_size=4, max_wait_ms=5000, eager=True)
+    first = threading.Thread(target=batcher.submit, args=("a", 0))
+    first.start()
+    started.wait(5)
+    others = [threading.Thread(target=batcher.submit, args=("a", i)) for i in (1, 2)]
+    for t in others:
+        t.start()
+    while batcher.stats()["queued"] < 2:
+        threading.Event().wait(0.01)
+    release.set()
+    for t in [first] + others:
+        t.join(5)
+
+    assert seen == [[0], [1, 2]]
+    batcher.shutdown()
+
+
+def test_batches_of_different_keys_run_in_parallel():
+    # Both batches must be running at once to pass the barrier
+    barrier = threading.Barrier(2, timeout=5)
+
+    def run_batch(key, items):
+        barrier.wait()
+        return items
+
+    batcher = MicroBatcher(run_batch, max_batch_size=4, max_wait_ms=5, num_workers=2, eager=True)
+    results = _submit_concurrently(batcher, [("a", 1), ("b", 2)])
+
+    assert results == {1: 1, 2: 2}
+    batcher.shutdown()
@@ -0,0 +1,52 @@
+import os
+import sys
+import pytest
+
+TEST_ROOT = os.path.dirname(__file__)
+NEURAL_STYLE_DIR = os.path.abspath(
+    os.path.join(TEST_ROOT, "..", "..", "neural_style_transfer", "neural_style")
+)
+if NEURAL_STYLE_DIR not in sys.path:
+    sys.path.insert(0, NEURAL_STYLE_DIR)
+
+torch = pytest.importorskip("torch")
+
+try:
+    import mixed_precision  # noqa: E402
+    from transformer_net import TransformerNet  # noqa: E402
+except Exception as exc:  # pragma: no cover - defensive
+    pytest.skip(f"mixed_precision import failed: {exc}", allow_module_level=True)
+
+
+@pytest.fixture()
+def model():
+    torch.manual_seed(0)
+    return TransformerNet().eval()
+
+
+def test_fp32_models_run_unchanged(model):
+    x = torch.rand(1, 3, 32, 32) * 255
+    with torch.no_grad():
+        assert torch.equal(mixed_precision.forward(model, x), model(x))
+
+
+def test_enable_bf16_validates_against_fp32(model):
+    if not mixed_precision.bf16_supported():
+        assert mixed_precision.enable_bf16(model) is None
+        assert not getattr(model, "bf16", False)
+        return
+    x = torch.rand(1, 3, 48, 40) * 255
+    with torch.no_grad():
+        reference = model(x)
+        assert mixed_precision.enable_bf16(model) >= mixed_precision.DEFAULT_MIN_PSNR
+        output = mixed_precision.forward(model, x)
+    assert model.bf16
+    assert model.conv1.conv2d.weight.is_contiguous(memory_format=torch.channels_last)
+    assert output.dtype == torch.float32
+    assert mixed_precision.psnr(output, reference) > 30
+
+
+def test_enable_bf16_rejects_when_below_threshold(model):
+    assert mixed_precision.enable_bf16(model, min_psnr=float("inf")) is None
+    assert not getattr(model, "bf16", False)
+    assert model.conv1.conv2d.weight.is_contiguous()
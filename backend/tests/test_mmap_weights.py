@@ -0,0 +1,74 @@
+import json
+import os
+import struct
+import sys
+import pytest
+
+TEST_ROOT = os.path.dirname(__file__)
+NEURAL_STYLE_DIR = os.path.abspath(
+    os.path.join(TEST_ROOT, "..", "..", "neural_style_transfer", "neural_style")
+)
+PROJECT_ROOT = os.path.abspath(os.path.join(TEST_ROOT, ".."))
+for path in (NEURAL_STYLE_DIR, PROJECT_ROOT):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+torch = pytest.importorskip("torch")
+if not hasattr(torch, "nn"):
+    pytest.skip("real torch is required", allow_module_level=True)
+
+try:
+    import mmap_weights  # noqa: E402
+    from serve import share_model_memory  # noqa: E402
+    from transformer_net import TransformerNet  # noqa: E402
+except Exception as exc:  # pragma: no cover - defensive
+    pytest.skip(f"mmap_weights import failed: {exc}", allow_module_level=True)
+
+
+@pytest.fixture()
+def model_path(tmp_path):
+    torch.manual_seed(0)
+    path = str(tmp_path / "mosaic.pth")
+    # DataParallel-style keys, as in some of the trained checkpoints
+    torch.save({f"module.{k}": v for k, v in TransformerNet().state_dict().items()}, path)
+    return path
+
+
+def test_mapped_model_matches_checkpoint(model_path):
+    assert mmap_weights.load_mmap_model(model_path) is None
+    mmap_weights.convert_checkpoint(model_path)
+
+    mapped = mmap_weights.load_mmap_model(model_path)
+    assert mapped is not None
+    eager = mmap_weights.load_eager_model(model_path)
+    x = torch.rand(1, 3, 37, 53) * 255
+    with torch.no_grad():
+        assert torch.equal(mapped(x), eager(x))
+
+
+def test_file_uses_the_safetensors_layout(model_path):
+    path = mmap_weights.convert_checkpoint(model_path)
+    with open(path, "rb") as f:
+        (length,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(length))
+    assert (8 + length) % mmap_weights.ALIGNMENT == 0
+    assert "conv1.conv2d.weight" in header
+    assert header["conv1.conv2d.weight"]["dtype"] == "F32"
+    assert not any("running_" in name for name in header)
+
+
+def test_parameters_view_the_mapping_without_copies(model_path):
+    mmap_weights.convert_checkpoint(model_path)
+    model = mmap_weights.load_mmap_model(model_path)
+    params = list(model.parameters())
+    assert all(not p.untyped_storage().resizable() for p in params)
+    # serve.py leaves mapped pages in place: fork already shares them
+    share_model_memory(model)
+    assert all(not p.is_shared() for p in params)
+
+
+def test_replaced_checkpoint_makes_the_file_stale(model_path):
+    mmap_weights.convert_checkpoint(model_path)
+    torch.save(TransformerNet().state_dict(), model_path)
+    os.utime(model_path, ns=(0, 0))
+    assert mmap_weights.load_mmap_model(model_path) is None
@@ -0,0 +1,79 @@
+import os
+import sys
+import threading
+import time
+
+TEST_ROOT = os.path.dirname(__file__)
+NEURAL_STYLE_DIR = os.path.abspath(
+    os.path.join(TEST_ROOT, "..", "..", "neural_style_transfer", "neural_style")
+)
+if NEURAL_STYLE_DIR not in sys.path:
+    sys.path.insert(0, NEURAL_STYLE_DIR)
+
+from model_cache import ModelCache  # noqa: E402
+
+
+class _FakeModel:
+    def __init__(self, nbytes):
+        self.nbytes = nbytes
+
+
+def test_lru_eviction_respects_budget_and_pins():
+    cache = ModelCache(max_bytes=250)
+    cache.get_or_load("a", lambda: _FakeModel(100), pin=True)
+    cache.get_or_load("b", lambda: _FakeModel(100))
+    cache.get_or_load("c", lambda: _FakeModel(100))
+
+    assert "a" in cache
+    assert "b" not in cache
+    assert "c" in cache
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["resident_bytes"] == 200
+    assert stats["pinned"] == ["a"]
+
+
+def test_hits_and_misses_are_counted():
+    cache = ModelCache()
+    cache.get_or_load("a", lambda: _FakeModel(1))
+    cache.get_or_load("a", lambda: _FakeModel(1))
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+    assert stats["models"]["a"]["hits"] == 1
+
+
+def test_concurrent_first_requests_load_once():
+    calls = []
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.05)
+        return _FakeModel(1)
+
+    cache = ModelCache()
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(cache.get_or_load("a", loader)))
+        for _ in range(5)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=5)
+
+    assert len(calls) == 1
+    assert len({id(r) for r in results}) == 1
+
+
+def test_failed_load_is_not_cached():
+    cache = ModelCache()
+
+    def broken():
+        raise IOError("missing")
+
+    try:
+        cache.get_or_load("a", broken)
+    except IOError:
+        pass
+    assert "a" not in cache
+    assert cache.get_or_load("a", lambda: _FakeModel(1)).nbytes == 1
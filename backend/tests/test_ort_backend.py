@@ -0,0 +1,60 @@
+import os
+import sys
+import pytest
+
+TEST_ROOT = os.path.dirname(__file__)
+NEURAL_STYLE_DIR = os.path.abspath(
+    os.path.join(TEST_ROOT, "..", "..", "neural_style_transfer", "neural_style")
+)
+if NEURAL_STYLE_DIR not in sys.path:
+    sys.path.insert(0, NEURAL_STYLE_DIR)
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("onnxruntime")
+pytest.importorskip("onnx")
+
+try:
+    import ort_backend  # noqa: E402
+    from transformer_net import TransformerNet  # noqa: E402
+except Exception as exc:  # pragma: no cover - defensive
+    pytest.skip(f"ort_backend import failed: {exc}", allow_module_level=True)
+
+
+@pytest.fixture()
+def model_path(tmp_path):
+    torch.manual_seed(0)
+    path = str(tmp_path / "mosaic.pth")
+    torch.save(TransformerNet().state_dict(), path)
+    return path
+
+
+def test_autoexport_matches_torch_on_odd_sizes(model_path):
+    model = ort_backend.load_ort_model(model_path, intra_op_threads=1)
+    assert model is not None
+    assert os.path.exists(ort_backend.onnx_path(model_path))
+    assert model.nbytes == os.path.getsize(ort_backend.onnx_path(model_path))
+
+    eager = TransformerNet()
+    eager.load_state_dict(torch.load(model_path))
+    eager.eval()
+    for shape in ((1, 3, 37, 53), (2, 3, 64, 64)):
+        x = torch.rand(shape) * 255
+        with torch.no_grad():
+            expected = eager(x)
+        out = model(x)
+        assert out.shape == expected.shape
+        assert (out - expected).abs().max().item() < 1e-2
+
+
+def test_stale_export_is_redone_or_ignored(model_path):
+    ort_backend.load_ort_model(model_path)
+    torch.save(TransformerNet().state_dict(), model_path)
+    os.utime(model_path, ns=(0, 0))
+
+    assert ort_backend.load_ort_model(model_path, autoexport=False) is None
+    assert ort_backend.load_ort_model(model_path) is not None
+    assert ort_backend.load_ort_model(model_path, autoexport=False) is not None
+
+
+def test_missing_export_without_autoexport_returns_none(model_path):
+    assert ort_backend.load_ort_model(model_path, autoexport=False) is None
@@ -0,0 +1,61 @@
+import os
+import sys
+
+import numpy as np
+
+TEST_ROOT = os.path.dirname(__file__)
+PROJECT_ROOT = os.path.abspath(os.path.join(TEST_ROOT, ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+import palette  # noqa: E402
+from palette import Palette  # noqa: E402
+
+COLORS = {
+    (100, 100, 100): 1,
+    (120, 100, 100): 2,  # overlaps the first entry's tolerance cube
+    (0, 0, 0): 3,
+    (255, 255, 255): 4,
+}
+
+
+# Scalar reference: exact match, then first entry within tolerance, then default
+def _reference(r, g, b, tolerance=30, default=9):
+    if (r, g, b) in COLORS:
+        return COLORS[(r, g, b)]
+    for (cr, cg, cb), class_id in COLORS.items():
+        if abs(r - cr) <= tolerance and abs(g - cg) <= tolerance and abs(b - cb) <= tolerance:
+            return class_id
+    return default
+
+
+def test_exact_color_wins_over_earlier_tolerance_match():
+    lookup = Palette(COLORS, tolerance=30, default=9)
+    assert lookup.class_id(120, 100, 100) == 2
+    # Inside both cubes: the first entry wins
+    assert lookup.class_id(110, 100, 100) == 1
+    # Only inside the second cube
+    assert lookup.class_id(140, 100, 100) == 2
+
+
+def test_tolerance_bounds_are_inclusive():
+    lookup = Palette(COLORS, tolerance=30, default=9)
+    assert lookup.class_id(70, 130, 100) == 1
+    assert lookup.class_id(69, 100, 100) == 9
+    assert lookup.class_id(30, 30, 30) == 3
+    assert lookup.class_id(225, 255, 230) == 4
+
+
+def test_label_map_matches_scalar_rules(monkeypatch):
+    # Small bands so the image spans several of them, including a partial one
+    monkeypatch.setattr(palette, "CHUNK_PIXELS", 100)
+    rng = np.random.default_rng(0)
+    rgb = rng.integers(0, 256, (37, 23, 3), dtype=np.uint8)
+    rgb[:5] = rng.integers(60, 160, (5, 23, 3), dtype=np.uint8)
+    lookup = Palette(COLORS, tolerance=30, default=9)
+
+    labels = lookup.label_map(rgb)
+
+    assert labels.shape == (37, 23) and labels.dtype == np.uint8
+    expected = [[_reference(*map(int, px)) for px in row] for row in rgb]
+    assert labels.tolist() == expected
@@ -0,0 +1,54 @@
+import json
+import os
+import sys
+
+TEST_ROOT = os.path.dirname(__file__)
+PROJECT_ROOT = os.path.abspath(os.path.join(TEST_ROOT, ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from perf_profile import PROFILE_VERSION, apply_profile, host_fingerprint, load_profile  # noqa: E402
+
+
+def _write(path, settings, host=None, version=PROFILE_VERSION):
+    path.write_text(json.dumps({
+        'version': version,
+        'host': host or host_fingerprint(),
+        'settings': settings,
+    }))
+    return str(path)
+
+
+def test_missing_profile_is_ignored(tmp_path):
+    assert load_profile(str(tmp_path / "missing.json")) is None
+    assert apply_profile(str(tmp_path / "missing.json")) == []
+
+
+def test_profile_settings_become_defaults(tmp_path, monkeypatch):
+    monkeypatch.delenv("AUTOTUNE_TEST_TILE", raising=False)
+    monkeypatch.setenv("AUTOTUNE_TEST_BACKEND", "torch")
+    path = _write(tmp_path / "profile.json", {"AUTOTUNE_TEST_TILE": 384, "AUTOTUNE_TEST_BACKEND": "onnxruntime"})
+
+    applied = apply_profile(path)
+
+    assert applied == ["AUTOTUNE_TEST_TILE"]
+    assert os.environ["AUTOTUNE_TEST_TILE"] == "384"
+    # Explicit environment variables win over the profile
+    assert os.environ["AUTOTUNE_TEST_BACKEND"] == "torch"
+    monkeypatch.delenv("AUTOTUNE_TEST_TILE")
+
+
+def test_profile_from_other_hardware_is_ignored(tmp_path, monkeypatch):
+    monkeypatch.delenv("AUTOTUNE_TEST_TILE", raising=False)
+    host = dict(host_fingerprint(), cpus=host_fingerprint()["cpus"] + 64)
+    path = _write(tmp_path / "profile.json", {"AUTOTUNE_TEST_TILE": 384}, host=host)
+
+    assert apply_profile(path) == []
+    assert "AUTOTUNE_TEST_TILE" not in os.environ
+
+
+def test_profile_of_other_version_or_corrupt_is_ignored(tmp_path):
+    assert load_profile(_write(tmp_path / "old.json", {}, version=PROFILE_VERSION + 1)) is None
+    corrupt = tmp_path / "corrupt.json"
+    corrupt.write_text("{not json")
+    assert load_profile(str(corrupt)) is None
@@ -0,0 +1,72 @@
+import os
+import sys
+import pytest
+
+TEST_ROOT = os.path.dirname(__file__)
+NEURAL_STYLE_DIR = os.path.abspath(
+    os.path.join(TEST_ROOT, "..", "..", "neural_style_transfer", "neural_style")
+)
+if NEURAL_STYLE_DIR not in sys.path:
+    sys.path.insert(0, NEURAL_STYLE_DIR)
+
+torch = pytest.importorskip("torch")
+
+try:
+    import quantize  # noqa: E402
+    from model_cache import model_nbytes  # noqa: E402
+    from transformer_net import TransformerNet  # noqa: E402
+except Exception as exc:  # pragma: no cover - defensive
+    pytest.skip(f"quantize import failed: {exc}", allow_module_level=True)
+
+
+@pytest.fixture()
+def eager():
+    torch.manual_seed(0)
+    return TransformerNet().eval()
+
+
+@pytest.fixture()
+def calibration():
+    torch.manual_seed(1)
+    return [torch.rand(1, 3, 48, 48) * 255 for _ in range(2)]
+
+
+def test_quantized_model_stays_close_to_fp32(eager, calibration):
+    int8 = quantize.quantize_model(eager, calibration)
+    report = quantize.evaluate(eager, int8, calibration, runs=1)
+    assert report["ssim_min"] > 0.9
+    assert report["psnr_min"] > 30
+    assert report["speedup"] > 0
+
+
+def test_ssim_and_psnr_of_identical_images():
+    x = torch.rand(1, 3, 32, 32) * 255
+    assert quantize.ssim(x, x) == pytest.approx(1.0, abs=1e-4)
+    assert quantize.psnr(x, x) == float("inf")
+    assert quantize.ssim(x, 255 - x) < 0.5
+
+
+def test_artifact_round_trip_and_staleness(eager, calibration, tmp_path):
+    model_path = str(tmp_path / "mosaic.pth")
+    torch.save(eager.state_dict(), model_path)
+    int8 = quantize.quantize_model(eager, calibration)
+
+    path = quantize.save_quantized_artifact(int8, model_path, {"ssim_min": 0.99})
+    assert path == str(tmp_path / "mosaic.int8.pt")
+
+    loaded = quantize.load_quantized_model(model_path)
+    assert loaded is not None
+    # Packed INT8 weights are not parameters: the cache uses the artifact size
+    assert model_nbytes(loaded) == os.path.getsize(path)
+    x = torch.rand(1, 3, 40, 44) * 255
+    with torch.no_grad():
+        assert torch.equal(loaded(x), int8(x))
+
+    # Replacing the checkpoint invalidates the artifact
+    torch.save(eager.state_dict(), model_path)
+    os.utime(model_path, ns=(0, 0))
+    assert quantize.load_quantized_model(model_path) is None
+
+
+def test_missing_artifact_returns_none(tmp_path):
+    assert quantize.load_quantized_model(str(tmp_path / "none.pth")) is None
@@ -0,0 +1,113 @@
+import os
+import sys
+
+TEST_ROOT = os.path.dirname(__file__)
+PROJECT_ROOT = os.path.abspath(os.path.join(TEST_ROOT, ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from result_cache import ResultCache, cache_key  # noqa: E402
+
+
+def test_cache_key_depends_on_every_component():
+    base = cache_key(b"img", "stylize", "mosaic", {"max_size": 1024})
+    assert base == cache_key(b"img", "stylize", "mosaic", {"max_size": 1024})
+    assert base != cache_key(b"img2", "stylize", "mosaic", {"max_size": 1024})
+    assert base != cache_key(b"img", "stylize", "candy", {"max_size": 1024})
+    assert base != cache_key(b"img", "stylize", "mosaic", {"max_size": 512})
+    assert base != cache_key(b"img", "enhance", "mosaic", {"max_size": 1024})
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    cache = ResultCache(directory=str(tmp_path))
+    cache.put("ab" * 32, b"payload")
+    cache.flush()
+
+    reopened = ResultCache(directory=str(tmp_path))
+    assert reopened.get("ab" * 32) == b"payload"
+    assert reopened.stats()["disk_hits"] == 1
+    assert reopened.get("ab" * 32) == b"payload"
+    assert reopened.stats()["memory_hits"] == 1
+
+
+def test_disk_tier_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(directory=str(tmp_path), max_disk_bytes=10, max_memory_bytes=0)
+    cache.put("a" * 64, b"12345")
+    cache.put("b" * 64, b"12345")
+    cache.flush()
+    cache.get("a" * 64)
+    cache.put("c" * 64, b"12345")
+    cache.flush()
+
+    assert cache.get("b" * 64) is None
+    assert cache.get("a" * 64) == b"12345"
+    assert cache.stats()["disk_bytes"] <= 10
+
+
+def test_disabled_cache_never_stores():
+    cache = ResultCache(enabled=False)
+    cache.put("k", b"v")
+    assert cache.get("k") is None
+
+
+def test_processes_sharing_a_directory_see_each_others_entries(tmp_path):
+    # Two caches opened before either wrote anything, like forked workers
+    first = ResultCache(directory=str(tmp_path), max_memory_bytes=0)
+    second = ResultCache(directory=str(tmp_path), max_memory_bytes=0)
+    first.put("d" * 64, b"shared")
+    first.flush()
+
+    assert second.get("d" * 64) == b"shared"
+    assert second.stats()["disk_hits"] == 1
+
+
+def test_disk_budget_covers_every_writer_of_the_directory(tmp_path):
+    writers = [ResultCache(directory=str(tmp_path), max_disk_bytes=12, max_memory_bytes=0) for _ in range(3)]
+    for i, cache in enumerate(writers):
+        cache.put(str(i) * 64, b"12345")
+        cache.flush()
+
+    sizes = [p.stat().st_size for p in tmp_path.rglob("*.bin")]
+    assert sum(sizes) <= 12
+    # The oldest entry was evicted, whichever process wrote it
+    assert writers[2].get("0" * 64) is None
+    assert writers[0].get("2" * 64) == b"12345"
+
+
+def test_put_does_not_wait_for_the_disk(tmp_path, monkeypatch):
+    import threading
+
+    cache = ResultCache(directory=str(tmp_path))
+    release = threading.Event()
+    write = cache._write_disk
+    monkeypatch.setattr(cache, "_write_disk", lambda key, data: (release.wait(5), write(key, data)))
+
+    cache.put("e" * 64, b"later")
+    # Served from memory while the write is still queued
+    assert cache.get("e" * 64) == b"later"
+    release.set()
+    cache.flush()
+    assert (tmp_path / "ee" / ("e" * 64 + ".bin")).read_bytes() == b"later"
+
+
+def test_writes_under_budget_do_not_rescan_the_directory(tmp_path, monkeypatch):
+    cache = ResultCache(directory=str(tmp_path), max_disk_bytes=12, max_memory_bytes=0)
+    scans = []
+    scan = cache._scan_disk
+    monkeypatch.setattr(cache, "_scan_disk", lambda: (scans.append(1), scan())[1])
+
+    cache.put("f" * 64, b"12345")
+    cache.put("f" * 64, b"12345")
+    cache.put("g" * 64, b"12345")
+    cache.flush()
+    # The running total covers new entries and overwrites without a scan
+    assert scans == []
+    assert cache.stats()["disk_entries"] == 2
+    assert cache.stats()["disk_bytes"] == 10
+
+    cache.put("h" * 64, b"12345")
+    cache.flush()
+    # Going over budget rescans once to pick what to evict
+    assert scans == [1]
+    assert cache.stats()["disk_bytes"] <= 12
+    assert cache.get("f" * 64) is None
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+TEST_ROOT = os.path.dirname(__file__)
+PROJECT_ROOT = os.path.abspath(os.path.join(TEST_ROOT, ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+torch = pytest.importorskip("torch")
+if not hasattr(torch, "nn"):
+    pytest.skip("real torch is required", allow_module_level=True)
+
+from serve import MAX_WORKERS, parse_args, share_model_memory, worker_thread_budget  # noqa: E402
+
+
+def test_thread_budget_splits_cores():
+    assert worker_thread_budget(4, cpus=16) == 4
+    assert worker_thread_budget(3, cpus=8) == 2
+    assert worker_thread_budget(16, cpus=4) == 1
+
+
+def test_share_model_memory_moves_parameters_and_buffers():
+    model = torch.nn.Sequential(torch.nn.Conv2d(3, 4, 3), torch.nn.BatchNorm2d(4))
+    nbytes = share_model_memory(model)
+    tensors = list(model.parameters()) + list(model.buffers())
+    assert all(t.is_shared() for t in tensors)
+    assert nbytes == sum(t.numel() * t.element_size() for t in tensors)
+
+
+def test_more_workers_than_the_shared_state_allows_are_refused():
+    assert parse_args([]).workers == 1
+    with pytest.raises(SystemExit):
+        parse_args(["--workers", str(MAX_WORKERS + 1)])
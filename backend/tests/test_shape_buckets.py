@@ -0,0 +1,41 @@
+import os
+import sys
+
+TEST_ROOT = os.path.dirname(__file__)
+PROJECT_ROOT = os.path.abspath(os.path.join(TEST_ROOT, ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from shape_buckets import ShapeBuckets  # noqa: E402
+
+
+def test_disabled_buckets_keep_the_input_shape():
+    buckets = ShapeBuckets(0)
+    assert not buckets.enabled
+    assert buckets.bucket(301, 457) == (301, 457)
+
+
+def test_sides_round_up_to_multiples_of_four():
+    buckets = ShapeBuckets(62)
+    # The step itself is rounded up so padded shapes round-trip through the model
+    assert buckets.step == 64
+    assert buckets.bucket(301, 457) == (320, 512)
+    assert buckets.bucket(320, 64) == (320, 64)
+    assert buckets.bucket(1, 1) == (64, 64)
+
+
+def test_hit_rate_counts_repeated_shapes():
+    buckets = ShapeBuckets(64, max_shapes=2)
+    assert not buckets.record(("m", 1, 320, 512))
+    assert buckets.record(("m", 1, 320, 512))
+    assert not buckets.record(("m", 2, 320, 512))
+    # The least recently used shape is forgotten beyond max_shapes
+    assert not buckets.record(("m", 1, 64, 64))
+    assert buckets.record(("m", 1, 320, 512)) is False
+
+    stats = buckets.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 4
+    assert stats["hit_rate"] == 0.2
+    assert stats["shapes"] == 2
+    assert sorted(entry["shape"] for entry in stats["top"]) == [[1, 64, 64], [1, 320, 512]]
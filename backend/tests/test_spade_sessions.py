@@ -0,0 +1,93 @@
+import os
+import sys
+
+import numpy as np
+
+TEST_ROOT = os.path.dirname(__file__)
+PROJECT_ROOT = os.path.abspath(os.path.join(TEST_ROOT, ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from spade_sessions import SessionStore, composite, dirty_boxes, group_boxes  # noqa: E402
+
+
+def test_unchanged_labels_have_no_dirty_boxes():
+    labels = np.zeros((100, 120), dtype=np.uint8)
+    assert dirty_boxes(labels, labels.copy()) == []
+
+
+def test_separate_strokes_give_separate_boxes_with_margin():
+    old = np.zeros((256, 256), dtype=np.uint8)
+    new = old.copy()
+    new[10:20, 10:20] = 5
+    new[200:210, 220:230] = 7
+
+    boxes = sorted(dirty_boxes(old, new, margin=16, cell=16))
+
+    assert len(boxes) == 2
+    (t, l, b, r), (t2, l2, b2, r2) = boxes
+    # Each box covers its stroke plus the margin, clipped to the canvas
+    assert t == 0 and l == 0 and b >= 20 + 16 and r >= 20 + 16
+    assert t2 <= 200 - 16 and l2 <= 220 - 16 and b2 >= 210 + 16 and r2 == 256
+
+
+def test_nearby_strokes_merge_into_one_box():
+    old = np.zeros((128, 128), dtype=np.uint8)
+    new = old.copy()
+    new[40:44, 40:44] = 1
+    new[40:44, 70:74] = 1
+    assert len(dirty_boxes(old, new, margin=16, cell=8)) == 1
+
+
+def test_composite_replaces_the_core_and_feathers_inner_edges():
+    output = np.zeros((64, 64, 3), dtype=np.uint8)
+    patch = np.full((32, 32, 3), 200, dtype=np.uint8)
+
+    composite(output, patch, (16, 16, 48, 48), feather=8)
+
+    assert (output[24:40, 24:40] == 200).all()
+    assert (output[:16] == 0).all()
+    # Ramp towards the untouched pixels
+    assert 0 < output[16, 32, 0] < output[20, 32, 0] < 200
+
+
+def test_store_ignores_other_params_and_evicts_least_recently_used():
+    labels = np.zeros((10, 10), dtype=np.uint8)
+    output = np.zeros((10, 10, 3), dtype=np.uint8)
+    store = SessionStore(max_bytes=2 * (labels.nbytes + output.nbytes), ttl=60)
+
+    store.put("a", "square", labels, output)
+    store.put("b", "square", labels, output)
+    assert store.get("a", "tiled") is None
+    assert store.get("a", "square") is not None
+    store.put("c", "square", labels, output)
+
+    # "b" was the least recently used
+    assert store.get("b", "square") is None
+    assert store.get("a", "square") is not None
+    assert store.stats()["sessions"] == 2
+
+
+def test_store_expires_idle_sessions():
+    store = SessionStore(ttl=0)
+    store.put("a", None, np.zeros((2, 2), dtype=np.uint8), np.zeros((2, 2, 3), dtype=np.uint8))
+    assert store.get("a", None) is None
+    assert store.stats()["sessions"] == 0
+
+
+def test_boxes_within_one_generator_window_are_generated_together():
+    boxes = [(10, 10, 60, 60), (400, 420, 480, 500)]
+    groups = group_boxes(boxes, (512, 512), window=512, context=64)
+    assert groups == [((10, 10, 480, 500), boxes)]
+
+
+def test_distant_boxes_on_a_large_canvas_stay_separate():
+    boxes = [(0, 0, 64, 64), (3000, 3000, 3064, 3064)]
+    groups = group_boxes(boxes, (4096, 4096), window=512, context=64)
+    assert [members for _, members in groups] == [[boxes[0]], [boxes[1]]]
+
+
+def test_scattered_boxes_costing_a_full_run_become_one_region():
+    boxes = [(y, x, y + 32, x + 32) for y in (0, 434, 868) for x in (0, 434, 868)]
+    groups = group_boxes(boxes, (900, 900), window=512, context=64)
+    assert groups == [((0, 0, 900, 900), boxes)]
@@ -0,0 +1,39 @@
+import os
+import sys
+import pytest
+
+TEST_ROOT = os.path.dirname(__file__)
+PROJECT_ROOT = os.path.abspath(os.path.join(TEST_ROOT, ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+torch = pytest.importorskip("torch")
+
+try:
+    import tiled_inference  # noqa: E402
+except Exception as exc:  # pragma: no cover - defensive
+    pytest.skip(f"tiled_inference import failed: {exc}", allow_module_level=True)
+
+
+def test_plan_axis_covers_whole_axis_with_aligned_starts():
+    segments = tiled_inference.plan_axis(1000, 384, 32, align=4)
+    assert segments[0][0] == 0
+    assert segments[-1][1] == 1000
+    for (_, prev_end), (start, _) in zip(segments, segments[1:]):
+        assert start % 4 == 0
+        assert start < prev_end
+
+
+def test_run_tiled_identity_reconstructs_input():
+    x = torch.rand(1, 3, 203, 317)
+    out = tiled_inference.run_tiled(lambda w: w, x, tile_size=96, context=16, overlap=8, workers=2)
+    assert out.shape == x.shape
+    assert torch.allclose(out, x, atol=1e-5)
+
+
+def test_run_tiled_reports_progress():
+    calls = []
+    x = torch.rand(1, 3, 64, 64)
+    tiled_inference.run_tiled(lambda w: w, x, tile_size=48, context=8, overlap=4,
+                              progress=lambda done, total: calls.append((done, total)))
+    assert calls[-1][0] == calls[-1][1] == len(calls)
@@ -0,0 +1,84 @@
+import os
+import sys
+import threading
+import pytest
+
+TEST_ROOT = os.path.dirname(__file__)
+PROJECT_ROOT = os.path.abspath(os.path.join(TEST_ROOT, ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+cv2 = pytest.importorskip("cv2")
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+if not hasattr(torch, "from_numpy"):  # pragma: no cover - lightweight torch stub
+    pytest.skip("real torch required", allow_module_level=True)
+
+from video_pipeline import frame_size, stylize_video  # noqa: E402
+
+
+def _write_clip(path, frames=10, size=(98, 66)):
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), 10.0, size)
+    assert writer.isOpened()
+    for i in range(frames):
+        frame = np.full((size[1], size[0], 3), i * 20, dtype=np.uint8)
+        writer.write(frame)
+    writer.release()
+
+
+def _read_frames(path):
+    capture = cv2.VideoCapture(path)
+    frames = []
+    while True:
+        ok, frame = capture.read()
+        if not ok:
+            break
+        frames.append(frame)
+    capture.release()
+    return frames
+
+
+def test_frame_size_fits_and_rounds_to_multiples_of_four():
+    assert frame_size(1920, 1080, 720) == (720, 404)
+    assert frame_size(98, 66, 720) == (96, 64)
+    assert frame_size(98, 66, 0) == (96, 64)
+
+
+def test_frames_are_stylized_in_batches_and_progress_is_reported(tmp_path):
+    src, dst = str(tmp_path / "in.mp4"), str(tmp_path / "out.mp4")
+    _write_clip(src, frames=10)
+    batches, progress = [], []
+
+    def forward(batch):
+        batches.append(tuple(batch.shape))
+        return 255 - batch
+
+    info = stylize_video(src, dst, forward, batch_size=4, queue_frames=4,
+                         progress=lambda done, total: progress.append((done, total)))
+
+    assert info["frames"] == 10
+    assert (info["width"], info["height"]) == (96, 64)
+    assert batches == [(4, 3, 64, 96), (4, 3, 64, 96), (2, 3, 64, 96)]
+    assert progress == [(4, 10), (8, 10), (10, 10)]
+    frames = _read_frames(dst)
+    assert len(frames) == 10
+    # First input frame is black, so the inverted output is close to white
+    assert frames[0].mean() > 200
+
+
+def test_max_frames_and_errors(tmp_path):
+    src, dst = str(tmp_path / "in.mp4"), str(tmp_path / "out.mp4")
+    _write_clip(src, frames=10)
+    assert stylize_video(src, dst, lambda b: b, batch_size=3, max_frames=5)["frames"] == 5
+
+    def broken(batch):
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError, match="boom"):
+        stylize_video(src, dst, broken)
+    # No pipeline thread is left behind
+    assert not [t for t in threading.enumerate() if t.name.startswith("video-")]
+
+    (tmp_path / "junk.mp4").write_bytes(b"not a video")
+    with pytest.raises(ValueError):
+        stylize_video(str(tmp_path / "junk.mp4"), dst, lambda b: b)
@@ -0,0 +1,41 @@
+import os
+import sys
+import threading
+
+TEST_ROOT = os.path.dirname(__file__)
+PROJECT_ROOT = os.path.abspath(os.path.join(TEST_ROOT, ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from warmup import Warmup  # noqa: E402
+
+
+def test_ready_without_warmup():
+    assert Warmup().ready
+
+
+def test_not_ready_until_all_tasks_finish():
+    release = threading.Event()
+    warmup = Warmup()
+    warmup.add("slow", release.wait)
+    warmup.add("fast", lambda: None)
+    warmup.start()
+
+    assert not warmup.ready
+    release.set()
+    assert warmup.wait(timeout=5)
+    assert warmup.status()["tasks"]["slow"]["state"] == "done"
+
+
+def test_failed_task_is_reported_and_does_not_block_readiness():
+    def broken():
+        raise RuntimeError("no weights")
+
+    warmup = Warmup()
+    warmup.add("broken", broken)
+    warmup.start()
+
+    assert warmup.wait(timeout=5)
+    task = warmup.status()["tasks"]["broken"]
+    assert task["state"] == "failed"
+    assert "no weights" in task["error"]
@@ -0,0 +1,222 @@
+"""
+Tiled, bounded-memory inference for fully convolutional image models.
+The input is split into overlapping tiles, each tile is run with extra
+reflection context around it, and the valid centres are feather-blended
+back into the full-resolution output. Peak activation memory depends on
+the tile size and worker count, not on the image size.
+"""
+# Import threading to serialise writes into the shared output buffers
+import threading
+# Import ThreadPoolExecutor to run tiles in parallel across cores
+from concurrent.futures import ThreadPoolExecutor
+# Import PyTorch for tensor operations
+import torch
+# Import functional API for padding and normalisation
+import torch.nn.functional as F
+
+
+# Function to split one image axis into overlapping core segments
+# length: Size of the axis in pixels
+# core: Size of each tile's core (the part written to the output)
+# overlap: Number of pixels shared by neighbouring cores (blended)
+# align: Core start positions are multiples of this value
+# Returns: List of (start, end) pairs covering [0, length)
+def plan_axis(length, core, overlap, align=1):
+    """Return overlapping (start, end) segments covering an axis."""
+    if length <= core:
+        return [(0, length)]
+    stride = max(align, (core - overlap) // align * align)
+    starts = list(range(0, length - core, stride))
+    # Final tile is pushed back so it ends exactly at the border
+    last = max(0, (length - core) // align * align)
+    if not starts or starts[-1] < last:
+        starts.append(last)
+    return [(s, length if s == last else s + core) for s in starts]
+
+
+# Function to build a 1-D blending ramp for one tile axis
+# size: Length of the tile core along this axis
+# overlap: Width of the feathered region
+# ramp_start / ramp_end: Whether the tile has a neighbour on that side
+def _axis_weights(size, overlap, ramp_start, ramp_end):
+    weights = torch.ones(size)
+    ramp_len = min(overlap, size // 2)
+    if ramp_len > 0:
+        ramp = torch.arange(1, ramp_len + 1, dtype=torch.float32) / (ramp_len + 1)
+        if ramp_start:
+            weights[:ramp_len] = ramp
+        if ramp_end:
+            weights[size - ramp_len:] = torch.minimum(weights[size - ramp_len:], ramp.flip(0))
+    return weights
+
+
+# Function to pad an image tensor with mirrored context on all sides
+def _pad_context(tensor, context, mode='reflect'):
+    if context <= 0:
+        return tensor
+    h, w = tensor.shape[-2:]
+    # Reflection needs the pad to be smaller than the side it mirrors
+    if mode == 'reflect' and (context >= h or context >= w):
+        mode = 'replicate'
+    return F.pad(tensor, (context, context, context, context), mode=mode)
+
+
+# Function to run a model tile by tile and blend the results
+# forward: Callable mapping a [1, C, h, w] window to a [1, C', h*scale, w*scale] output
+# tensor: Full input tensor of shape [1, C, H, W]
+# tile_size: Size of the window fed to the model (core + 2 * context)
+# context: Pixels of surrounding context added on each side of a core
+# overlap: Pixels shared and blended between neighbouring cores
+# workers: Number of tiles processed in parallel
+# scale: Output/input resolution ratio of the model
+# align: Tile positions are multiples of this (e.g. 4 for two stride-2 convs)
+# progress: Optional callback(done, total) invoked after every tile
+# pad_mode: Padding used to create context beyond the image border
+# Returns: Blended output tensor of shape [1, C', H*scale, W*scale] on CPU
+def run_tiled(forward, tensor, tile_size=512, context=64, overlap=32, workers=1,
+              scale=1, align=4, progress=None, pad_mode='reflect'):
+    """Run forward() over overlapping tiles of tensor and blend the outputs."""
+    _, _, height, width = tensor.shape
+    core = max(align, tile_size - 2 * context)
+    rows = plan_axis(height, core, overlap, align)
+    cols = plan_axis(width, core, overlap, align)
+    tiles = [(r, c) for r in rows for c in cols]
+
+    padded = _pad_context(tensor, context, pad_mode)
+    output = None
+    weight = torch.zeros(1, 1, height * scale, width * scale)
+    lock = threading.Lock()
+    done = [0]
+
+    def process(tile):
+        nonlocal output
+        (top, bottom), (left, right) = tile
+        # Window in padded coordinates: the core plus context on every side
+        window = padded[:, :, top:bottom + 2 * context, left:right + 2 * context]
+        result = forward(window)
+        # Keep only the core of the output, dropping the context margin
+        y0, x0 = context * scale, context * scale
+        core_out = result[:, :, y0:y0 + (bottom - top) * scale, x0:x0 + (right - left) * scale]
+        core_out = core_out.float().cpu()
+
+        tile_weight = torch.outer(
+            _axis_weights((bottom - top) * scale, overlap * scale, top > 0, bottom < height),
+            _axis_weights((right - left) * scale, overlap * scale, left > 0, right < width),
+        )[None, None]
+
+        ys = slice(top * scale, bottom * scale)
+        xs = slice(left * scale, right * scale)
+        with lock:
+            if output is None:
+                output = torch.zeros(1, core_out.shape[1], height * scale, width * scale)
+            output[:, :, ys, xs] += core_out * tile_weight
+            weight[:, :, ys, xs] += tile_weight
+            done[0] += 1
+            finished = done[0]
+        if progress is not None:
+            progress(finished, len(tiles))
+
+    if workers <= 1 or len(tiles) == 1:
+        for tile in tiles:
+            process(tile)
+    else:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tile') as pool:
+            # list() re-raises the first tile failure, if any
+            list(pool.map(process, tiles))
+
+    return output / weight.clamp_min(1e-8)
+
+
+# ---------- TransformerNet with global instance-norm statistics ----------
+# InstanceNorm computed per tile would give every tile its own colour and
+# contrast. Instead the statistics of every norm layer are measured once on a
+# downscaled copy of the whole image and reused for all tiles, so tiles are
+# normalised identically and only the convolution receptive field (~54px for
+# TransformerNet) has to be covered by the context margin.
+
+_RESIDUAL_BLOCKS = ('res1', 'res2', 'res3', 'res4', 'res5')
+
+
+# Function to check whether a model exposes the TransformerNet layer layout
+def supports_global_norm(model):
+    """True if model has the TransformerNet submodules used by the tiled forward."""
+    names = ('conv1', 'in1', 'conv2', 'in2', 'conv3', 'in3', 'deconv1', 'in4',
+             'deconv2', 'in5', 'deconv3', 'relu') + _RESIDUAL_BLOCKS
+    return all(hasattr(model, n) for n in names)
+
+
+# Function mirroring TransformerNet.forward with a pluggable normalisation step
+# norm: Callable(name, module, x) replacing each InstanceNorm2d call
+def _transformer_forward(model, x, norm):
+    relu = model.relu
+    y = relu(norm('in1', model.in1, model.conv1(x)))
+    y = relu(norm('in2', model.in2, model.conv2(y)))
+    y = relu(norm('in3', model.in3, model.conv3(y)))
+    for name in _RESIDUAL_BLOCKS:
+        block = getattr(model, name)
+        residual = y
+        out = block.relu(norm(f'{name}.in1', block.in1, block.conv1(y)))
+        out = norm(f'{name}.in2', block.in2, block.conv2(out))
+        y = out + residual
+    y = relu(norm('in4', model.in4, model.deconv1(y)))
+    y = relu(norm('in5', model.in5, model.deconv2(y)))
+    return model.deconv3(y)
+
+
+# Function to measure per-channel statistics of every InstanceNorm layer
+# model: TransformerNet instance
+# tensor: Input tensor [1, 3, H, W] (typically a downscaled copy of the image)
+# Returns: Dict of layer name -> (mean, var) tensors of shape [C]
+def capture_norm_stats(model, tensor):
+    """Run the model once and record the mean/var seen by each norm layer."""
+    stats = {}
+
+    def record(name, module, x):
+        var, mean = torch.var_mean(x, dim=(0, 2, 3), unbiased=False)
+        stats[name] = (mean, var)
+        return F.instance_norm(x, weight=module.weight, bias=module.bias, eps=module.eps)
+
+    with torch.no_grad():
+        _transformer_forward(model, tensor, record)
+    return stats
+
+
+# Function to run TransformerNet with fixed (global) normalisation statistics
+def forward_with_norm_stats(model, x, stats):
+    """Forward pass using precomputed norm statistics instead of per-input ones."""
+    def apply(name, module, y):
+        mean, var = stats[name]
+        return F.batch_norm(y, mean, var, module.weight, module.bias, False, 0.0, module.eps)
+
+    with torch.no_grad():
+        return _transformer_forward(model, x, apply)
+
+
+# Function to stylize an arbitrarily large image tile by tile
+# model: Style model (TransformerNet or any callable on [N, 3, H, W] tensors)
+# tensor: Input tensor [1, 3, H, W] in [0, 255] range
+# stats_size: Longest side of the downscaled copy used to measure norm statistics
+# Returns: Stylized tensor [1, 3, H, W] on CPU
+def stylize_tiled(model, tensor, tile_size=512, context=64, overlap=32, workers=1,
+                  stats_size=1024, progress=None):
+    """Tiled style transfer with seam-free instance normalisation."""
+    if supports_global_norm(model):
+        h, w = tensor.shape[-2:]
+        factor = min(1.0, stats_size / max(h, w))
+        preview = tensor
+        if factor < 1.0:
+            preview = F.interpolate(tensor, size=(max(4, round(h * factor)), max(4, round(w * factor))),
+                                    mode='bilinear', align_corners=False)
+        stats = capture_norm_stats(model, preview)
+
+        def forward(window):
+            return forward_with_norm_stats(model, window, stats)
+    else:
+        # Opaque models (e.g. compiled artifacts) fall back to per-tile norms
+        def forward(window):
+            with torch.no_grad():
+                return model(window)
+
+    return run_tiled(forward, tensor, tile_size=tile_size, context=context,
+                     overlap=overlap, workers=workers, scale=1, align=4,
+                     progress=progress)
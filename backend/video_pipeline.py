@@ -0,0 +1,182 @@
+"""
+Pipelined video stylization.
+A reader thread decodes frames with OpenCV, the calling thread runs them
+through the style model in batches, and a writer thread encodes the
+result, so decoding, inference and encoding overlap. The stages are
+connected by bounded queues: memory stays constant however long the clip
+is, and a slow stage simply makes the others wait.
+"""
+# Import queue for the bounded hand-off between stages
+import queue
+# Import threading for the reader and writer threads
+import threading
+# Import cv2 (OpenCV) for video decoding and encoding
+import cv2
+# Import numpy to stack frames into batches
+import numpy as np
+# Import PyTorch to hand batches to the model
+import torch
+# Import stage timers reported by /metrics
+from metrics import stage
+
+
+# Codecs tried in order: H.264 plays in browsers but is missing from some
+# OpenCV builds, MPEG-4 Part 2 is always available
+VIDEO_CODECS = ('avc1', 'mp4v')
+
+# Marks the end of a stream between stages
+_END = object()
+
+
+# Error raised in a pipeline thread, re-raised by the caller
+class _Failure:
+    __slots__ = ('error',)
+
+    def __init__(self, error):
+        self.error = error
+
+
+# Function to put an item on a bounded queue unless the pipeline is stopping
+def _put(q, item, stop):
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+# Function to take an item from a queue, giving up if the pipeline is stopping
+def _get(q, stop):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _END
+
+
+# Function returning the output frame size for a source size
+# Sides are scaled to fit max_size and rounded down to multiples of 4, so the
+# frames round-trip through TransformerNet exactly and suit every codec
+def frame_size(width, height, max_size):
+    scale = min(1.0, max_size / max(width, height, 1)) if max_size else 1.0
+    return max(4, int(width * scale) // 4 * 4), max(4, int(height * scale) // 4 * 4)
+
+
+# Function opening a video writer with the first codec this OpenCV build supports
+def _open_writer(path, fps, size):
+    for codec in VIDEO_CODECS:
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*codec), fps, size)
+        if writer.isOpened():
+            return writer
+        writer.release()
+    raise RuntimeError('No usable video codec in this OpenCV build')
+
+
+# Function to stylize a video file frame by frame
+# src_path: Input container (MP4, WebM, ... anything OpenCV can read)
+# dst_path: Output .mp4 path
+# forward: Callable(batch) -> batch, both [N, 3, H, W] float tensors in 0-255
+# batch_size: Frames per forward
+# max_size: Longest side of the output frames (0 = keep the source size)
+# max_frames: Stop after this many frames (0 = whole clip)
+# queue_frames: Decoded frames buffered ahead of inference
+# progress: Optional callback(done, total) called as frames are written
+# Returns: Dict with frames written, fps, width and height
+def stylize_video(src_path, dst_path, forward, batch_size=4, max_size=720, max_frames=0,
+                  queue_frames=16, progress=None):
+    """Decode, stylize and encode a video with the three stages running concurrently."""
+    capture = cv2.VideoCapture(src_path)
+    if not capture.isOpened():
+        raise ValueError('Could not read the video (unsupported or corrupt file)')
+    fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+    total = int(capture.get(cv2.CAP_PROP_FRAME_COUNT)) or None
+    if max_frames:
+        total = min(total, max_frames) if total else max_frames
+    width, height = frame_size(int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                               int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)), max_size)
+
+    batch_size = max(1, batch_size)
+    decoded = queue.Queue(maxsize=max(batch_size, queue_frames))
+    stylized = queue.Queue(maxsize=2)
+    stop = threading.Event()
+    written = [0]
+
+    def read():
+        try:
+            count = 0
+            while not max_frames or count < max_frames:
+                with stage('stylize_video', 'decode'):
+                    ok, frame = capture.read()
+                    if not ok:
+                        break
+                    if frame.shape[1] != width or frame.shape[0] != height:
+                        frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+                    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                if not _put(decoded, frame, stop):
+                    return
+                count += 1
+            _put(decoded, _END, stop)
+        except Exception as e:
+            _put(decoded, _Failure(e), stop)
+        finally:
+            capture.release()
+
+    def write():
+        writer = None
+        try:
+            writer = _open_writer(dst_path, fps, (width, height))
+            while True:
+                frames = _get(stylized, stop)
+                if frames is _END:
+                    return
+                with stage('stylize_video', 'encode'):
+                    for frame in frames:
+                        writer.write(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
+                written[0] += len(frames)
+                if progress is not None:
+                    progress(written[0], total)
+        except Exception as e:
+            failures.append(e)
+            # Unblock the inference loop
+            stop.set()
+        finally:
+            if writer is not None:
+                writer.release()
+
+    failures = []
+    reader = threading.Thread(target=read, name='video-reader', daemon=True)
+    writer_thread = threading.Thread(target=write, name='video-writer', daemon=True)
+    reader.start()
+    writer_thread.start()
+    try:
+        finished = False
+        while not finished:
+            frames = []
+            while len(frames) < batch_size:
+                item = _get(decoded, stop)
+                if isinstance(item, _Failure):
+                    raise item.error
+                if item is _END:
+                    finished = True
+                    break
+                frames.append(item)
+            if not frames:
+                break
+            with stage('stylize_video', 'forward'):
+                batch = torch.from_numpy(np.stack(frames)).permute(0, 3, 1, 2).float()
+                output = forward(batch)[:, :, :height, :width]
+                output = output.clamp(0, 255).to(torch.uint8).permute(0, 2, 3, 1).contiguous().numpy()
+            if not _put(stylized, output, stop):
+                break
+        _put(stylized, _END, stop)
+        writer_thread.join()
+    finally:
+        stop.set()
+        reader.join()
+        writer_thread.join()
+    if failures:
+        raise failures[0]
+    return {'frames': written[0], 'fps': fps, 'width': width, 'height': height}
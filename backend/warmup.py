@@ -0,0 +1,108 @@
+"""
+Startup warmup and readiness tracking.
+Each engine registers a warmup task (load the model, run a dummy forward)
+that runs in its own background thread at boot. The instance reports
+ready only once every task has finished, so a load balancer can keep
+traffic away from cold instances.
+"""
+# Import threading to run warmup tasks in the background
+import threading
+# Import time to measure task durations
+import time
+# Import traceback to log task failures
+import traceback
+
+
+# One warmup task and its outcome
+class _Task:
+    __slots__ = ('name', 'fn', 'state', 'error', 'seconds')
+
+    def __init__(self, name, fn):
+        self.name = name
+        self.fn = fn
+        # pending -> running -> done | failed
+        self.state = 'pending'
+        self.error = None
+        self.seconds = None
+
+
+class Warmup:
+    """
+    Runs registered warmup tasks in background threads and tracks readiness.
+    An instance that never started a warmup is considered ready.
+    """
+
+    def __init__(self):
+        self._tasks = []
+        self._threads = []
+        self._lock = threading.Lock()
+        self._started_at = None
+        self._all_done = threading.Event()
+        self._all_done.set()
+
+    # Function to register a warmup task (must be called before start())
+    # name: Task name shown in the readiness report
+    # fn: Zero-argument callable doing the loading/warmup work
+    def add(self, name, fn):
+        with self._lock:
+            self._tasks.append(_Task(name, fn))
+
+    # Function to launch every registered task in its own thread
+    def start(self):
+        """Start all registered tasks; readiness is withheld until they finish."""
+        with self._lock:
+            if self._started_at is not None or not self._tasks:
+                return
+            self._started_at = time.time()
+            self._all_done.clear()
+            for task in self._tasks:
+                thread = threading.Thread(target=self._run, args=(task,),
+                                          name=f'warmup-{task.name}', daemon=True)
+                self._threads.append(thread)
+                thread.start()
+
+    @property
+    def ready(self):
+        """True when no warmup is in progress."""
+        return self._all_done.is_set()
+
+    # Function to block until warmup has finished
+    # Returns: True if ready within the timeout
+    def wait(self, timeout=None):
+        return self._all_done.wait(timeout)
+
+    # Function returning the per-task warmup report
+    def status(self):
+        with self._lock:
+            return {
+                'ready': self.ready,
+                'started_at': self._started_at,
+                'tasks': {
+                    task.name: {
+                        'state': task.state,
+                        'seconds': None if task.seconds is None else round(task.seconds, 3),
+                        'error': task.error,
+                    }
+                    for task in self._tasks
+                },
+            }
+
+    def _run(self, task):
+        task.state = 'running'
+        start = time.perf_counter()
+        try:
+            task.fn()
+            task.state = 'done'
+        except Exception as e:
+            # A failed engine must not keep the whole instance out of rotation;
+            # the failure is reported and the engine keeps loading lazily
+            task.state = 'failed'
+            task.error = f'{type(e).__name__}: {e}'
+            print(f"Warmup task '{task.name}' failed: {task.error}")
+            traceback.print_exc()
+        finally:
+            task.seconds = time.perf_counter() - start
+            print(f"Warmup task '{task.name}' {task.state} in {task.seconds:.2f}s")
+            with self._lock:
+                if all(t.state in ('done', 'failed') for t in self._tasks):
+                    self._all_done.set()
@@ -0,0 +1,343 @@
+"""
+Inference build for TransformerNet style models.
+
+Turns a trained (eager) TransformerNet into an inference artifact:
+reflection padding is folded into the convolutions (padding_mode='reflect'),
+instance norm and ReLU run as one step with an in-place activation, and
+the network is compiled with TorchScript and frozen. The artifact is saved
+next to the checkpoint in saved_models (mosaic.pth -> mosaic.frozen.pt)
+together with the checkpoint fingerprint, so a stale artifact is ignored
+once the .pth is replaced.
+
+Usage:
+    python inference_build.py saved_models/*.pth [--check] [--benchmark]
+"""
+# Import argparse for the command-line interface
+import argparse
+# Import contextlib for the atomic write helper
+import contextlib
+# Import json to store artifact metadata
+import json
+# Import os for file system operations
+import os
+# Import threading to name temporary files per writer
+import threading
+# Import time for load/latency measurements
+import time
+# Import warnings to silence TorchScript deprecation notices
+import warnings
+
+# Import PyTorch for the fused modules and TorchScript
+import torch
+# Import functional ops used by the fused layers
+import torch.nn.functional as F
+
+
+# Suffix of the artifact stored next to each checkpoint
+ARTIFACT_SUFFIX = '.frozen.pt'
+# Bumped whenever the fused architecture changes (old artifacts are rebuilt)
+ARTIFACT_VERSION = 1
+# Largest absolute difference (in 0-255 pixel units) accepted by the equivalence check
+DEFAULT_TOLERANCE = 1e-2
+
+
+# Convolution with the reflection padding folded in (and optional nearest upsample)
+class FusedConv(torch.nn.Module):
+    # layer: ConvLayer or UpsampleConvLayer from transformer_net.py
+    def __init__(self, layer):
+        super(FusedConv, self).__init__()
+        conv = layer.conv2d
+        # Conv2d pads internally, so no separate ReflectionPad2d output is kept around
+        self.conv2d = torch.nn.Conv2d(
+            conv.in_channels, conv.out_channels, conv.kernel_size, conv.stride,
+            padding=conv.kernel_size[0] // 2, padding_mode='reflect',
+        )
+        self.conv2d.weight = torch.nn.Parameter(conv.weight.detach().clone())
+        self.conv2d.bias = torch.nn.Parameter(conv.bias.detach().clone())
+        self.upsample = float(getattr(layer, 'upsample', None) or 0)
+
+    def forward(self, x):
+        if self.upsample > 0:
+            x = F.interpolate(x, scale_factor=self.upsample, mode='nearest')
+        return self.conv2d(x)
+
+
+# Instance normalisation followed by an optional in-place ReLU
+class FusedNormReLU(torch.nn.Module):
+    # norm: Affine InstanceNorm2d from transformer_net.py
+    # relu: Apply ReLU in place on the normalised output
+    def __init__(self, norm, relu=True):
+        super(FusedNormReLU, self).__init__()
+        self.weight = torch.nn.Parameter(norm.weight.detach().clone())
+        self.bias = torch.nn.Parameter(norm.bias.detach().clone())
+        self.eps = float(norm.eps)
+        self.relu = relu
+
+    def forward(self, x):
+        y = F.instance_norm(x, weight=self.weight, bias=self.bias, eps=self.eps)
+        if self.relu:
+            y = F.relu_(y)
+        return y
+
+
+# Residual block built from the fused layers
+class FusedResidualBlock(torch.nn.Module):
+    def __init__(self, block):
+        super(FusedResidualBlock, self).__init__()
+        self.conv1 = FusedConv(block.conv1)
+        self.in1 = FusedNormReLU(block.in1)
+        self.conv2 = FusedConv(block.conv2)
+        self.in2 = FusedNormReLU(block.in2, relu=False)
+        # Kept for the tiled engine, which replays the layers one by one
+        self.relu = torch.nn.ReLU()
+
+    def forward(self, x):
+        out = self.in2(self.conv2(self.in1(self.conv1(x))))
+        return out + x
+
+
+class FusedTransformerNet(torch.nn.Module):
+    """
+    Numerically equivalent TransformerNet made of fused layers.
+    Submodule names match TransformerNet, so code that walks the layers
+    (e.g. the tiled engine's global normalisation) works on both.
+    """
+
+    def __init__(self, model):
+        super(FusedTransformerNet, self).__init__()
+        self.conv1 = FusedConv(model.conv1)
+        self.in1 = FusedNormReLU(model.in1)
+        self.conv2 = FusedConv(model.conv2)
+        self.in2 = FusedNormReLU(model.in2)
+        self.conv3 = FusedConv(model.conv3)
+        self.in3 = FusedNormReLU(model.in3)
+        self.res1 = FusedResidualBlock(model.res1)
+        self.res2 = FusedResidualBlock(model.res2)
+        self.res3 = FusedResidualBlock(model.res3)
+        self.res4 = FusedResidualBlock(model.res4)
+        self.res5 = FusedResidualBlock(model.res5)
+        self.deconv1 = FusedConv(model.deconv1)
+        self.in4 = FusedNormReLU(model.in4)
+        self.deconv2 = FusedConv(model.deconv2)
+        self.in5 = FusedNormReLU(model.in5)
+        self.deconv3 = FusedConv(model.deconv3)
+        self.relu = torch.nn.ReLU()
+
+    def forward(self, X):
+        y = self.in1(self.conv1(X))
+        y = self.in2(self.conv2(y))
+        y = self.in3(self.conv3(y))
+        y = self.res1(y)
+        y = self.res2(y)
+        y = self.res3(y)
+        y = self.res4(y)
+        y = self.res5(y)
+        y = self.in4(self.deconv1(y))
+        y = self.in5(self.deconv2(y))
+        return self.deconv3(y)
+
+
+class FrozenStyleModel(torch.nn.Module):
+    """
+    Loaded inference artifact.
+    forward() runs the frozen TorchScript graph; the scripted module with
+    named layers and parameters stays reachable for code that needs the
+    individual layers (tiled global normalisation, size accounting).
+    """
+
+    def __init__(self, scripted, frozen):
+        super(FrozenStyleModel, self).__init__()
+        self.module = scripted
+        # Kept out of the submodule registry: its constants alias module's weights
+        self.__dict__['frozen'] = frozen
+
+    def forward(self, X):
+        return self.frozen(X)
+
+    # Layer lookups (conv1, in1, res1, ...) fall through to the scripted module
+    def __getattr__(self, name):
+        try:
+            return super(FrozenStyleModel, self).__getattr__(name)
+        except AttributeError:
+            return getattr(super(FrozenStyleModel, self).__getattr__('module'), name)
+
+
+# Function returning the artifact path for a checkpoint
+# model_path: Path to the .pth/.model checkpoint
+def artifact_path(model_path):
+    return os.path.splitext(model_path)[0] + ARTIFACT_SUFFIX
+
+
+# Function yielding a temporary path that replaces path once the block succeeds
+# The name is unique per process and thread: forked workers may build the
+# same artifact at the same time, and must never rename a half-written file
+@contextlib.contextmanager
+def atomic_path(path):
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+# Function returning the identity of a checkpoint file (stored in artifacts)
+def source_fingerprint(model_path):
+    st = os.stat(model_path)
+    return {'name': os.path.basename(model_path), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+# Function compiling a fused network with TorchScript and freezing it
+# Returns: (scripted module, frozen module)
+def _compile(fused):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', FutureWarning)
+        scripted = torch.jit.script(fused.eval())
+        frozen = torch.jit.freeze(scripted)
+    return scripted, frozen
+
+
+# Function building the inference model from a loaded eager TransformerNet
+# model: Eager TransformerNet (weights loaded, any device)
+# Returns: FrozenStyleModel on the same device as model
+def build_inference_model(model):
+    """Fuse, script and freeze an eager TransformerNet."""
+    fused = FusedTransformerNet(model).to(next(model.parameters()).device)
+    scripted, frozen = _compile(fused)
+    return FrozenStyleModel(scripted, frozen)
+
+
+# Function checking that the inference model reproduces the eager model
+# sizes: Input sizes (height, width) to compare on, including odd sizes
+# Returns: Largest absolute difference seen (0-255 pixel units)
+def max_difference(eager, built, sizes=((256, 256), (257, 383)), seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    device = next(eager.parameters()).device
+    worst = 0.0
+    with torch.no_grad():
+        for h, w in sizes:
+            x = (torch.rand(1, 3, h, w, generator=generator) * 255).to(device)
+            worst = max(worst, (eager(x) - built(x)).abs().max().item())
+    return worst
+
+
+# Function building, verifying and saving the artifact for a checkpoint
+# model: Eager TransformerNet loaded from model_path
+# model_path: Checkpoint the model was loaded from
+# tolerance: Maximum allowed difference against the eager model
+# Returns: (artifact path, max difference)
+def save_inference_artifact(model, model_path, tolerance=DEFAULT_TOLERANCE):
+    """Build the artifact, refuse it if it does not match the eager model, save it."""
+    built = build_inference_model(model)
+    difference = max_difference(model, built)
+    if difference > tolerance:
+        raise ValueError(f"Inference build differs from the eager model by {difference:.4g} (> {tolerance})")
+
+    path = artifact_path(model_path)
+    meta = {'version': ARTIFACT_VERSION, 'source': source_fingerprint(model_path),
+            'max_difference': difference, 'torch': torch.__version__}
+    with atomic_path(path) as tmp_path, warnings.catch_warnings():
+        warnings.simplefilter('ignore', FutureWarning)
+        # The scripted module is saved; freezing is repeated at load (milliseconds)
+        torch.jit.save(built.module, tmp_path, _extra_files={'meta.json': json.dumps(meta)})
+    return path, difference
+
+
+# Function loading the artifact for a checkpoint if it is present and current
+# model_path: Path to the .pth/.model checkpoint
+# device: Device to map the artifact to
+# Returns: FrozenStyleModel, or None if there is no usable artifact
+def load_inference_model(model_path, device='cpu'):
+    """Load model_path's inference artifact, or None if missing or stale."""
+    path = artifact_path(model_path)
+    if not os.path.exists(path):
+        return None
+    extra = {'meta.json': ''}
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', FutureWarning)
+            scripted = torch.jit.load(path, map_location=device, _extra_files=extra)
+        meta = json.loads(extra['meta.json'] or '{}')
+        if meta.get('version') != ARTIFACT_VERSION or meta.get('source') != source_fingerprint(model_path):
+            print(f"Ignoring stale inference artifact: {os.path.basename(path)}")
+            return None
+        scripted.eval()
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', FutureWarning)
+            frozen = torch.jit.freeze(scripted)
+        return FrozenStyleModel(scripted, frozen)
+    except Exception as e:
+        print(f"Could not load inference artifact {os.path.basename(path)}: {e}")
+        return None
+
+
+# Function loading an eager TransformerNet checkpoint (same cleanup as the server)
+def load_eager_model(model_path, device='cpu'):
+    from transformer_net import TransformerNet
+    state_dict = torch.load(model_path, map_location=device)
+    if isinstance(state_dict, dict):
+        state_dict = state_dict.get('state_dict', state_dict.get('model', state_dict))
+    state_dict = {k[len('module.'):] if k.startswith('module.') else k: v
+                  for k, v in state_dict.items()
+                  if 'running_mean' not in k and 'running_var' not in k}
+    model = TransformerNet()
+    model.load_state_dict(state_dict, strict=False)
+    return model.to(device).eval()
+
+
+# Function timing forward passes
+# Returns: Average milliseconds per forward
+def _benchmark(model, size, runs):
+    x = torch.rand(1, 3, size, size) * 255
+    with torch.no_grad():
+        model(x)
+        start = time.perf_counter()
+        for _ in range(runs):
+            model(x)
+    return (time.perf_counter() - start) / runs * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build frozen inference artifacts for style models")
+    parser.add_argument("models", nargs='+', help="checkpoints (.pth/.model) to build")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="maximum allowed difference against the eager model")
+    parser.add_argument("--check", action='store_true',
+                        help="only verify existing artifacts, do not build")
+    parser.add_argument("--benchmark", action='store_true',
+                        help="compare load time and forward latency with the eager model")
+    parser.add_argument("--size", type=int, default=512, help="benchmark image side")
+    parser.add_argument("--runs", type=int, default=5, help="benchmark forward passes")
+    args = parser.parse_args()
+
+    for model_path in args.models:
+        name = os.path.basename(model_path)
+        start = time.perf_counter()
+        eager = load_eager_model(model_path)
+        eager_load = time.perf_counter() - start
+
+        if not args.check:
+            path, difference = save_inference_artifact(eager, model_path, args.tolerance)
+            print(f"{name}: wrote {os.path.basename(path)} (max difference {difference:.2e})")
+
+        start = time.perf_counter()
+        built = load_inference_model(model_path)
+        built_load = time.perf_counter() - start
+        if built is None:
+            print(f"{name}: no usable artifact")
+            continue
+        difference = max_difference(eager, built)
+        status = 'ok' if difference <= args.tolerance else 'MISMATCH'
+        print(f"{name}: artifact {status} (max difference {difference:.2e})")
+
+        if args.benchmark:
+            eager_ms = _benchmark(eager, args.size, args.runs)
+            built_ms = _benchmark(built, args.size, args.runs)
+            print(f"  load:    eager {eager_load * 1000:.0f} ms, artifact {built_load * 1000:.0f} ms")
+            print(f"  forward: eager {eager_ms:.1f} ms, artifact {built_ms:.1f} ms "
+                  f"({eager_ms / built_ms:.2f}x) at {args.size}x{args.size}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+bfloat16 CPU execution for TransformerNet style models.
+
+The model is converted to channels_last and forward passes run under CPU
+autocast in bfloat16, which uses AVX512-BF16/AMX kernels where the CPU
+has them. The output is converted back to fp32 before the caller clamps
+and encodes it. enable_bf16() validates each model against its own fp32
+output and leaves it in fp32 when the CPU has no bf16 support or the
+difference is too large.
+"""
+# Import math for PSNR
+import math
+# Import os to read the execution mode from the environment
+import os
+
+# Import PyTorch for autocast and memory formats
+import torch
+
+
+# Whether the style.py entry points run in bfloat16 (the server has its own STYLE_BF16 setting)
+BF16_ENABLED = os.environ.get('STYLE_BF16', '0').strip().lower() in ('1', 'true', 'yes', 'on')
+# Minimum PSNR (dB, 0-255 range) of the bf16 output against fp32
+DEFAULT_MIN_PSNR = 40.0
+# Side of the validation image
+VALIDATION_SIZE = 256
+
+
+# Function reporting whether the CPU has native bfloat16 kernels
+def bf16_supported():
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except Exception:
+        return False
+
+
+# Function running a style model, in bfloat16 when it was enabled for it
+# model: Style model (a bf16 model carries bf16=True)
+# x: Input batch [N, 3, H, W] in 0-255
+# Returns: fp32 output batch
+def forward(model, x):
+    """Run model on x, under bfloat16 autocast if enable_bf16() accepted the model."""
+    if not getattr(model, 'bf16', False):
+        return model(x)
+    # Autocast is thread-local, so it is entered by whichever thread runs the model
+    with torch.autocast('cpu', dtype=torch.bfloat16):
+        output = model(x.contiguous(memory_format=torch.channels_last))
+    return output.float()
+
+
+# Function computing PSNR between two outputs in 0-255
+def psnr(a, b):
+    mse = torch.mean((a.clamp(0, 255) - b.clamp(0, 255)) ** 2).item()
+    return float('inf') if mse == 0 else 10 * math.log10(255.0 ** 2 / mse)
+
+
+# Function switching an eager CPU style model to channels_last + bfloat16
+# model: Eager TransformerNet on the CPU (converted in place)
+# min_psnr: Smallest acceptable PSNR of bf16 against fp32
+# Returns: PSNR against fp32, or None if the model was left in fp32
+def enable_bf16(model, min_psnr=DEFAULT_MIN_PSNR):
+    """Convert model to channels_last/bf16 if the CPU supports it and the output matches fp32."""
+    if not bf16_supported():
+        return None
+    # Deterministic image with edges and flat areas
+    generator = torch.Generator().manual_seed(0)
+    x = torch.rand(1, 3, VALIDATION_SIZE, VALIDATION_SIZE, generator=generator) * 255
+    x = torch.nn.functional.avg_pool2d(x, 5, stride=1, padding=2)
+    with torch.no_grad():
+        reference = model(x)
+        model.to(memory_format=torch.channels_last)
+        model.bf16 = True
+        score = psnr(forward(model, x), reference)
+    if score < min_psnr:
+        model.bf16 = False
+        model.to(memory_format=torch.contiguous_format)
+        return None
+    return score
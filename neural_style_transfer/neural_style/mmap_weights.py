@@ -0,0 +1,170 @@
+"""
+Memory-mapped weight files for TransformerNet style models.
+
+torch.load() unpickles a checkpoint into private memory and
+load_state_dict() then copies every tensor into a fresh model. This
+module converts each checkpoint once into a flat file next to it
+(mosaic.pth -> mosaic.safetensors, in the safetensors layout: an 8-byte
+header length, a JSON header with dtype/shape/offsets, then the raw
+tensor bytes) holding the already cleaned weights. Loading maps the file
+and builds the model on the meta device, then assigns tensor views of
+the mapping as its parameters, so nothing is read or copied until a page
+is touched and every process serving the style shares the same page
+cache pages. The checkpoint fingerprint is stored in the header metadata,
+so a replaced .pth is converted again.
+
+Usage:
+    python mmap_weights.py saved_models/*.pth [--benchmark]
+"""
+# Import argparse for the command-line interface
+import argparse
+# Import json for the file header
+import json
+# Import mmap to map the weights file
+import mmap
+# Import os for file system operations
+import os
+# Import struct for the header length
+import struct
+# Import time for load time measurements
+import time
+
+# Import PyTorch for tensors and the meta device
+import torch
+
+# Import the checkpoint helpers shared with the other inference builds
+from inference_build import atomic_path, load_eager_model, source_fingerprint
+from transformer_net import TransformerNet
+
+
+# Suffix of the converted weights stored next to each checkpoint
+WEIGHTS_SUFFIX = '.safetensors'
+# Metadata key holding the checkpoint fingerprint
+SOURCE_KEY = 'source'
+# Tensor data starts at a multiple of this many bytes
+ALIGNMENT = 64
+
+# torch dtype <-> safetensors dtype name
+_DTYPES = {
+    torch.float32: 'F32',
+    torch.float16: 'F16',
+    torch.bfloat16: 'BF16',
+    torch.float64: 'F64',
+    torch.int64: 'I64',
+    torch.int32: 'I32',
+    torch.uint8: 'U8',
+}
+_TORCH_DTYPES = {name: dtype for dtype, name in _DTYPES.items()}
+
+
+# Function returning the weights path for a checkpoint
+def weights_path(model_path):
+    return os.path.splitext(model_path)[0] + WEIGHTS_SUFFIX
+
+
+# Function writing a state dict as a flat, mappable file
+# metadata: Dict of strings stored in the header
+def save_weights(state_dict, path, metadata=None):
+    """Write state_dict in the safetensors layout (atomically)."""
+    tensors = {name: t.detach().cpu().contiguous() for name, t in state_dict.items()}
+    header = {'__metadata__': dict(metadata or {})}
+    offset = 0
+    for name, t in tensors.items():
+        # Keep every tensor aligned for vectorized kernels reading the mapping
+        offset = -(-offset // ALIGNMENT) * ALIGNMENT
+        nbytes = t.numel() * t.element_size()
+        header[name] = {'dtype': _DTYPES[t.dtype], 'shape': list(t.shape), 'data_offsets': [offset, offset + nbytes]}
+        offset += nbytes
+    encoded = json.dumps(header, separators=(',', ':')).encode()
+    # Pad the header with spaces so the data section starts aligned
+    encoded += b' ' * (-(8 + len(encoded)) % ALIGNMENT)
+
+    with atomic_path(path) as tmp_path, open(tmp_path, 'wb') as f:
+        f.write(struct.pack('<Q', len(encoded)))
+        f.write(encoded)
+        start = f.tell()
+        for name, t in tensors.items():
+            begin = header[name]['data_offsets'][0]
+            f.write(b'\0' * (start + begin - f.tell()))
+            f.write(t.view(torch.uint8).numpy().tobytes() if t.numel() else b'')
+    return path
+
+
+# Function mapping a weights file
+# Returns: (dict of tensors viewing the mapping, header metadata)
+def map_weights(path):
+    """Map path and return its tensors without reading or copying the data."""
+    with open(path, 'rb') as f:
+        (length,) = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(length))
+        # Private (copy-on-write) mapping: pages are shared with the page cache
+        # and with other processes until someone writes to a tensor
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    metadata = header.pop('__metadata__', {})
+    start = 8 + length
+    tensors = {}
+    for name, info in header.items():
+        dtype = _TORCH_DTYPES[info['dtype']]
+        begin, end = info['data_offsets']
+        count = (end - begin) // torch.empty((), dtype=dtype).element_size()
+        # Each tensor keeps a reference to the mapping, which stays open as long as they live
+        t = torch.frombuffer(mapping, dtype=dtype, count=count, offset=start + begin) if count else torch.empty(0, dtype=dtype)
+        tensors[name] = t.view(info['shape'])
+    return tensors, metadata
+
+
+# Function converting a checkpoint into its mappable weights file
+# Returns: Path of the weights file
+def convert_checkpoint(model_path, model=None):
+    """Write model_path's cleaned weights next to it, tagged with its fingerprint."""
+    model = model if model is not None else load_eager_model(model_path)
+    metadata = {SOURCE_KEY: json.dumps(source_fingerprint(model_path))}
+    return save_weights(model.state_dict(), weights_path(model_path), metadata)
+
+
+# Function building a TransformerNet directly on mapped weights
+# model_path: Path to the .pth/.model checkpoint
+# device: Target device (other devices than the CPU get a copy)
+# Returns: TransformerNet, or None if there is no current weights file
+def load_mmap_model(model_path, device='cpu'):
+    """Map model_path's converted weights and build the model without copying them."""
+    path = weights_path(model_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        state_dict, metadata = map_weights(path)
+        source = metadata.get(SOURCE_KEY)
+        if source is None or json.loads(source) != source_fingerprint(model_path):
+            print(f"Ignoring stale weights file: {os.path.basename(path)}")
+            return None
+        # Parameters are created without storage and replaced by the mapped tensors
+        with torch.device('meta'):
+            model = TransformerNet()
+        model.load_state_dict(state_dict, assign=True)
+        return model.to(device).eval()
+    except Exception as e:
+        print(f"Could not map weights file {os.path.basename(path)}: {e}")
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert style checkpoints to memory-mapped weight files")
+    parser.add_argument("models", nargs='+', help="checkpoints (.pth/.model) to convert")
+    parser.add_argument("--benchmark", action='store_true', help="compare cold load times")
+    args = parser.parse_args()
+
+    for model_path in args.models:
+        path = convert_checkpoint(model_path)
+        print(f"{os.path.basename(model_path)} -> {os.path.basename(path)}")
+        if args.benchmark:
+            start = time.perf_counter()
+            load_eager_model(model_path)
+            eager = time.perf_counter() - start
+            start = time.perf_counter()
+            load_mmap_model(model_path)
+            mapped = time.perf_counter() - start
+            print(f"  torch.load: {eager * 1000:.1f} ms, mapped: {mapped * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+"""
+Memory-budgeted model cache shared by the style transfer entry points.
+Models are kept in LRU order under a byte budget, hot models can be
+pinned so they are never evicted, and concurrent first requests for the
+same key wait for a single load instead of each loading their own copy.
+"""
+# Import os to read the cache budget from the environment
+import os
+# Import threading for the cache lock and per-key load locks
+import threading
+# Import time to measure load durations
+import time
+# Import OrderedDict to keep entries in least-recently-used order
+from collections import OrderedDict
+
+
+# Function to estimate the resident size of a loaded model in bytes
+# model: torch.nn.Module (parameters + buffers are counted) or any object
+#        exposing an integer `nbytes` attribute, which takes precedence (for
+#        modules whose weights are not parameters, e.g. packed INT8 weights)
+def model_nbytes(model):
+    """Return the number of bytes held by a model's tensors."""
+    if isinstance(getattr(model, 'nbytes', None), int):
+        return model.nbytes
+    if hasattr(model, 'parameters') and hasattr(model, 'buffers'):
+        total = 0
+        seen = set()
+        for tensor in list(model.parameters()) + list(model.buffers()):
+            # Shared/tied tensors are only counted once
+            if id(tensor) in seen:
+                continue
+            seen.add(id(tensor))
+            total += tensor.numel() * tensor.element_size()
+        return total
+    return int(getattr(model, 'nbytes', 0) or 0)
+
+
+# A single cached model with its bookkeeping
+class _Entry:
+    __slots__ = ('value', 'nbytes', 'load_seconds', 'hits', 'loaded_at', 'last_used')
+
+    def __init__(self, value, nbytes, load_seconds):
+        self.value = value
+        self.nbytes = nbytes
+        self.load_seconds = load_seconds
+        self.hits = 0
+        self.loaded_at = time.time()
+        self.last_used = self.loaded_at
+
+
+class ModelCache:
+    """
+    Thread-safe LRU cache of loaded models bounded by a byte budget.
+
+    get_or_load(key, loader) returns the cached model or calls loader()
+    exactly once per key, even when many threads ask at the same time.
+    """
+
+    # max_bytes: Byte budget for resident models (None or 0 = unbounded)
+    # sizeof: Callable estimating a model's size in bytes
+    def __init__(self, max_bytes=None, sizeof=model_nbytes, name='models'):
+        self.max_bytes = max_bytes or None
+        self.sizeof = sizeof
+        self.name = name
+
+        # key -> _Entry, least recently used first
+        self._entries = OrderedDict()
+        # Keys that must never be evicted
+        self._pinned = set()
+        # key -> lock held while that key is being loaded
+        self._load_locks = {}
+        # Guards all of the above
+        self._lock = threading.Lock()
+
+        # Counters
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._load_failures = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    # Function to return a cached model or load it once
+    # key: Cache key (e.g. model path)
+    # loader: Zero-argument callable building the model on a miss
+    # pin: Pin the key so the model is never evicted
+    # Returns: The cached or freshly loaded model
+    def get_or_load(self, key, loader, pin=False):
+        """Return the model for key, loading it (single-flight) on a miss."""
+        with self._lock:
+            if pin:
+                self._pinned.add(key)
+            entry = self._touch(key)
+            if entry is not None:
+                return entry.value
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        # Only one thread per key runs the loader; the others wait here
+        with load_lock:
+            with self._lock:
+                entry = self._touch(key)
+                if entry is not None:
+                    return entry.value
+                self._misses += 1
+
+            start = time.perf_counter()
+            try:
+                value = loader()
+            except Exception:
+                with self._lock:
+                    self._load_failures += 1
+                    self._load_locks.pop(key, None)
+                raise
+            elapsed = time.perf_counter() - start
+            nbytes = self.sizeof(value)
+
+            with self._lock:
+                self._entries[key] = _Entry(value, nbytes, elapsed)
+                self._load_locks.pop(key, None)
+                self._evict_over_budget(keep=key)
+            return value
+
+    # Function to return a cached model without loading it
+    def get(self, key, default=None):
+        """Return the cached model for key, or default if it is not resident."""
+        with self._lock:
+            entry = self._touch(key)
+            return default if entry is None else entry.value
+
+    # Function to insert an already loaded model
+    def put(self, key, value, load_seconds=0.0):
+        """Insert (or replace) a model and apply the byte budget."""
+        nbytes = self.sizeof(value)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = _Entry(value, nbytes, load_seconds)
+            self._evict_over_budget(keep=key)
+
+    # Function to pin a key so its model is never evicted
+    def pin(self, key):
+        with self._lock:
+            self._pinned.add(key)
+
+    # Function to allow a pinned key to be evicted again
+    def unpin(self, key):
+        with self._lock:
+            self._pinned.discard(key)
+            self._evict_over_budget()
+
+    # Function to drop a model from the cache
+    # Returns: True if the key was resident
+    def evict(self, key):
+        with self._lock:
+            if self._entries.pop(key, None) is None:
+                return False
+            self._evictions += 1
+            return True
+
+    # Function to drop every model (pins are kept)
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    # Function returning all resident (key, model) pairs, most recent last
+    def items(self):
+        with self._lock:
+            return [(key, entry.value) for key, entry in self._entries.items()]
+
+    @property
+    def resident_bytes(self):
+        with self._lock:
+            return sum(entry.nbytes for entry in self._entries.values())
+
+    # Function returning counters and per-model details for /health and /models
+    # label: Optional callable turning a key into a display name
+    def stats(self, label=str):
+        """Return cache counters and per-model size/load-time information."""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'resident_bytes': sum(e.nbytes for e in self._entries.values()),
+                'max_bytes': self.max_bytes,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': (self._hits / lookups) if lookups else 0.0,
+                'evictions': self._evictions,
+                'load_failures': self._load_failures,
+                'pinned': sorted(label(k) for k in self._pinned),
+                'models': {
+                    label(key): {
+                        'bytes': entry.nbytes,
+                        'load_seconds': round(entry.load_seconds, 4),
+                        'hits': entry.hits,
+                        'pinned': key in self._pinned,
+                        'idle_seconds': round(time.time() - entry.last_used, 1),
+                    }
+                    for key, entry in self._entries.items()
+                },
+            }
+
+    # ---------- internals (called with self._lock held) ----------
+    def _touch(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            entry.hits += 1
+            entry.last_used = time.time()
+            self._hits += 1
+        return entry
+
+    def _evict_over_budget(self, keep=None):
+        if not self.max_bytes:
+            return
+        resident = sum(entry.nbytes for entry in self._entries.values())
+        for key in list(self._entries.keys()):
+            if resident <= self.max_bytes:
+                break
+            if key == keep or key in self._pinned:
+                continue
+            resident -= self._entries.pop(key).nbytes
+            self._evictions += 1
+            print(f"Evicted model from {self.name} cache: {key}")
+
+
+# Shared cache for style transfer models (budget from STYLE_CACHE_MAX_MB)
+style_model_cache = ModelCache(
+    max_bytes=int(float(os.environ.get('STYLE_CACHE_MAX_MB', '256')) * 1024 * 1024),
+    name='style',
+)
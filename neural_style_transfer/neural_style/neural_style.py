@@ -275,11 +275,11 @@ def stylize_onnx(content_image, args):
     # Ensure we're not trying to export while using ONNX inference
     assert not args.export_onnx
 
-    # Import onnxruntime for ONNX model inference
-    import onnxruntime
+    # Import the shared session factory (graph optimisations, thread settings)
+    from ort_backend import create_session
 
     # Create ONNX runtime inference session from model file
-    ort_session = onnxruntime.InferenceSession(args.model)
+    ort_session = create_session(args.model)
 
     # Helper function to convert PyTorch tensor to numpy array
     def to_numpy(tensor):
@@ -0,0 +1,181 @@
+"""
+ONNX Runtime execution backend for TransformerNet style models.
+
+Each checkpoint is exported once to ONNX next to it (mosaic.pth ->
+mosaic.onnx, with dynamic batch/height/width) and the checkpoint
+fingerprint is stored in the model metadata, so the export is redone
+when the .pth is replaced. Sessions are expensive to create, so callers
+keep the returned OrtStyleModel (the server holds it in the shared model
+cache). Inputs and outputs are bound straight to torch CPU tensors with
+IO binding, so no array is copied on the way in or out.
+
+Usage:
+    python ort_backend.py saved_models/*.pth [--benchmark]
+"""
+# Import argparse for the command-line interface
+import argparse
+# Import json to store the checkpoint fingerprint in the ONNX metadata
+import json
+# Import os for file system operations
+import os
+# Import time for latency measurements
+import time
+# Import warnings to silence exporter notices
+import warnings
+
+# Import numpy for the IO binding element type
+import numpy as np
+# Import ONNX Runtime for inference
+import onnxruntime as ort
+# Import PyTorch for export and the tensors bound to the session
+import torch
+
+# Import the checkpoint helpers shared with the other inference builds
+from inference_build import atomic_path, load_eager_model, source_fingerprint
+
+
+# Suffix of the exported model stored next to each checkpoint
+ONNX_SUFFIX = '.onnx'
+# Operator set used for export
+OPSET_VERSION = 17
+# Metadata key holding the checkpoint fingerprint
+SOURCE_KEY = 'source'
+
+
+# Function returning the ONNX path for a checkpoint
+def onnx_path(model_path):
+    return os.path.splitext(model_path)[0] + ONNX_SUFFIX
+
+
+# Function exporting an eager TransformerNet to ONNX next to its checkpoint
+# model: Eager TransformerNet loaded from model_path
+# Returns: Path of the .onnx file
+def export_onnx(model, model_path, opset=OPSET_VERSION):
+    """Export model with dynamic batch and image size, tagged with its checkpoint."""
+    # The onnx package is only needed to export, not to serve
+    import onnx
+
+    path = onnx_path(model_path)
+    dummy = torch.rand(1, 3, 64, 64) * 255
+    axes = {0: 'batch', 2: 'height', 3: 'width'}
+    with atomic_path(path) as tmp_path:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            torch.onnx.export(model.cpu().eval(), (dummy,), tmp_path, opset_version=opset, dynamo=False,
+                              input_names=['input'], output_names=['output'],
+                              dynamic_axes={'input': axes, 'output': axes})
+        proto = onnx.load(tmp_path)
+        entry = proto.metadata_props.add()
+        entry.key = SOURCE_KEY
+        entry.value = json.dumps(source_fingerprint(model_path), sort_keys=True)
+        onnx.save(proto, tmp_path)
+    return path
+
+
+# Function creating an inference session with explicit thread settings
+# intra_op_threads: Threads used inside one operator (0 = ONNX Runtime default)
+# inter_op_threads: Threads running independent operators in parallel
+def create_session(path, intra_op_threads=0, inter_op_threads=1):
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = intra_op_threads
+    options.inter_op_num_threads = inter_op_threads
+    # The network is a single chain of convolutions: nothing runs in parallel
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+
+
+class OrtStyleModel:
+    """
+    Cached ONNX Runtime session called like the torch model: takes and
+    returns [N, 3, H, W] CPU float tensors in the 0-255 range.
+    """
+
+    def __init__(self, session, nbytes=0):
+        self.session = session
+        self.input_name = session.get_inputs()[0].name
+        self.output_name = session.get_outputs()[0].name
+        # Size of the ONNX file, used by the model cache budget
+        self.nbytes = nbytes
+
+    # TransformerNet downsamples twice and upsamples twice, so each side is
+    # rounded up to a multiple of 4
+    @staticmethod
+    def output_shape(shape):
+        n, _, h, w = shape
+        return n, 3, -(-h // 4) * 4, -(-w // 4) * 4
+
+    def __call__(self, x):
+        x = x.detach().to('cpu', torch.float32).contiguous()
+        out = torch.empty(self.output_shape(x.shape), dtype=torch.float32)
+        # Bind both tensors' memory directly: no copies in or out of the session
+        binding = self.session.io_binding()
+        binding.bind_input(self.input_name, 'cpu', 0, np.float32, tuple(x.shape), x.data_ptr())
+        binding.bind_output(self.output_name, 'cpu', 0, np.float32, tuple(out.shape), out.data_ptr())
+        self.session.run_with_iobinding(binding)
+        return out
+
+
+# Function loading the ONNX Runtime model for a checkpoint
+# model_path: Path to the .pth/.model checkpoint
+# autoexport: Export the .onnx from the checkpoint when it is missing or stale
+# Returns: OrtStyleModel, or None if there is no usable .onnx
+def load_ort_model(model_path, intra_op_threads=0, inter_op_threads=1, autoexport=True):
+    """Create a session for model_path's ONNX export, exporting it first if needed."""
+    path = onnx_path(model_path)
+    try:
+        session = None
+        if os.path.exists(path):
+            session = create_session(path, intra_op_threads, inter_op_threads)
+            source = session.get_modelmeta().custom_metadata_map.get(SOURCE_KEY)
+            # Files exported by hand carry no fingerprint and are trusted as-is
+            if source is not None and json.loads(source) != source_fingerprint(model_path):
+                print(f"Ignoring stale ONNX export: {os.path.basename(path)}")
+                session = None
+        if session is None:
+            if not autoexport:
+                return None
+            print(f"Exporting {os.path.basename(model_path)} to ONNX")
+            export_onnx(load_eager_model(model_path), model_path)
+            session = create_session(path, intra_op_threads, inter_op_threads)
+        return OrtStyleModel(session, os.path.getsize(path))
+    except Exception as e:
+        print(f"Could not load ONNX model for {os.path.basename(model_path)}: {e}")
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export style models to ONNX and compare with torch")
+    parser.add_argument("models", nargs='+', help="checkpoints (.pth/.model) to export")
+    parser.add_argument("--threads", type=int, default=0, help="intra-op threads (0 = default)")
+    parser.add_argument("--benchmark", action='store_true', help="compare latency with eager torch")
+    parser.add_argument("--size", type=int, default=512, help="benchmark image side")
+    parser.add_argument("--runs", type=int, default=5, help="benchmark forward passes")
+    args = parser.parse_args()
+
+    for model_path in args.models:
+        name = os.path.basename(model_path)
+        eager = load_eager_model(model_path)
+        path = export_onnx(eager, model_path)
+        model = load_ort_model(model_path, args.threads, autoexport=False)
+        x = torch.rand(1, 3, 257, 383) * 255
+        with torch.no_grad():
+            difference = (eager(x) - model(x)).abs().max().item()
+        print(f"{name}: wrote {os.path.basename(path)} (max difference {difference:.2e})")
+
+        if args.benchmark:
+            x = torch.rand(1, 3, args.size, args.size) * 255
+            timings = {}
+            for label, fn in (('torch', eager), ('onnxruntime', model)):
+                with torch.no_grad():
+                    fn(x)
+                    start = time.perf_counter()
+                    for _ in range(args.runs):
+                        fn(x)
+                timings[label] = (time.perf_counter() - start) / args.runs * 1000
+            print(f"  forward: torch {timings['torch']:.1f} ms, onnxruntime {timings['onnxruntime']:.1f} ms "
+                  f"({timings['torch'] / timings['onnxruntime']:.2f}x) at {args.size}x{args.size}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,341 @@
+"""
+INT8 static quantization for TransformerNet style models (CPU).
+
+Each style is calibrated on sample content images, converted to INT8
+(quantized convolutions, instance norm, residual adds) and compared with
+the fp32 model on held-out images: PSNR and SSIM measure the perceptual
+difference, and forward latency gives the speedup. Styles whose SSIM
+reaches --min-ssim get an artifact next to the checkpoint
+(mosaic.pth -> mosaic.int8.pt) that the server can load for int8
+requests; styles below the threshold are reported and left in fp32.
+
+Usage:
+    python quantize.py saved_models/*.pth --calibration images/content-images
+"""
+# Import argparse for the command-line interface
+import argparse
+# Import copy so quantization never modifies the fp32 model
+import copy
+# Import json for artifact metadata and the report
+import json
+# Import math for PSNR
+import math
+# Import os for file system operations
+import os
+# Import time for latency measurements
+import time
+# Import warnings to silence TorchScript deprecation notices
+import warnings
+
+# Import numpy to convert sample images to tensors
+import numpy as np
+# Import PyTorch and its eager-mode quantization toolkit
+import torch
+import torch.ao.quantization as tq
+import torch.nn.functional as F
+# Import PIL to read calibration images
+from PIL import Image
+
+# Import the checkpoint helpers shared with the fp32 inference build
+from inference_build import atomic_path, load_eager_model, source_fingerprint
+
+
+# Suffix of the INT8 artifact stored next to each checkpoint
+ARTIFACT_SUFFIX = '.int8.pt'
+# Bumped whenever the quantized architecture changes
+ARTIFACT_VERSION = 1
+# Minimum SSIM against fp32 for a style to be saved as INT8
+DEFAULT_MIN_SSIM = 0.95
+
+
+# Function returning the quantized engine for this CPU (x86 or ARM)
+def default_engine():
+    engines = torch.backends.quantized.supported_engines
+    for engine in ('x86', 'fbgemm', 'qnnpack'):
+        if engine in engines:
+            return engine
+    raise RuntimeError('No quantized CPU engine available in this PyTorch build')
+
+
+# Convolution layer with explicit reflection padding (quantized tensors support both)
+class QuantizableConv(torch.nn.Module):
+    # layer: ConvLayer or UpsampleConvLayer from transformer_net.py
+    def __init__(self, layer):
+        super(QuantizableConv, self).__init__()
+        self.reflection_pad = torch.nn.ReflectionPad2d(layer.conv2d.kernel_size[0] // 2)
+        self.conv2d = copy.deepcopy(layer.conv2d)
+        self.upsample = float(getattr(layer, 'upsample', None) or 0)
+
+    def forward(self, x):
+        if self.upsample > 0:
+            x = F.interpolate(x, scale_factor=self.upsample, mode='nearest')
+        return self.conv2d(self.reflection_pad(x))
+
+
+# Residual block whose skip connection is a quantization-aware add
+class QuantizableResidualBlock(torch.nn.Module):
+    def __init__(self, block):
+        super(QuantizableResidualBlock, self).__init__()
+        self.conv1 = QuantizableConv(block.conv1)
+        self.in1 = copy.deepcopy(block.in1)
+        self.conv2 = QuantizableConv(block.conv2)
+        self.in2 = copy.deepcopy(block.in2)
+        self.relu = torch.nn.ReLU()
+        self.skip_add = torch.ao.nn.quantized.FloatFunctional()
+
+    def forward(self, x):
+        out = self.in2(self.conv2(self.relu(self.in1(self.conv1(x)))))
+        return self.skip_add.add(out, x)
+
+
+class QuantizableTransformerNet(torch.nn.Module):
+    """TransformerNet with quant/dequant stubs, ready for static quantization."""
+
+    def __init__(self, model):
+        super(QuantizableTransformerNet, self).__init__()
+        self.quant = tq.QuantStub()
+        self.conv1 = QuantizableConv(model.conv1)
+        self.in1 = copy.deepcopy(model.in1)
+        self.conv2 = QuantizableConv(model.conv2)
+        self.in2 = copy.deepcopy(model.in2)
+        self.conv3 = QuantizableConv(model.conv3)
+        self.in3 = copy.deepcopy(model.in3)
+        self.res = torch.nn.Sequential(*[QuantizableResidualBlock(getattr(model, f'res{i}'))
+                                         for i in range(1, 6)])
+        self.deconv1 = QuantizableConv(model.deconv1)
+        self.in4 = copy.deepcopy(model.in4)
+        self.deconv2 = QuantizableConv(model.deconv2)
+        self.in5 = copy.deepcopy(model.in5)
+        self.deconv3 = QuantizableConv(model.deconv3)
+        self.relu = torch.nn.ReLU()
+        self.dequant = tq.DeQuantStub()
+
+    def forward(self, X):
+        y = self.quant(X)
+        y = self.relu(self.in1(self.conv1(y)))
+        y = self.relu(self.in2(self.conv2(y)))
+        y = self.relu(self.in3(self.conv3(y)))
+        y = self.res(y)
+        y = self.relu(self.in4(self.deconv1(y)))
+        y = self.relu(self.in5(self.deconv2(y)))
+        return self.dequant(self.deconv3(y))
+
+
+class QuantizedStyleModel(torch.nn.Module):
+    """
+    Loaded INT8 artifact. Packed INT8 weights are not parameters, so the
+    artifact's size is exposed as nbytes for the model cache budget.
+    """
+
+    def __init__(self, module, nbytes, engine):
+        super(QuantizedStyleModel, self).__init__()
+        self.module = module
+        self.nbytes = nbytes
+        self.engine = engine
+
+    def forward(self, X):
+        return self.module(X)
+
+
+# Function returning the INT8 artifact path for a checkpoint
+def artifact_path(model_path):
+    return os.path.splitext(model_path)[0] + ARTIFACT_SUFFIX
+
+
+# Function to read calibration/evaluation images as [1, 3, H, W] tensors in [0, 255]
+# directory: Folder of content images
+# size: Longest side the images are downscaled to
+def load_sample_images(directory, size=512, limit=None):
+    images = []
+    for name in sorted(os.listdir(directory)):
+        if not name.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp', '.webp')):
+            continue
+        image = Image.open(os.path.join(directory, name)).convert('RGB')
+        image.thumbnail((size, size), Image.LANCZOS)
+        tensor = torch.from_numpy(np.asarray(image, dtype=np.float32).copy())
+        images.append(tensor.permute(2, 0, 1).unsqueeze(0))
+        if limit and len(images) >= limit:
+            break
+    return images
+
+
+# Function running static quantization on an fp32 TransformerNet
+# model: Eager fp32 TransformerNet (CPU)
+# calibration: List of input tensors observed to choose the INT8 ranges
+# Returns: Converted INT8 module (eager)
+def quantize_model(model, calibration, engine=None):
+    """Calibrate on sample inputs and convert the model to INT8."""
+    if not calibration:
+        raise ValueError('At least one calibration image is required')
+    engine = engine or default_engine()
+    torch.backends.quantized.engine = engine
+    qmodel = QuantizableTransformerNet(model.cpu()).eval()
+    qmodel.qconfig = tq.get_default_qconfig(engine)
+    # Eager-mode quantization is deprecated upstream but still the only API
+    # that quantizes InstanceNorm; keep its notices out of the report
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        tq.prepare(qmodel, inplace=True)
+        with torch.no_grad():
+            for tensor in calibration:
+                qmodel(tensor)
+        tq.convert(qmodel, inplace=True)
+    return qmodel
+
+
+# Function computing PSNR between two images in [0, 255]
+def psnr(a, b):
+    mse = torch.mean((a.clamp(0, 255) - b.clamp(0, 255)) ** 2).item()
+    return float('inf') if mse == 0 else 10 * math.log10(255.0 ** 2 / mse)
+
+
+# Function computing mean SSIM between two [N, 3, H, W] images in [0, 255]
+# Uses the standard 11x11 Gaussian window (sigma 1.5) per channel
+def ssim(a, b):
+    a = a.clamp(0, 255) / 255.0
+    b = b.clamp(0, 255) / 255.0
+    coords = torch.arange(11, dtype=torch.float32) - 5
+    g = torch.exp(-coords ** 2 / (2 * 1.5 ** 2))
+    g = g / g.sum()
+    window = (g[:, None] * g[None, :]).expand(a.shape[1], 1, 11, 11).contiguous()
+
+    def blur(x):
+        return F.conv2d(x, window, groups=x.shape[1])
+
+    mu_a, mu_b = blur(a), blur(b)
+    var_a = blur(a * a) - mu_a ** 2
+    var_b = blur(b * b) - mu_b ** 2
+    cov = blur(a * b) - mu_a * mu_b
+    c1, c2 = 0.01 ** 2, 0.03 ** 2
+    score = ((2 * mu_a * mu_b + c1) * (2 * cov + c2)) / ((mu_a ** 2 + mu_b ** 2 + c1) * (var_a + var_b + c2))
+    return score.mean().item()
+
+
+# Function comparing an INT8 model with its fp32 source on evaluation images
+# Returns: Dict with worst/mean PSNR and SSIM and both latencies (ms per image)
+def evaluate(fp32, int8, images, runs=2):
+    psnrs, ssims = [], []
+    fp32_seconds = int8_seconds = 0.0
+    with torch.no_grad():
+        # One untimed pass each so one-off setup costs are not measured
+        fp32(images[0])
+        int8(images[0])
+        for x in images:
+            start = time.perf_counter()
+            for _ in range(runs):
+                reference = fp32(x)
+            fp32_seconds += (time.perf_counter() - start) / runs
+            start = time.perf_counter()
+            for _ in range(runs):
+                output = int8(x)
+            int8_seconds += (time.perf_counter() - start) / runs
+            psnrs.append(psnr(reference, output))
+            ssims.append(ssim(reference, output))
+    return {
+        'psnr_min': min(psnrs),
+        'psnr_mean': sum(psnrs) / len(psnrs),
+        'ssim_min': min(ssims),
+        'ssim_mean': sum(ssims) / len(ssims),
+        'fp32_ms': fp32_seconds / len(images) * 1000,
+        'int8_ms': int8_seconds / len(images) * 1000,
+        'speedup': fp32_seconds / int8_seconds if int8_seconds else 0.0,
+    }
+
+
+# Function saving a converted INT8 model as a TorchScript artifact
+# Returns: Artifact path
+def save_quantized_artifact(int8, model_path, report=None, engine=None):
+    path = artifact_path(model_path)
+    meta = {'version': ARTIFACT_VERSION, 'source': source_fingerprint(model_path),
+            'engine': engine or torch.backends.quantized.engine,
+            'report': report or {}, 'torch': torch.__version__}
+    with atomic_path(path) as tmp_path, warnings.catch_warnings():
+        warnings.simplefilter('ignore', FutureWarning)
+        scripted = torch.jit.script(int8.eval())
+        torch.jit.save(scripted, tmp_path, _extra_files={'meta.json': json.dumps(meta)})
+    return path
+
+
+# Function loading the INT8 artifact for a checkpoint if present and current
+# Returns: QuantizedStyleModel, or None if there is no usable artifact
+def load_quantized_model(model_path):
+    """Load model_path's INT8 artifact (CPU), or None if missing or stale."""
+    path = artifact_path(model_path)
+    if not os.path.exists(path):
+        return None
+    extra = {'meta.json': ''}
+    try:
+        # Read the metadata first: the engine must be selected before unpacking weights
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', FutureWarning)
+            torch.jit.load(path, map_location='cpu', _extra_files=extra)
+        meta = json.loads(extra['meta.json'] or '{}')
+        if meta.get('version') != ARTIFACT_VERSION or meta.get('source') != source_fingerprint(model_path):
+            print(f"Ignoring stale INT8 artifact: {os.path.basename(path)}")
+            return None
+        engine = meta.get('engine') or default_engine()
+        if engine not in torch.backends.quantized.supported_engines:
+            print(f"INT8 artifact {os.path.basename(path)} needs the {engine} engine")
+            return None
+        torch.backends.quantized.engine = engine
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', FutureWarning)
+            module = torch.jit.load(path, map_location='cpu').eval()
+        return QuantizedStyleModel(module, os.path.getsize(path), engine)
+    except Exception as e:
+        print(f"Could not load INT8 artifact {os.path.basename(path)}: {e}")
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build INT8 style models and report their quality")
+    parser.add_argument("models", nargs='+', help="checkpoints (.pth/.model) to quantize")
+    parser.add_argument("--calibration", required=True,
+                        help="folder of sample content images")
+    parser.add_argument("--calibration-images", type=int, default=8,
+                        help="images used for calibration (the rest are used for evaluation)")
+    parser.add_argument("--eval-images", type=int, default=4,
+                        help="held-out images used to score the INT8 model")
+    parser.add_argument("--size", type=int, default=512,
+                        help="longest side of the sample images")
+    parser.add_argument("--min-ssim", type=float, default=DEFAULT_MIN_SSIM,
+                        help="minimum worst-case SSIM against fp32 to save the INT8 model")
+    parser.add_argument("--report", help="write the per-style report to this JSON file")
+    args = parser.parse_args()
+
+    torch.backends.quantized.engine = default_engine()
+    samples = load_sample_images(args.calibration, args.size,
+                                 args.calibration_images + args.eval_images)
+    calibration = samples[:args.calibration_images]
+    evaluation = samples[args.calibration_images:] or samples[:1]
+    print(f"Engine {torch.backends.quantized.engine}: {len(calibration)} calibration, "
+          f"{len(evaluation)} evaluation images")
+
+    report = {}
+    for model_path in args.models:
+        name = os.path.splitext(os.path.basename(model_path))[0]
+        fp32 = load_eager_model(model_path)
+        int8 = quantize_model(fp32, calibration)
+        result = evaluate(fp32, int8, evaluation)
+        result['safe'] = result['ssim_min'] >= args.min_ssim
+        report[name] = result
+
+        if result['safe']:
+            path = save_quantized_artifact(int8, model_path, result)
+            verdict = f"saved {os.path.basename(path)}"
+        else:
+            # Remove an older artifact so the style is served in fp32
+            if os.path.exists(artifact_path(model_path)):
+                os.remove(artifact_path(model_path))
+            verdict = "kept fp32 (below --min-ssim)"
+        print(f"{name}: {result['speedup']:.2f}x faster "
+              f"({result['fp32_ms']:.0f} -> {result['int8_ms']:.0f} ms), "
+              f"SSIM min {result['ssim_min']:.4f}, PSNR min {result['psnr_min']:.1f} dB: {verdict}")
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
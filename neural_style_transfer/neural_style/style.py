@@ -30,13 +30,21 @@ import utils
 from transformer_net import TransformerNet
 # Import Vgg16 (not used in this file but kept for compatibility)
 from vgg import Vgg16
+# Import the shared, memory-budgeted model cache
+from model_cache import style_model_cache
+# Import the loader for frozen inference artifacts (saved next to the .pth)
+from inference_build import load_inference_model
+# Import bfloat16 execution helpers (enabled with STYLE_BF16=1)
+from mixed_precision import BF16_ENABLED, enable_bf16, forward
+# Import the memory-mapped weight files (written by mmap_weights.py)
+from mmap_weights import load_mmap_model
 
 # Determine computation device: use CUDA if available, otherwise CPU
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-# Global model cache to avoid reloading models multiple times
-# Key: model path, Value: loaded model instance
-_cached_models = {}
+# Shared model cache to avoid reloading models multiple times
+# Key: model path, Value: loaded model instance (LRU, bounded by STYLE_CACHE_MAX_MB)
+_cached_models = style_model_cache
 
 # Function to load a pre-trained style transfer model from disk
 # model_path: Path to the saved model checkpoint file
@@ -63,6 +71,17 @@ def load_model(model_path):
         style_model.eval()
     return style_model
 
+# Function choosing how a model is loaded for the shared cache
+# bfloat16 mode converts the eager model; otherwise the frozen artifact is preferred,
+# then the mapped weights file, then the checkpoint
+def _load_cached_model(model_path):
+    if BF16_ENABLED and device.type == 'cpu':
+        style_model = load_mmap_model(model_path, device) or load_model(model_path)
+        enable_bf16(style_model)
+        return style_model
+    return (load_inference_model(model_path, device) or load_mmap_model(model_path, device)
+            or load_model(model_path))
+
 # Function to apply style transfer to a content image using a loaded model
 # style_model: Pre-loaded TransformerNet model instance
 # content_image: Path to the input content image file
@@ -83,8 +102,8 @@ def stylize(style_model, content_image, output_image):
 
     # Run inference without computing gradients (saves memory)
     with torch.no_grad():
-        # Forward pass: apply style transfer
-        output = style_model(content_image).cpu()
+        # Forward pass: apply style transfer (bfloat16 if enabled for this model)
+        output = forward(style_model, content_image).cpu()
     # Save stylized output image to file
     utils.save_image(output_image, output[0])
 
@@ -158,16 +177,9 @@ def transfer(content_file, style_file):
         # Construct full path to model file
         model_path = os.path.join(models_dir, model_file)
         
-        # Load model (with caching to avoid reloading same model multiple times)
-        if model_path not in _cached_models:
-            print(f"Loading style model: {model_file}")
-            # Load and cache the model
-            _cached_models[model_path] = load_model(model_path)
-        else:
-            print(f"Using cached model: {model_file}")
-        
-        # Get model from cache
-        style_model = _cached_models[model_path]
+        # Load model (cached; concurrent first requests share a single load)
+        print(f"Using style model: {model_file}")
+        style_model = _cached_models.get_or_load(model_path, lambda: _load_cached_model(model_path))
         
         # Generate unique output file path
         output_path = os.path.join(output_dir, f'stylized_{timestamp}.jpg')